@@ -0,0 +1,34 @@
+"""
+Microbenchmark for the cost of TickClock.advance() when the frame limiter is off, which is the overhead that the clock
+adds to every tick on top of any sleeping.
+
+Run from the repository root with:
+
+	python benchmarks/bench_clock.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pytelegrafhttp import clock  # noqa: E402
+
+
+def main():
+	number = 20000
+	tc = clock.TickClock(limiter_enabled=False).start(60)
+	best = min(timeit.repeat(tc.advance, number=number, repeat=5))
+	print("TickClock.advance(): {:.2f} us per call".format(best / number * 1000000))
+
+	section = clock._CriticalSection()
+
+	def enter_exit():
+		with section:
+			pass
+	best = min(timeit.repeat(enter_exit, number=number, repeat=5))
+	print("_CriticalSection enter/exit: {:.2f} us per call".format(best / number * 1000000))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,80 @@
+"""
+Benchmark for extracting the client metrics from large H@H pages, comparing row-by-row value conversion with
+column-batched conversion, and the peak memory used when all bursts are collected into a list against when they
+are consumed one at a time as they are streamed. Pages are generated with the same helper that the endpoint tests use.
+
+Run from the repository root with:
+
+	python benchmarks/bench_extraction.py
+"""
+import os
+import re
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pytelegrafhttp import scrape, util  # noqa: E402
+from pytelegrafhttp.endpoint import Endpoint  # noqa: E402
+from pytelegrafhttp.tests.endpoint_test import _client_stats_metric, _create_body_text  # noqa: E402
+
+
+def _named_metric(extraction):
+	metric = dict(_client_stats_metric, extraction=extraction)
+	metric['values'] = scrape.parse_config_metric_values([
+		{'name': 'online', 'conversion': 'online-within:5m', 'type': 'CAPTURE-3'},
+		{'name': 'files', 'conversion': 'int-commas', 'type': 'CAPTURE-4'},
+		{'name': 'trust', 'conversion': 'int', 'type': 'CAPTURE-5'},
+		{'name': 'quality', 'conversion': 'int', 'type': 'CAPTURE-6'},
+		{'name': 'hitrate', 'conversion': 'float', 'type': 'CAPTURE-7'},
+		{'name': 'hathrate', 'conversion': 'float', 'type': 'CAPTURE-8'}
+	], '')
+	return metric
+
+
+def _peak_memory(func):
+	tracemalloc.start()
+	try:
+		func()
+		return tracemalloc.get_traced_memory()[1]
+	finally:
+		tracemalloc.stop()
+
+
+def _consume(bursts):
+	for _ in bursts:
+		pass
+
+
+def main():
+	endpoint = Endpoint('/fancomicsathome.php', re.compile('F@H Miss% shows the percentage of requests'))
+	cases = [
+		('lambda converters, row', dict(_client_stats_metric, extraction='row')),
+		('named converters, row', _named_metric('row')),
+		('named converters, column', _named_metric('column')),
+	]
+	for rows in (1000, 10000):
+		# last-seen times are spread over a whole day, so that no more than 1440 rows have the same one
+		clients = [
+			dict(
+				id=str(i), name='client' + str(i), files=1000 + i, hitrate=i % 7 / 10.0,
+				last_seen='Today, {:d}:{:02d}'.format(*divmod(i % 1440, 60))
+			) for i in range(rows)
+		]
+		text = _create_body_text(*clients)
+		number = 10 if rows <= 1000 else 2
+		print(str(rows) + " rows:")
+		with util.tick_time(util.current_time()):
+			for name, metric in cases:
+				best = min(timeit.repeat(lambda: endpoint.scrape_metric(metric, text), number=number, repeat=7))
+				print("  {:<28s} {:8.2f} ms".format(name, best / number * 1000))
+			metric = _named_metric('row')
+			listed = _peak_memory(lambda: endpoint.scrape_metric(metric, text))
+			streamed = _peak_memory(lambda: _consume(endpoint.iter_metric(metric, text)))
+			print("  {:<28s} {:8.1f} KiB".format('peak memory, list', listed / 1024.0))
+			print("  {:<28s} {:8.1f} KiB".format('peak memory, streamed', streamed / 1024.0))
+
+
+if __name__ == '__main__':
+	main()
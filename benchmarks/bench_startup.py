@@ -0,0 +1,54 @@
+"""
+Benchmark for loading the config at start-up by executing, parsing, and linting it against loading it from its
+snapshot. The example config is used, with a large recorded page given as the sample page of its endpoint so that
+linting times its regexes against it the way a production config would.
+
+Run from the repository root with:
+
+	python benchmarks/bench_startup.py
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pytelegrafhttp import pytelegrafhttp, snapshot  # noqa: E402
+from pytelegrafhttp.tests.endpoint_test import _create_body_text  # noqa: E402
+
+_RUNS = 20
+
+
+def _time_load(path, remove_snapshot):
+	best = None
+	for _ in range(_RUNS):
+		if remove_snapshot and os.path.exists(snapshot.get_snapshot_path(path)):
+			os.remove(snapshot.get_snapshot_path(path))
+		start = time.perf_counter()
+		pytelegrafhttp._parsed_config_from_path(path)
+		elapsed = time.perf_counter() - start
+		best = elapsed if best is None else min(best, elapsed)
+	return best
+
+
+def main():
+	with tempfile.TemporaryDirectory() as tmp:
+		path = os.path.join(tmp, 'config.py')
+		sample = os.path.join(tmp, 'sample.html')
+		clients = [dict(id=str(i), name='client' + str(i), files=1000 + i) for i in range(2000)]
+		with open(sample, 'w', encoding='utf-8') as fp:
+			fp.write(_create_body_text(*clients))
+		shutil.copyfile(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'config.example.py'), path)
+		with open(path, 'a') as fp:
+			fp.write("\nscraper_endpoints[0]['sample-page'] = " + repr(sample) + "\n")
+
+		cold = _time_load(path, True)
+		print("  {:<20s} {:8.2f} ms".format('parse and lint', cold * 1000))
+		warm = _time_load(path, False)
+		print("  {:<20s} {:8.2f} ms".format('snapshot', warm * 1000))
+
+
+if __name__ == '__main__':
+	main()
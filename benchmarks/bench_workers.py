@@ -0,0 +1,65 @@
+"""
+Benchmark for extracting the metrics of a large H@H page in-process against extracting them with a pool of worker
+processes. The page has several metrics over the same client table, so that there is work for more than one core.
+
+Run from the repository root with:
+
+	python benchmarks/bench_workers.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pytelegrafhttp import scrape, util, workers  # noqa: E402
+from pytelegrafhttp.endpoint import Endpoint  # noqa: E402
+from pytelegrafhttp.tests.endpoint_test import _create_body_text  # noqa: E402
+
+
+def _metric(name, value_group):
+	return {
+		'dest': 'hath-health',
+		'name': name,
+		'regex': [
+			r'<tr>\s*<td><a [^>]*>([^<]+)</a></td>\s*<td>([^<]+)</td>\s*<td [^>]*>Online</td>\s*',
+			r'<td>[^<]*</td>\s*<td>([^<]*)</td>\s*<td>([^<]+)</td>\s*<td [^>]*>[^<]+</td>\s*',
+			r'<td>[^<]*</td>\s*<td>[^<]*</td>\s*<td>[^<]*</td>\s*<td [^>]*>([^<]+)</td>\s*<td>([^<]+)</td>'
+		],
+		'values': [{'name': 'v', 'conversion': 'int-commas', 'type': 'CAPTURE-' + str(value_group)}],
+		'tags': {'host': 'CAPTURE-1'}
+	}
+
+
+def main():
+	endpoints = scrape.parse_config_endpoints([{
+		'endpoint': '/fancomicsathome.php',
+		'verify-pattern': 'F@H Miss% shows the percentage of requests',
+		'metrics': [_metric('files', 4), _metric('trust', 5), _metric('quality', 6), _metric('client-id', 2)]
+	}], '', lint_mode='off')
+	ep = endpoints[0]
+	metrics = ep['metrics']
+	clients = [dict(id=str(i), name='client' + str(i), files=1000 + i) for i in range(20000)]
+	text = _create_body_text(*clients)
+	in_process = Endpoint(ep['endpoint'], ep['verify-pattern'])
+
+	with util.tick_time(util.current_time()):
+		start = time.perf_counter()
+		expected = in_process.scrape_all_metrics(metrics, text)
+		print("  {:<20s} {:8.1f} ms".format('in-process', (time.perf_counter() - start) * 1000))
+		for count in (2, 4):
+			pool = workers.ExtractionPool(count, 60)
+			pool.start(endpoints, None, 3)
+			pooled = Endpoint(ep['endpoint'], ep['verify-pattern'])
+			# warm up, so that worker start-up is not counted
+			pool.submit(0, pooled, metrics, text).bursts()
+			start = time.perf_counter()
+			actual = pool.submit(0, pooled, metrics, text).bursts()
+			elapsed = time.perf_counter() - start
+			pool.shutdown()
+			assert actual == expected
+			print("  {:<20s} {:8.1f} ms".format(str(count) + ' workers', elapsed * 1000))
+
+
+if __name__ == '__main__':
+	main()
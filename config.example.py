@@ -1,5 +1,3 @@
-from pytelegrafhttp.util import check_online
-
 # Global default install directory for all files. Note that each specific file / directory may override where it is
 # located, but by default they are all grouped together
 install_dir = '/etc/pytelegrafhttp'
@@ -8,14 +6,27 @@ install_dir = '/etc/pytelegrafhttp'
 # ENVIRONMENT #
 ###############
 
-# Directory for files for use with daemon communication
+# Directory for files for use with daemon communication. A running scraper listens for the commands of 'stop',
+# 'reload-config', 'status', 'stats', and 'flush' on a unix socket named after its PID in this directory.
 env_daemon_files_dir = install_dir + '/daemon'
 
-# file to save cookies in
+# SQLite database to save cookies, login state, the last collection, and the last values sent in. Only values that
+# changed since the last save are written. A state file from an older version that was pickled is imported and moved
+# aside to the same path with '.bak' added.
+env_state_file = install_dir + '/state.db'
+
+# file that older versions saved cookies in. Only read to import the cookies when the state database has none; can be
+# left out.
 env_cookies_file = install_dir + '/cookies.pkl'
 
-# file to save general program state in
-env_state_file = install_dir + '/state.pkl'
+# Whether to keep a snapshot of this config, already parsed and checked, in the __pycache__ directory next to it. While
+# this file, the sample pages it names, and the scraper itself are unchanged, starting and reloading use the snapshot
+# instead of running this file and parsing and linting it again, so regex lint warnings are only logged the first time.
+# Only set to True if this file does not read anything that can change without the file itself changing, such as
+# environment variables or other files, as the values in the snapshot would be used instead. The snapshot holds every
+# value in this file, including the password, and is only readable by its owner. A config with lambda conversions is
+# never snapshotted.
+env_config_snapshot = False
 
 # How often the system should save state. Given in terms of 'ticks', where one tick is equal to the time of the
 # time_collection_interval
@@ -28,9 +39,17 @@ env_state_file = install_dir + '/state.pkl'
 # How often metrics are collected. Measured in seconds.
 time_collection_interval = 60
 
+# What to do when collecting metrics takes so long that the next collection should already have started, such as when
+# a slow re-login happens. 'skip' drops the collections that were missed and waits until the next one is due,
+# 'catch-up' runs each missed collection back-to-back until back on schedule, and 'rephase' runs the next collection
+# immediately and schedules all later ones relative to it. The policy is applied to each endpoint's own schedule, so an
+# endpoint that is collected less often than others only misses collections when its own are overrun.
+time_overrun_policy = 'skip'
+
 # How often to save the state. Given in terms of time_collection_interval variable, so putting 10 here indicates that
-# the state should be saved after every 10th data collection.
-time_save_frequencey = 10
+# the state should be saved once 10 collection intervals have passed since it was last saved. This is measured in time
+# rather than counted in collections, as endpoints with their own 'interval' make collections unevenly spaced.
+time_save_frequency = 10
 
 
 ###########
@@ -81,6 +100,8 @@ scraper_host = 'e-fancomics.org'
 scraper_username = 'username'
 scraper_password = 'password'
 scraper_use_ssl = True
+# The form extracted by 'resp-extract' is remembered, and later logins submit it straight away, skipping the steps
+# before 'submit-form'. The full steps are only run again if that login fails verification.
 scraper_login_steps = [
 	('attempt', {'endpoint': '/fancomicsathome.php'}),
 	('resp-extract', {'type': 'form-vars', 'inject': {'UserName': 'username', 'PassWord': 'password'}}),
@@ -89,6 +110,12 @@ scraper_login_steps = [
 	('verify', {'pattern': 'F@H Miss% shows the percentage of requests'})
 ]
 scraper_logged_out_pattern = 'requires you to log on.</p>'
+
+# At startup, saved cookies are checked with a single request before deciding whether to log in. The page is checked
+# against scraper_logged_out_pattern and the probe's 'verify-pattern', which can be left out if 'endpoint' is one of
+# scraper_endpoints to use that endpoint's pattern. If the page is an endpoint, the first collection uses it instead of
+# requesting it again. Defaults to the first endpoint; set to None to trust the saved state without checking.
+scraper_session_probe = {'endpoint': '/fancomicsathome.php'}
 scraper_bot_kicked_pattern = 'banned for excessive pageloads which indicates'
 scraper_telegraf_destinations = {
 	'hath-net': {
@@ -101,82 +128,108 @@ scraper_telegraf_destinations = {
 	}
 }
 
+# Telegraf destination to send statistics on the operation of the scraper to, such as tick lateness and the amount of
+# work shed. Must be one of the destinations in scraper_telegraf_destinations. Set to None to not send statistics.
+# Endpoints with the same URI only download the page once per collection; the number of downloads that were shared is
+# sent as 'request-cache-hits'. When the session expires partway through a collection, the scraper logs in again and
+# carries on if there is time left; the number of times this happened is sent as 'relogins', and how long the most
+# recent one took as 'relogin-seconds'. Between collections, the scraper also logs in ahead of time when the session
+# cookies or the length of past sessions show that the session will expire before the next collection is done; these
+# are counted in 'keepalive-logins'.
+scraper_stats_destination = None
+
+# When collection falls behind schedule, endpoints, metrics, and metric values are shed until it is back on schedule.
+# Anything with a 'priority' below scraper_shed_priority is shed (priority defaults to 0 when not given, and higher
+# numbers are more important). Endpoints are shed if their measured time to scrape does not fit in what is left of the
+# collection interval, while metrics and values are still collected every scraper_shed_cadence collections so that they
+# do not go completely dark.
+scraper_shed_priority = 0
+scraper_shed_cadence = 5
+
+# Endpoint regexes are checked when the config is loaded for constructs that are likely to make scraping slow: nested
+# quantifiers such as '(a+)+', an unanchored '.*' at the start of a pattern, and adjacent quantifiers that can match
+# the same characters such as '\s*\s+'. If an endpoint gives a 'sample-page', the path of a saved copy of its page,
+# each of its metric regexes is also timed against it and must take no longer than scraper_regex_time_budget seconds.
+# Set scraper_regex_lint to 'warn' to log problems, 'refuse' to not load a config with problems, or 'off' to not check.
+scraper_regex_lint = 'warn'
+scraper_regex_time_budget = 0.1
+
+# The longest that extracting any one metric from a page may take, in seconds. A metric can give its own 'time-budget'
+# to override this. A metric that goes over its budget is skipped for that collection, and one that goes over it
+# scraper_metric_max_overruns times in a row is disabled until the config is reloaded. Set to None to not limit
+# metrics that do not give their own budget.
+#
+# A metric that is over its budget sends nothing rather than part of its rows, so every row of a metric with a budget
+# is extracted before any are sent. Metrics without one are sent row by row as they are extracted, which keeps the
+# memory used by large pages low. Only give a budget if a metric's regex could run away on an unexpected page.
+scraper_metric_time_budget = None
+scraper_metric_max_overruns = 3
+
+# Number of worker processes to extract metrics from pages with, so that large pages, and the metrics of several
+# endpoints, can be extracted on more than one core. Each metric of a page is extracted separately. Set to 0 to extract
+# in the main process. Workers can only be used when every 'conversion' is a built-in converter name, a type such as
+# int, or a function defined at the top level of an importable module; a config with lambda conversions is extracted
+# in the main process. If the metrics of a page are not all extracted within scraper_extraction_timeout seconds, the
+# rest are skipped and the workers are restarted.
+scraper_extraction_workers = 0
+scraper_extraction_timeout = 30.0
+
+# Each endpoint is scraped every 'interval' seconds, starting 'offset' seconds after the scraper starts. Both are
+# optional; 'interval' defaults to time_collection_interval and 'offset' defaults to 0. Slowly-changing pages can be
+# given a longer interval than the rest to reduce the number of requests made.
+#
+# An endpoint can divide its page into named 'sections', each found between a 'start' pattern and an optional 'end'
+# pattern (without one, the section runs to the end of the page). A metric with a 'section' only searches that part of
+# the page. When the text of a section has not changed since the last collection, the metrics in it reuse the values
+# from then instead of being scraped again; metrics that use a function conversion or a time-dependent converter such
+# as 'online-within' are always scraped again.
+#
+# Metrics that differ only in one part of their regex can be written once with a 'template'. The 'placeholder' text in
+# the regex is replaced by a match of any of the 'instances' (matched as plain text, not as regexes), and the 'tags' of
+# whichever instance matched are added to the metric's tags. All of the instances are searched for in a single pass
+# over the page. Captures are numbered as if the placeholder were not there.
+#
+# Each metric value gives the 'conversion' used to turn the captured text into a value. This is either the name of a
+# built-in converter or a function that takes the captured text. Built-in converters are preferred, as they are faster
+# and can be cached. They are:
+#   'int', 'float'                - plain numbers, such as '612' or '2.45'
+#   'int-commas', 'float-commas'  - numbers with thousands separators, such as '61,234'
+#   'percent'                     - a number with an optional percent sign, such as '2.45 %'
+#   'per-min', 'per-day'          - a rate with an optional unit, such as '2.6 / min'
+#   'online-within:5m'            - 1 if a last-seen time such as 'Today, 12:30' is within the given duration, and 0
+#                                   otherwise. The duration is a number followed by 's', 'm', or 'h'.
+# Values with a 'type' of 'VALUE' use the conversion as the value itself.
+#
+# A metric with an 'extraction' of 'column' has every match of its regex found in one pass, and each captured column is
+# then converted at once rather than row by row. This only makes a difference with the built-in converters, and only on
+# pages with many rows, such as the H@H client list of an account with many clients. 'extraction' defaults to 'row'.
 scraper_endpoints = []
 scraper_endpoints.append({
 	'endpoint': '/fancomicsathome.php',
 	'verify-pattern': 'F@H Miss% shows the percentage of requests',
+	'interval': 60,
+	'offset': 0,
+	'sections': {
+		'network': {'start': r'<th>F@H Region</th>', 'end': r'</table>'},
+		'clients': {'start': r'Your Active Clients'}
+	},
 	'metrics': [
 		{
 			'dest': 'hath-net',  # destination db / telegraf identifier
 			'name': 'hath-net',  # metrics name
+			'section': 'network',  # only search the network load table
+			# one metric for every region; '{region}' in the regex is matched against each instance's 'match' text
+			'template': {
+				'placeholder': '{region}',
+				'instances': [
+					{'match': 'North and South America', 'tags': {'region': 'americas'}},
+					{'match': 'Europe and South America', 'tags': {'region': 'europe-africa'}},
+					{'match': 'Asia and Oceania', 'tags': {'region': 'asia-oceania'}},
+					{'match': 'Global', 'tags': {'region': 'global'}}
+				]
+			},
 			'regex': [
-				r'<td>North and South America</td>\s*',
-				r'<td [^>]*>[^ ]+ Gbit/s</td>\s*',
-				r'<td [^>]*>=</td>\s*',
-				r'<td [^>]*>([^ ]+) MB/s</td>\s*',
-				r'<td [^>]*>([^ ]+) %</td>\s*',
-				r'<td [^>]*>([^<]+)</td>\s*',
-				r'<td [^>]*>([^<]+)</td>\s*',
-				r'<td [^>]*>([^<]+)</td>',
-			],
-			'values': [
-				{'name': 'load', 'conversion': int, 'type': 'CAPTURE-1'},
-				{'name': 'miss-rate', 'conversion': float, 'type': 'CAPTURE-2'},
-				{'name': 'coverage', 'conversion': float, 'type': 'CAPTURE-3'},
-				{'name': 'hits-per-gb', 'conversion': float, 'type': 'CAPTURE-4'},
-				{'name': 'quality', 'conversion': int, 'type': 'CAPTURE-5'}
-			],
-			'tags': {'region': 'americas'}
-		},
-		{
-			'dest': 'hath-net',
-			'name': 'hath-net',
-			'regex': [
-				r'<td>Europe and South America</td>\s*',
-				r'<td [^>]*>[^ ]+ Gbit/s</td>\s*',
-				r'<td [^>]*>=</td>\s*',
-				r'<td [^>]*>([^ ]+) MB/s</td>\s*',
-				r'<td [^>]*>([^ ]+) %</td>\s*',
-				r'<td [^>]*>([^<]+)</td>\s*',
-				r'<td [^>]*>([^<]+)</td>\s*',
-				r'<td [^>]*>([^<]+)</td>',
-			],
-			'values': [
-				{'name': 'load', 'conversion': int, 'type': 'CAPTURE-1'},
-				{'name': 'miss-rate', 'conversion': float, 'type': 'CAPTURE-2'},
-				{'name': 'coverage', 'conversion': float, 'type': 'CAPTURE-3'},
-				{'name': 'hits-per-gb', 'conversion': float, 'type': 'CAPTURE-4'},
-				{'name': 'quality', 'conversion': int, 'type': 'CAPTURE-5'}
-			],
-			'tags': {'region': 'europe-africa'}
-		},
-		{
-			'dest': 'hath-net',
-			'name': 'hath-net',
-			'regex': [
-				r'<td>Asia and Oceania</td>\s*',
-				r'<td [^>]*>[^ ]+ Gbit/s</td>\s*',
-				r'<td [^>]*>=</td>\s*',
-				r'<td [^>]*>([^ ]+) MB/s</td>\s*',
-				r'<td [^>]*>([^ ]+) %</td>\s*',
-				r'<td [^>]*>([^<]+)</td>\s*',
-				r'<td [^>]*>([^<]+)</td>\s*',
-				r'<td [^>]*>([^<]+)</td>',
-			],
-			'values': [
-				{'name': 'load', 'conversion': int, 'type': 'CAPTURE-1'},
-				{'name': 'miss-rate', 'conversion': float, 'type': 'CAPTURE-2'},
-				{'name': 'coverage', 'conversion': float, 'type': 'CAPTURE-3'},
-				{'name': 'hits-per-gb', 'conversion': float, 'type': 'CAPTURE-4'},
-				{'name': 'quality', 'conversion': int, 'type': 'CAPTURE-5'}
-			],
-			'tags': {'region': 'asia-oceania'}
-		},
-		{
-			'dest': 'hath-net',
-			'name': 'hath-net',
-			'regex': [
-				r'<td>Global</td>\s*',
+				r'<td>{region}</td>\s*',
 				r'<td [^>]*>[^ ]+ Gbit/s</td>\s*',
 				r'<td [^>]*>=</td>\s*',
 				r'<td [^>]*>([^ ]+) MB/s</td>\s*',
@@ -186,17 +239,19 @@ scraper_endpoints.append({
 				r'<td [^>]*>([^<]+)</td>',
 			],
 			'values': [
-				{'name': 'load', 'conversion': int, 'type': 'CAPTURE-1'},
-				{'name': 'miss-rate', 'conversion': float, 'type': 'CAPTURE-2'},
-				{'name': 'coverage', 'conversion': float, 'type': 'CAPTURE-3'},
-				{'name': 'hits-per-gb', 'conversion': float, 'type': 'CAPTURE-4'},
-				{'name': 'quality', 'conversion': int, 'type': 'CAPTURE-5'}
+				{'name': 'load', 'conversion': 'int', 'type': 'CAPTURE-1'},
+				{'name': 'miss-rate', 'conversion': 'float', 'type': 'CAPTURE-2'},
+				{'name': 'coverage', 'conversion': 'float', 'type': 'CAPTURE-3'},
+				{'name': 'hits-per-gb', 'conversion': 'float', 'type': 'CAPTURE-4'},
+				{'name': 'quality', 'conversion': 'int', 'type': 'CAPTURE-5'}
 			],
-			'tags': {'region': 'global'}
+			'tags': {}
 		},
 		{
 			'dest': 'hath-client-net-stats',
 			'name': 'hath-health',
+			'section': 'clients',
+			'extraction': 'column',  # one row per H@H client, so convert whole columns at once
 			'regex': [
 				r'<tr>\s*',
 				r'<td><a [^>]*>([^<]+)</a></td>\s*',
@@ -215,12 +270,17 @@ scraper_endpoints.append({
 				r'<td>([^ ]+) / day</td>\s*',
 			],
 			'values': [
-				{'name': 'online', 'conversion': lambda last: check_online(last, max_minutes=5), 'type': 'CAPTURE-3'},
-				{'name': 'files', 'conversion': lambda x: int(x.replace(',', '')), 'type': 'CAPTURE-4'},
-				{'name': 'trust', 'conversion': int, 'type': 'CAPTURE-5'},
-				{'name': 'quality', 'conversion': int, 'type': 'CAPTURE-6'},
-				{'name': 'hitrate', 'conversion': float, 'type': 'CAPTURE-7'},
-				{'name': 'hathrate', 'conversion': float, 'type': 'CAPTURE-8'}
+				{
+					'name': 'online',
+					'conversion': 'online-within:5m',
+					'type': 'CAPTURE-3',
+					'priority': -1  # checking this is expensive, so let it be shed first
+				},
+				{'name': 'files', 'conversion': 'int-commas', 'type': 'CAPTURE-4'},
+				{'name': 'trust', 'conversion': 'int', 'type': 'CAPTURE-5'},
+				{'name': 'quality', 'conversion': 'int', 'type': 'CAPTURE-6'},
+				{'name': 'hitrate', 'conversion': 'float', 'type': 'CAPTURE-7'},
+				{'name': 'hathrate', 'conversion': 'float', 'type': 'CAPTURE-8'}
 			],
 			'tags': {
 				'host': 'CAPTURE-1',
@@ -230,6 +290,7 @@ scraper_endpoints.append({
 		{
 			'dest': 'hath-client-net-stats',
 			'name': 'hath-health',
+			'section': 'clients',
 			'regex': [
 				r'<tr>\s*',
 				r'<td><a [^>]*>([^<]+)</a></td>\s*',
@@ -242,12 +303,53 @@ scraper_endpoints.append({
 			],
 			'values': [
 				{'name': 'online', 'conversion': 0, 'type': 'VALUE'},
-				{'name': 'files', 'conversion': lambda x: int(x.replace(',', '')), 'type': 'CAPTURE-3'}
+				{'name': 'files', 'conversion': 'int-commas', 'type': 'CAPTURE-3'}
 			],
 			'tags': {
 				'host': 'CAPTURE-1',
 				'client-id': 'CAPTURE-2',
 			}
 		}
+	],
+	# Aggregations are computed over all of the metrics scraped from the endpoint in a single collection and are sent
+	# as additional metrics. 'source' is the name of the metric to aggregate, 'group-by' is a list of tag names to group
+	# on (leave empty to aggregate everything into one metric), and each value gives the 'field' of the source metric
+	# to aggregate along with the 'function' to use. Supported functions are 'sum', 'count', 'min', 'max', 'mean', and
+	# percentiles given as 'p' followed by the percentile, such as 'p50' or 'p95'. Set 'drop-source' to True to only
+	# send the aggregated metrics and not the individual metrics they were created from.
+	'aggregations': [
+		{
+			'dest': 'hath-client-net-stats',
+			'name': 'hath-fleet',
+			'source': 'hath-health',
+			'group-by': [],
+			'values': [
+				{'name': 'clients', 'field': 'files', 'function': 'count'},
+				{'name': 'online', 'field': 'online', 'function': 'sum'},
+				{'name': 'files', 'field': 'files', 'function': 'sum'},
+				{'name': 'quality-mean', 'field': 'quality', 'function': 'mean'},
+				{'name': 'quality-min', 'field': 'quality', 'function': 'min'},
+				{'name': 'quality-max', 'field': 'quality', 'function': 'max'},
+				{'name': 'hitrate', 'field': 'hitrate', 'function': 'sum'}
+			],
+			'tags': {},
+			'drop-source': False
+		}
 	]
 })
+
+# To scrape more than one site or account from the same scraper, list each one as a target. Each target gives a
+# 'name' along with any of the following keys, which it then has its own value for; every key that it does not give is
+# taken from the rest of this config:
+#   scraper_use_ssl, scraper_host, scraper_username, scraper_password, scraper_login_steps,
+#   scraper_logged_out_pattern, scraper_bot_kicked_pattern, scraper_endpoints, scraper_session_probe,
+#   scraper_regex_lint, scraper_regex_time_budget, env_state_file, env_cookies_file
+# Every target has its own session and state file. A target that does not give env_state_file uses env_state_file with
+# '-' and the target's name added before the extension, such as 'state-alt.db'. The telegraf destinations, extraction
+# workers, and schedule are shared by all targets, so give the metrics of different targets different names or tags.
+# Statistics are sent separately for each target with a 'target' tag. Leave this out to scrape only the site and
+# account given above.
+# scraper_targets = [
+# 	{'name': 'main'},
+# 	{'name': 'alt', 'scraper_username': 'other-username', 'scraper_password': 'other-password'}
+# ]
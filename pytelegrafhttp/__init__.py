@@ -1,7 +1,9 @@
 import argparse
 import logging
 import sys
-from .pytelegrafhttp import start, stop, reload
+import json
+from .pytelegrafhttp import start, stop, reload, control
+from . import daemon
 
 _log = logging.getLogger('pytelegrafhttp')  # explicitly give package here so we don't end up getting '__main__'
 _log.setLevel(logging.DEBUG)
@@ -55,10 +57,29 @@ def _parse_cli_and_run():
 	rel_parser.add_argument('--config', help="Use the specified config file.", default='config.py')
 	rel_parser.set_defaults(func=lambda ns: reload(ns.pid, ns.config))
 
+	# STATUS, STATS, FLUSH
+	query_cmds = [
+		('status', daemon.COMMAND_STATUS, "Show the current tick and activity of a metrics scraper."),
+		('stats', daemon.COMMAND_STATS, "Show the operation statistics of a metrics scraper."),
+		('flush', daemon.COMMAND_FLUSH, "Save the state of a metrics scraper now.")
+	]
+	for name, command, desc in query_cmds:
+		query_parser = subparsers.add_parser(name, help=desc, description=desc)
+		""":type : argparse.ArgumentParser"""
+		query_parser.add_argument('pid', type=int, help='PID of scraper to query.')
+		query_parser.add_argument('--config', help="Use the specified config file.", default='config.py')
+		query_parser.set_defaults(func=lambda ns, cmd=command: _print_response(control(ns.pid, cmd, ns.config)))
+
 	args = parser.parse_args()
 	args.func(args)
 
 
+def _print_response(response):
+	print("Status: " + daemon.describe_status(response['status']))
+	if 'result' in response:
+		print(json.dumps(response['result'], indent=2, sort_keys=True))
+
+
 class _ExactLevelFilter(object):
 	"""
 	Only allows log records through that are particular levels.
@@ -0,0 +1,168 @@
+"""
+In-process aggregation of metric bursts. Used to reduce per-row metrics (such as one burst per H@H client) into a small
+number of fleet-wide measurements before they are sent to telegraf.
+"""
+import logging
+import math
+from .endpoint import Burst
+
+_log = logging.getLogger(__name__)
+_log.setLevel(logging.DEBUG)
+
+
+def percentile(values, pct):
+	"""
+	Gets a percentile of a set of values using linear interpolation between the closest ranks.
+
+	:type values: ``list[float]``
+	:param values: The values to get the percentile of. Must already be sorted in ascending order and must not be
+	empty.
+	:type pct: ``float``
+	:param pct: The percentile to get, from 0 to 100 inclusive.
+	:rtype: ``float``
+	:return: The value at the given percentile.
+	"""
+	if len(values) == 1:
+		return values[0]
+	rank = (pct / 100.0) * (len(values) - 1)
+	lower = int(math.floor(rank))
+	upper = int(math.ceil(rank))
+	if lower == upper:
+		return values[lower]
+	return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+def apply_function(func, values):
+	"""
+	Applies an aggregation function to a list of values.
+
+	:type func: ``dict[str, Any]``
+	:param func: The parsed aggregation function, as created by parse_config_aggregations().
+	:type values: ``list[int|float]``
+	:param values: The values to aggregate. Must not be empty.
+	:rtype: ``int|float``
+	:return: The aggregated value.
+	"""
+	func_type = func['type']
+	if func_type == 'sum':
+		return sum(values)
+	elif func_type == 'count':
+		return len(values)
+	elif func_type == 'min':
+		return min(values)
+	elif func_type == 'max':
+		return max(values)
+	elif func_type == 'mean':
+		return sum(values) / float(len(values))
+	elif func_type == 'percentile':
+		return percentile(sorted(values), func['percentile'])
+	else:
+		# should be caught during config parsing, but double-check
+		raise ValueError("Bad aggregation function type: " + repr(func_type))
+
+
+class _Aggregator(object):
+	"""
+	Collects the values of a single aggregation from bursts one at a time, so that the bursts themselves do not need to
+	be kept.
+	"""
+
+	def __init__(self, aggregation):
+		self.aggregation = aggregation
+		# group values by the tags being grouped on; keep order of first appearance so output is deterministic
+		self._groups = {}
+		self._group_order = []
+
+	def add(self, burst):
+		if burst['metric'] != self.aggregation['source']:
+			return
+		group_key = tuple(burst['tags'].get(t) for t in self.aggregation['group-by'])
+		if group_key not in self._groups:
+			self._groups[group_key] = {}
+			self._group_order.append(group_key)
+		group_values = self._groups[group_key]
+		for field, field_value in burst['values'].items():
+			if isinstance(field_value, bool):
+				field_value = int(field_value)
+			if not isinstance(field_value, (int, float)):
+				continue
+			group_values.setdefault(field, []).append(field_value)
+
+	def bursts(self):
+		aggregation = self.aggregation
+		agg_bursts = []
+		for group_key in self._group_order:
+			group_values = self._groups[group_key]
+			metric_values = {}
+			for value_def in aggregation['values']:
+				field_values = group_values.get(value_def['field'])
+				if not field_values:
+					continue
+				metric_values[value_def['name']] = apply_function(value_def['function'], field_values)
+			if len(metric_values) == 0:
+				continue
+			metric_tags = dict(aggregation['tags'])
+			for tag_name, tag_value in zip(aggregation['group-by'], group_key):
+				if tag_value is not None:
+					metric_tags[tag_name] = tag_value
+			agg_bursts.append(Burst(aggregation['dest'], aggregation['name'], metric_values, metric_tags))
+		return agg_bursts
+
+
+def aggregate_bursts(aggregation, bursts):
+	"""
+	Executes a single aggregation over the bursts of a tick.
+
+	:type aggregation: ``dict[str, Any]``
+	:param aggregation: The parsed aggregation, as created by parse_config_aggregations().
+	:type bursts: ``Iterable[Burst]``
+	:param bursts: The bursts that were scraped from an endpoint.
+	:rtype: ``list[Burst]``
+	:return: The aggregated bursts; one for every group that had at least one value.
+	"""
+	aggregator = _Aggregator(aggregation)
+	for b in bursts:
+		aggregator.add(b)
+	return aggregator.bursts()
+
+
+def apply_aggregations(aggregations, bursts):
+	"""
+	Executes all aggregations over the bursts of a tick and gives the bursts that should be sent.
+
+	:type aggregations: ``list[dict[str, Any]]``
+	:param aggregations: The parsed aggregations, as created by parse_config_aggregations().
+	:type bursts: ``Iterable[Burst]``
+	:param bursts: The bursts that were scraped from an endpoint.
+	:rtype: ``list[Burst]``
+	:return: The bursts to send. This is the original bursts, minus any whose metric was marked to be dropped by an
+	aggregation, followed by the bursts created by the aggregations.
+	"""
+	return list(iter_aggregations(aggregations, bursts))
+
+
+def iter_aggregations(aggregations, bursts):
+	"""
+	Executes all aggregations over the bursts of a tick as they are given, and gives the bursts that should be sent.
+	Each burst that is not dropped is passed on as soon as it is given, and the bursts created by the aggregations
+	are given once all bursts have been.
+
+	:type aggregations: ``list[dict[str, Any]]``
+	:param aggregations: The parsed aggregations, as created by parse_config_aggregations().
+	:type bursts: ``Iterable[Burst]``
+	:param bursts: The bursts that were scraped from an endpoint.
+	:rtype: ``Iterator[Burst]``
+	:return: The bursts to send, in the same order as apply_aggregations().
+	"""
+	if len(aggregations) == 0:
+		yield from bursts
+		return
+	dropped = set(agg['source'] for agg in aggregations if agg['drop-source'])
+	aggregators = [_Aggregator(agg) for agg in aggregations]
+	for b in bursts:
+		for aggregator in aggregators:
+			aggregator.add(b)
+		if b['metric'] not in dropped:
+			yield b
+	for aggregator in aggregators:
+		yield from aggregator.bursts()
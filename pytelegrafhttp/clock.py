@@ -1,4 +1,4 @@
-import sys
+import signal
 import threading
 import datetime
 import logging
@@ -9,41 +9,137 @@ _log = logging.getLogger(__name__)
 _log.setLevel(logging.DEBUG)
 
 
+try:
+	# signal.signal() converts to and from enums on every call, which is most of the cost of swapping handlers
+	from _signal import signal as _set_handler
+except ImportError:
+	_set_handler = signal.signal
+
+# signals whose handlers are held off while in a critical section
+_critical_signals = set(
+	getattr(signal, name) for name in ('SIGINT', 'SIGTERM', 'SIGHUP', 'SIGBREAK') if hasattr(signal, name)
+)
+
+
 # Uninterruptable code
-def _no_interrupt(fun):
+class _CriticalSection(object):
 	"""
-	Executes the given function in a context where it can't be interrupted by keyboard interupts.
-	:type fun: ``() -> Any``
-	:param fun: The function to run. If it returns something, that will be returned by _no_interrupt.
-	:rtype: ``Any``
-	:return: Whatever the result of executing the function is.
+	Context manager for a block of code that must not be interrupted by a signal handler, such as the
+	KeyboardInterrupt raised for SIGINT or the exceptions raised by the daemon's SIGTERM and SIGHUP handlers. Any of
+	those signals that arrive while in the block are held and delivered as soon as the block exits.
+
+	The handlers of the signals are swapped out for one that records the signal, and the original handlers are called for
+	any recorded signals once they are restored. Blocking the signals with pthread_sigmask() would only block them in
+	the calling thread; with other threads running, such as the control thread, the signal would be taken by one of
+	those instead and its handler would still run in the main thread in the middle of the block.
 	"""
 
-	def thread_func(r):
-		# noinspection PyBroadException
-		try:
-			r[0] = fun()
-		except BaseException:
-			r[1] = sys.exc_info()
-	result = [None, None]
-	""":type: list"""
-	th = threading.Thread(target=thread_func, args=(result,))
-	th.start()
-	th.join()
-	if result[1] is not None:
-		inf = result[1]
-		raise inf[1].with_traceback(inf[2])
-	return result[0]
+	def __init__(self):
+		"""
+		Creates a new critical section.
+		"""
+		self._old_handlers = {}
+		self._deferred = []
+
+	def __enter__(self):
+		if threading.current_thread() is threading.main_thread():
+			# handlers can only be changed from the main thread, but then again, only the main thread is interrupted by
+			# them.
+			self._deferred = []
+			for sig in _critical_signals:
+				self._old_handlers[sig] = _set_handler(sig, self._defer_signal)
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		if len(self._old_handlers) > 0:
+			handlers = self._old_handlers
+			deferred = self._deferred
+			self._old_handlers = {}
+			self._deferred = []
+			for sig in handlers:
+				_set_handler(sig, handlers[sig])
+			delivered = 0
+			try:
+				for sig in deferred:
+					delivered += 1
+					handler = handlers[sig]
+					if callable(handler):
+						handler(sig, None)
+					elif handler == signal.SIG_DFL:
+						signal.raise_signal(sig)
+			finally:
+				# a handler that raises, as the reload and interrupt handlers do, would otherwise drop the signals after
+				# it; they are raised again so that their handlers still run
+				for sig in deferred[delivered:]:
+					signal.raise_signal(sig)
+		return False
+
+	def _defer_signal(self, signum, frame):
+		self._deferred.append(signum)
+
+
+# policies for choosing the next target time when a tick overruns past the time that the following tick should start at
+OVERRUN_CATCH_UP = 'catch-up'
+"""Run every missed tick as soon as possible, back-to-back, until the clock is back on schedule."""
+OVERRUN_SKIP = 'skip'
+"""Drop missed ticks and wait for the first tick time that has not yet passed."""
+OVERRUN_REPHASE = 'rephase'
+"""Start the next tick immediately and measure all following tick times from it."""
+
+OVERRUN_POLICIES = (OVERRUN_CATCH_UP, OVERRUN_SKIP, OVERRUN_REPHASE)
+
+DEFAULT_OVERRUN_POLICY = OVERRUN_SKIP
+"""The overrun policy used by both TickClock and Scheduler when none is given, and by the time_overrun_policy config."""
+
+
+def next_target(prev_target, interval, current, policy):
+	"""
+	Gets the time that the next run of something repeating at a regular interval should start at.
+
+	:type prev_target: ``int``
+	:param prev_target: The monotonic time that the previous run was supposed to start at, in nanoseconds.
+	:type interval: ``int``
+	:param interval: The number of nanoseconds between the start of each run.
+	:type current: ``int``
+	:param current: The current monotonic time, in nanoseconds.
+	:type policy: ``str``
+	:param policy: What to do when the next run's time has already passed. Must be one of the values in
+	OVERRUN_POLICIES.
+	:rtype: ``(int, int)``
+	:return: The monotonic time that the next run should start at in nanoseconds, and the number of runs that were
+	skipped to get there.
+	"""
+	target = prev_target + interval
+	if target > current:
+		return target, 0
+	if policy == OVERRUN_CATCH_UP:
+		return target, 0
+	elif policy == OVERRUN_SKIP:
+		missed = (current - target) // interval + 1
+		return target + (missed * interval), missed
+	elif policy == OVERRUN_REPHASE:
+		return current, 0
+	else:
+		raise ValueError("Bad overrun policy: " + repr(policy))
 
 
 class TickClock(object):
 	"""
 	Tracks time delta and ticks. Used for time-keeping.
 
-	:type _prev_target_time: ``datetime.datetime``
+	Tick scheduling is done against the monotonic clock, so it is not disturbed by changes to the system time. The
+	real-world system time is still recorded at the start of each tick for use in timestamps.
 	"""
 
-	def __init__(self, tick=0, tick_speed=None, total_time=None, suspended=False, limiter_enabled=True):
+	def __init__(
+			self,
+			tick=0,
+			tick_speed=None,
+			total_time=None,
+			suspended=False,
+			limiter_enabled=True,
+			overrun_policy=DEFAULT_OVERRUN_POLICY
+	):
 		"""
 		Creates a new TickClock. The current tick is set to the given number of ticks.
 		:type tick: ``long``
@@ -62,47 +158,76 @@ class TickClock(object):
 		:param limiter_enabled: Whether to enable the frame-limiting mechanism of the clock. If this is set to false,
 		calls to advance will immediately advance the tick with no waiting, and no frame will ever be considered to be
 		running slowly.
+		:type overrun_policy: ``str``
+		:param overrun_policy: What to do when a tick runs past the time that the next tick should have started at. Must
+		be one of the values in OVERRUN_POLICIES. This only applies to calls to advance() that are not given a target
+		time; when the target time comes from a Scheduler, the Scheduler's own policy is the one in force.
 		"""
+		if overrun_policy not in OVERRUN_POLICIES:
+			raise ValueError("Bad overrun policy: " + repr(overrun_policy))
 		self._tick = tick
 		self._time = now()
+		self._mono = now_monotonic()
 		self._speed = None
-		self._elapsed = None
+		self._speed_ns = None
+		self._elapsed_ns = None
 		self._prev = None
-		self._total = None
+		self._prev_mono = None
+		self._total_ns = None
 		self._is_slow = False
 		self._clock_active = False
 		self._clock_suspended = False
 		self._limiter_enabled = limiter_enabled
+		self._overrun_policy = overrun_policy
 		# tolerance for hitting time target is ten milliseconds. More off than that and it will be considered slow.
-		self._target_tolerance = datetime.timedelta(seconds=0.01)
-		self._prev_target_time = None
+		self._target_tolerance_ns = 10 * 1000000
+		self._prev_target = None
+		self._lateness_ns = 0
+		self._missed = 0
+		self._stat_ticks = 0
+		self._stat_late_ticks = 0
+		self._stat_missed_ticks = 0
+		self._stat_total_lateness_ns = 0
+		self._stat_max_lateness_ns = 0
 		if tick_speed is not None:
 			# Then the clock has already been started.
-			_no_interrupt(lambda: self._set_clock_props(datetime.timedelta(seconds=tick_speed), total_time))
+			with _CriticalSection():
+				self._set_clock_props(datetime.timedelta(seconds=tick_speed), total_time)
 			self._clock_active = True
 			if suspended:
 				self._clock_suspended = True
 
-	def advance(self):
+	def advance(self, target_time=None):
 		"""
 		Advances to the next tick. Thread will sleep until the time of the next tick arrives. This method should be
 		called at the very end (but still within) the main loop of the associated bot. When this method returns, the
 		properties of this TickClock will have been updated to reflect the new time information.
 
+		:type target_time: ``int``
+		:param target_time: The monotonic time that the next tick should start at, in nanoseconds, as given by
+		now_monotonic(). If not given, the next tick starts one tick speed after the target time of the current tick,
+		subject to the overrun policy.
 		:rtype: ``TickClock``
 		:return This TickClock.
 		"""
 		if not self.is_running:
 			raise ValueError("Clock must be running before calling advance()")
+		missed = 0
 		if self._limiter_enabled:
-			target_time = self._prev_target_time + self.speed
-			self._prev_target_time = target_time
-			sleep_time = max((target_time - now()).total_seconds(), 0.0)
+			current = now_monotonic()
+			if target_time is None:
+				target_time, missed = next_target(self._prev_target, self._speed_ns, current, self._overrun_policy)
+				if missed > 0:
+					_log.debug("Skipping " + str(missed) + " missed tick(s)")
+			self._prev_target = target_time
+			sleep_time = (target_time - current) / 1000000000.0
 			if sleep_time > 0:
 				_log.debug("Sleep for %0.5f seconds", sleep_time)
 				time.sleep(sleep_time)
 		ts = now()
-		_no_interrupt(lambda: self._increment_clock_props(ts))
+		mono = now_monotonic()
+		with _CriticalSection():
+			self._increment_clock_props(ts, mono, missed)
 		_log.debug("Clock advanced to tick " + str(self.tick))
 		return self
 
@@ -129,7 +254,8 @@ class TickClock(object):
 			raise ValueError("clock not started, or was stopped after previous suspend")
 		if not self._clock_suspended:
 			return
-		_no_interrupt(lambda: self._set_clock_props(self._speed, self._total))
+		with _CriticalSection():
+			self._set_clock_props(self._speed, self.total)
 		self._clock_suspended = False
 		_log.debug("Clock resumed")
 		return self
@@ -137,6 +263,11 @@ class TickClock(object):
 	def reset(self):
 		""":rtype: TickClock"""
 		self._tick = 0
+		self._stat_ticks = 0
+		self._stat_late_ticks = 0
+		self._stat_missed_ticks = 0
+		self._stat_total_lateness_ns = 0
+		self._stat_max_lateness_ns = 0
 		return self
 
 	def start(self, tick_speed):
@@ -153,7 +284,8 @@ class TickClock(object):
 		:return This TickClock.
 		"""
 		speed = datetime.timedelta(seconds=tick_speed)
-		_no_interrupt(lambda: self._set_clock_props(speed))
+		with _CriticalSection():
+			self._set_clock_props(speed)
 		self._clock_active = True
 		_log.debug("Clock started")
 		return self
@@ -168,6 +300,7 @@ class TickClock(object):
 		"""
 		self._clock_active = False
 		self._speed = None
+		self._speed_ns = None
 		_log.debug("Clock stopped")
 		return self
 
@@ -183,6 +316,20 @@ class TickClock(object):
 		self._limiter_enabled = value
 		return self
 
+	def use_overrun_policy(self, value):
+		"""
+		Sets what to do when a tick runs past the time that the next tick should have started at. This only applies to
+		calls to advance() that are not given a target time.
+		:type value: ``str``
+		:param value: The overrun policy. Must be one of the values in OVERRUN_POLICIES.
+		:rtype: ``TickClock``
+		:return: This TickClock.
+		"""
+		if value not in OVERRUN_POLICIES:
+			raise ValueError("Bad overrun policy: " + repr(value))
+		self._overrun_policy = value
+		return self
+
 	@property
 	def tick(self):
 		"""
@@ -201,6 +348,16 @@ class TickClock(object):
 		"""
 		return self._time
 
+	@property
+	def monotonic(self):
+		"""
+		The monotonic time of the start of the current tick, as given by now_monotonic(). This is the time that should
+		be used for scheduling, as it is not affected by changes to the system time.
+		:rtype: ``int``
+		:return: The monotonic tick time, in nanoseconds.
+		"""
+		return self._mono
+
 	@property
 	def elapsed(self):
 		"""
@@ -208,7 +365,9 @@ class TickClock(object):
 		:rtype: ``datetime.timedelta``
 		:return: The elapsed time.
 		"""
-		return self._elapsed
+		if self._elapsed_ns is None:
+			return None
+		return _ns_to_timedelta(self._elapsed_ns)
 
 	@property
 	def prev(self):
@@ -237,7 +396,9 @@ class TickClock(object):
 		:rtype: ``datetime.timedelta``
 		:return: The total amount of real-world time that has passed since bot time started.
 		"""
-		return self._total
+		if self._total_ns is None:
+			return None
+		return _ns_to_timedelta(self._total_ns)
 
 	@property
 	def timestamp(self):
@@ -248,6 +409,63 @@ class TickClock(object):
 		"""
 		return _datetime_to_ts(self.time)
 
+	@property
+	def target(self):
+		"""
+		The monotonic time that the current tick was supposed to start at, as given by now_monotonic().
+		:rtype: ``int``
+		:return: The target time of the current tick, in nanoseconds.
+		"""
+		return self._prev_target
+
+	@property
+	def lateness(self):
+		"""
+		How long after its target time the current tick started. Small amounts of lateness are normal due to imprecision
+		in waking up from sleep.
+		:rtype: ``datetime.timedelta``
+		:return: The lateness of the current tick.
+		"""
+		return _ns_to_timedelta(self._lateness_ns)
+
+	@property
+	def missed(self):
+		"""
+		The number of ticks that were skipped immediately before the current one due to the overrun policy.
+		:rtype: ``int``
+		:return: The number of skipped ticks.
+		"""
+		return self._missed
+
+	@property
+	def lateness_stats(self):
+		"""
+		Statistics on how late ticks have started since the clock was last reset. Times are given in seconds.
+		:rtype: ``dict[str, int|float]``
+		:return: The number of ticks that have been advanced to ('ticks'), how many of them started late enough to be
+		considered slow ('late-ticks'), how many ticks were skipped ('missed-ticks'), and the maximum and mean lateness of
+		ticks ('max-lateness' and 'mean-lateness').
+		"""
+		mean = 0.0
+		if self._stat_ticks > 0:
+			mean = self._stat_total_lateness_ns / self._stat_ticks / 1000000000.0
+		return {
+			'ticks': self._stat_ticks,
+			'late-ticks': self._stat_late_ticks,
+			'missed-ticks': self._stat_missed_ticks,
+			'max-lateness': self._stat_max_lateness_ns / 1000000000.0,
+			'mean-lateness': mean
+		}
+
+	@property
+	def overrun_policy(self):
+		"""
+		What to do when a tick runs past the time that the next tick should have started at.
+		:rtype: ``str``
+		:return: One of the values in OVERRUN_POLICIES.
+		"""
+		return self._overrun_policy
+
 	@property
 	def is_using_limiter(self):
 		"""
@@ -262,9 +480,9 @@ class TickClock(object):
 	@property
 	def is_slow(self):
 		"""
-		Whether the execution of the previous tick's operations took longer than the target tick speed. In this case, if
-		possible, the following tick should try to limit its actions to try and 'speed up' the its execution in order to
-		return to the target time.
+		Whether the execution of the previous tick's operations took longer than the time available to it, so that the
+		current tick started after its target time. In this case, if possible, the following tick should try to limit
+		its actions to try and 'speed up' the its execution in order to return to the target time.
 		:rtype: ``bool``
 		:return: Whether the previous tick missed its target for execution time.
 		"""
@@ -303,7 +521,7 @@ class TickClock(object):
 		:rtype: ``dict[str, Any]``
 		:return: The dictionary.
 		"""
-		data = {'tick': self.tick, 'active': self.is_active}
+		data = {'tick': self.tick, 'active': self.is_active, 'overrun_policy': self.overrun_policy}
 		if self._clock_active:
 			data['speed'] = self.speed.total_seconds()
 			data['total'] = self.total.total_seconds()
@@ -316,13 +534,14 @@ class TickClock(object):
 		tick = int(json['tick'])
 		active = bool(json['active'])
 		limiter = bool(json.get('frame_limiter', True))
+		policy = str(json.get('overrun_policy', DEFAULT_OVERRUN_POLICY))
 		if active:
 			speed = float(json['speed'])
 			total = datetime.timedelta(seconds=float(json['total']))
 			suspended = bool(json['suspended'])
-			return TickClock(tick, speed, total, suspended, limiter_enabled=limiter)
+			return TickClock(tick, speed, total, suspended, limiter_enabled=limiter, overrun_policy=policy)
 		else:
-			return TickClock(tick, limiter_enabled=limiter)
+			return TickClock(tick, limiter_enabled=limiter, overrun_policy=policy)
 
 	def _set_clock_props(self, speed, total=None):
 		"""
@@ -331,23 +550,42 @@ class TickClock(object):
 		:return:
 		"""
 		self._time = now()
+		self._mono = now_monotonic()
 		self._speed = speed
+		self._speed_ns = _timedelta_to_ns(speed)
 		if total is not None:
-			self._total = total
+			self._total_ns = _timedelta_to_ns(total)
 		else:
-			self._total = datetime.timedelta(seconds=0.0)
+			self._total_ns = 0
 		self._prev = self._time - self._speed
+		self._prev_mono = self._mono - self._speed_ns
 		self._is_slow = False
-		self._elapsed = self._speed
-		self._prev_target_time = self._time
+		self._elapsed_ns = self._speed_ns
+		self._prev_target = self._mono
+		self._lateness_ns = 0
+		self._missed = 0
 
-	def _increment_clock_props(self, ts):
+	def _increment_clock_props(self, ts, mono, missed):
 		self._prev = self._time
+		self._prev_mono = self._mono
 		self._tick += 1
 		self._time = ts
-		self._elapsed = self._time - self._prev
-		self._is_slow = self._limiter_enabled and (self.elapsed - self.speed > self._target_tolerance)
-		self._total += self._elapsed
+		self._mono = mono
+		self._elapsed_ns = self._mono - self._prev_mono
+		self._total_ns += self._elapsed_ns
+		self._missed = missed
+		if self._limiter_enabled:
+			self._lateness_ns = max(self._mono - self._prev_target, 0)
+		else:
+			self._lateness_ns = 0
+		self._is_slow = self._lateness_ns > self._target_tolerance_ns
+		self._stat_ticks += 1
+		self._stat_missed_ticks += missed
+		self._stat_total_lateness_ns += self._lateness_ns
+		self._stat_max_lateness_ns = max(self._stat_max_lateness_ns, self._lateness_ns)
+		if self._is_slow:
+			self._stat_late_ticks += 1
+			_log.debug("Tick %d started %0.5f seconds late", self._tick, self._lateness_ns / 1000000000.0)
 
 	def __str__(self):
 		return "<T=" + str(self.tick) + ">"
@@ -356,6 +594,24 @@ class TickClock(object):
 		return type(TickClock, self).__name__ + "(tick=" + repr(self.tick) + ")"
 
 
+def now_monotonic() -> int:
+	"""
+	Gets the current time of the monotonic clock. This clock is not affected by changes to the system time, and only
+	has meaning relative to other values gotten from it.
+
+	:return: The current monotonic time, in nanoseconds.
+	"""
+	return time.monotonic_ns()
+
+
+def _timedelta_to_ns(delta: datetime.timedelta) -> int:
+	return ((delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds) * 1000
+
+
+def _ns_to_timedelta(ns: int) -> datetime.timedelta:
+	return datetime.timedelta(microseconds=ns // 1000)
+
+
 def now() -> datetime.datetime:
 	"""
 	Gets the current datetime as a timezone-aware UTC datetime instance.
@@ -1,9 +1,58 @@
 """
 For communication between different daemons.
+
+The main process listens on a unix socket in the daemon files directory, and its controllers send it commands over
+it. Each request is a single line of JSON giving the command, such as ``{"command": "status"}``; each response is one
+or more lines of JSON, the last of which has a 'state' of 'done' or 'error'. Commands that the main process needs time
+to carry out, such as stop and reload, first get a response with a 'state' of 'accepted'. Every response includes the
+status of the main process, so that a controller can tell what a stuck process is doing.
+
+On systems without unix sockets, lockfiles in the same directory are used to signal the controllers instead.
 """
+import json
+import logging
 import os
+import signal
+import socket
+import socketserver
+import threading
 import time
 
+_log = logging.getLogger(__name__)
+_log.setLevel(logging.DEBUG)
+
+CONTROL_SUPPORTED = hasattr(socket, 'AF_UNIX')
+
+COMMAND_STATUS = 'status'
+COMMAND_STATS = 'stats'
+COMMAND_FLUSH = 'flush'
+COMMAND_STOP = 'stop'
+COMMAND_RELOAD = 'reload'
+COMMANDS = (COMMAND_STATUS, COMMAND_STATS, COMMAND_FLUSH, COMMAND_STOP, COMMAND_RELOAD)
+
+# longest request line that is read from a controller
+_MAX_REQUEST_SIZE = 4096
+
+
+class ControlError(Exception):
+	"""
+	Raised when the main process could not carry out a command, or could not be reached.
+	"""
+
+	def __init__(self, msg, status=None):
+		"""
+		Creates a new ControlError.
+
+		:type msg: ``str``
+		:param msg: The message.
+		:type status: ``dict[str, Any]``
+		:param status: The last status of the main process, if it was reached.
+		"""
+		if status is not None:
+			msg += " (" + describe_status(status) + ")"
+		super().__init__(msg)
+		self.status = status
+
 
 class DaemonCommunicator(object):
 	"""For communication between the main process and its controllers."""
@@ -11,6 +60,13 @@ class DaemonCommunicator(object):
 	def __init__(self):
 		self._daemon_dir = None
 		self._owner_pid = os.getpid()
+		self._server = None
+		self._server_thread = None
+		self._status = None
+		self._handlers = {}
+		self._command_timeout = 30
+		self._terminated = threading.Event()
+		self._reloaded = threading.Event()
 
 	def load_config(self, conf):
 		self._daemon_dir = conf.env_daemon_files_dir
@@ -20,6 +76,50 @@ class DaemonCommunicator(object):
 		if os.path.isfile(fn):
 			os.remove(fn)
 
+	def start_control(self, status, handlers, timeout=30):
+		"""
+		Starts listening for commands from controllers, in a separate thread. Does nothing if unix sockets are not
+		supported.
+
+		:type status: ``Callable[[], dict[str, Any]]``
+		:param status: Gives the status of the main process. It is called from the listening thread.
+		:type handlers: ``dict[str, Callable[[], Any]]``
+		:param handlers: The functions that carry out the commands other than status, stop, and reload, keyed by
+		command. They are called from the listening thread, and what they return is sent back to the controller.
+		:type timeout: ``float``
+		:param timeout: The number of seconds to wait for a stop or reload to complete before reporting that it did not.
+		"""
+		self._status = status
+		self._handlers = dict(handlers)
+		self._command_timeout = timeout
+		if not CONTROL_SUPPORTED or self._server is not None:
+			return
+		path = self._get_socket_path()
+		if os.path.exists(path):
+			# left behind by a process that did not shut down cleanly; pids are not reused while it is running
+			os.remove(path)
+		self._server = _ControlServer(path, self)
+		self._server_thread = threading.Thread(target=self._server.serve_forever, name='control', daemon=True)
+		self._server_thread.start()
+		_log.debug("Listening for commands on '" + path + "'")
+
+	def stop_control(self):
+		"""
+		Stops listening for commands. Commands that are being handled are given their responses first.
+		"""
+		server, thread = self._server, self._server_thread
+		if server is None:
+			return
+		self._server = None
+		self._server_thread = None
+		server.shutdown()
+		server.server_close()
+		thread.join()
+		try:
+			os.remove(self._get_socket_path())
+		except FileNotFoundError:
+			pass
+
 	def signal_started(self):
 		fn = self._get_filename_for('running')
 		if os.path.isfile(fn):
@@ -33,13 +133,16 @@ class DaemonCommunicator(object):
 			raise ValueError("out of order signaling; pid lockfile does not exist")
 		else:
 			os.remove(fn)
+		self._terminated.set()
+		self.stop_control()
 
 	def signal_reload_completed(self):
 		fn = self._get_filename_for('reload')
-		if not os.path.isfile(fn):
-			raise ValueError("out of order signaling; pid reload lockfile does not exist")
-		else:
+		if os.path.isfile(fn):
 			os.remove(fn)
+		elif not CONTROL_SUPPORTED:
+			raise ValueError("out of order signaling; pid reload lockfile does not exist")
+		self._reloaded.set()
 
 	def signal_reload_start(self, pid):
 		fn = self._get_filename_for('reload', pid=pid)
@@ -64,12 +167,147 @@ class DaemonCommunicator(object):
 			if time.monotonic() - start > timeout:
 				raise TimeoutError("timed out while waiting for main process to reload")
 
+	def send_command(self, pid, command, timeout=30):
+		"""
+		Sends a command to a main process and waits for it to be carried out. A process that reports that it is stuck
+		when it accepts a command is reported right away instead of being waited on.
+
+		:type pid: ``int``
+		:param pid: The PID of the main process.
+		:type command: ``str``
+		:param command: The command. Must be one of COMMANDS.
+		:type timeout: ``float``
+		:param timeout: The number of seconds to wait for the process to respond.
+		:rtype: ``dict[str, Any]``
+		:return: The final response, with the 'status' of the process and the 'result' of the command if it has one.
+		"""
+		path = self._get_socket_path(pid)
+		sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		sock.settimeout(timeout)
+		status = None
+		try:
+			try:
+				sock.connect(path)
+			except (FileNotFoundError, ConnectionRefusedError):
+				raise ControlError("process " + str(pid) + " is not listening for commands; is it running?")
+			sock.sendall((json.dumps({'command': command}) + '\n').encode('utf-8'))
+			responses = sock.makefile('rb')
+			for line in responses:
+				response = json.loads(line.decode('utf-8'))
+				status = response.get('status', status)
+				if response['state'] == 'accepted':
+					if status is not None and status.get('stuck'):
+						raise ControlError("process " + str(pid) + " accepted '" + command + "' but appears stuck", status)
+					continue
+				if response['state'] == 'error':
+					raise ControlError(response['error'], status)
+				response['status'] = status
+				return response
+		except socket.timeout:
+			raise ControlError("timed out waiting for process " + str(pid) + " to respond to '" + command + "'", status)
+		finally:
+			sock.close()
+		if command == COMMAND_STOP:
+			# the process exited before it could say so
+			return {'state': 'done', 'status': status}
+		raise ControlError("process " + str(pid) + " closed the connection without responding", status)
+
+	def _handle_command(self, command, reply):
+		"""
+		Carries out a command from a controller. Called from the listening thread.
+
+		:type command: ``str``
+		:param command: The command.
+		:type reply: ``Callable[[dict[str, Any]], None]``
+		:param reply: Sends a response to the controller.
+		"""
+		status = self._status()
+		if command == COMMAND_STATUS:
+			reply({'state': 'done', 'status': status})
+		elif command in (COMMAND_STOP, COMMAND_RELOAD):
+			if command == COMMAND_STOP:
+				done, signum = self._terminated, signal.SIGTERM
+			else:
+				done, signum = self._reloaded, signal.SIGHUP
+				done.clear()
+			_log.info("Received '" + command + "' command")
+			reply({'state': 'accepted', 'status': status})
+			self._signal_self(signum)
+			if done.wait(self._command_timeout):
+				reply({'state': 'done', 'status': self._status()})
+			else:
+				reply({'state': 'error', 'error': "'" + command + "' did not complete in time", 'status': self._status()})
+		elif command in self._handlers:
+			try:
+				result = self._handlers[command]()
+			except Exception as e:
+				_log.exception("Problem handling '" + command + "' command")
+				reply({'state': 'error', 'error': str(e), 'status': status})
+				return
+			reply({'state': 'done', 'status': status, 'result': result})
+		else:
+			reply({'state': 'error', 'error': "unknown command: " + repr(command), 'status': status})
+
+	def _signal_self(self, signum):
+		# handlers of the main thread carry out stops and reloads, the same as when they are sent from outside
+		os.kill(os.getpid(), signum)
+
+	def _get_socket_path(self, pid=None):
+		if pid is None:
+			pid = self._owner_pid
+		return os.path.join(self._daemon_dir, str(pid) + '.sock')
+
 	def _get_filename_for(self, name, pid=None):
 		if pid is None:
 			pid = self._owner_pid
 		return os.path.join(self._daemon_dir, str(pid) + '.' + name + '.lock')
 
 
+def describe_status(status):
+	"""
+	Gets a description of the status of a main process.
+
+	:type status: ``dict[str, Any]``
+	:param status: The status, as given in responses to commands.
+	:rtype: ``str``
+	:return: The description.
+	"""
+	desc = "tick " + str(status.get('tick')) + ", " + str(status.get('activity'))
+	desc += " for " + str(round(status.get('activity-seconds', 0.0), 1)) + "s"
+	return desc
+
+
+if CONTROL_SUPPORTED:
+	class _ControlServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+		# closing the server waits for commands that are being handled to be given their responses
+		block_on_close = True
+		daemon_threads = False
+
+		def __init__(self, path, communicator):
+			self.communicator = communicator
+			super().__init__(path, _ControlHandler)
+
+
+class _ControlHandler(socketserver.StreamRequestHandler):
+
+	def handle(self):
+		line = self.rfile.readline(_MAX_REQUEST_SIZE)
+		try:
+			command = json.loads(line.decode('utf-8'))['command']
+		except (ValueError, KeyError, TypeError):
+			self._reply({'state': 'error', 'error': "bad request"})
+			return
+		self.server.communicator._handle_command(command, self._reply)
+
+	def _reply(self, response):
+		try:
+			self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+			self.wfile.flush()
+		except OSError:
+			# the controller went away; nothing to tell it
+			pass
+
+
 def _touch(path):
 	with open(path, 'a'):
 		os.utime(path, None)
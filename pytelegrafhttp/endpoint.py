@@ -1,43 +1,198 @@
 """
 Endpoint data and text scraper.
 """
+import contextlib
+import hashlib
 import logging
+import signal
+import threading
+import time
 from .util import VerificationError
 
 _log = logging.getLogger(__name__)
 _log.setLevel(logging.DEBUG)
 
 
+class ExtractionTimeout(Exception):
+	"""
+	Raised when extracting a metric takes longer than its time budget.
+	"""
+	pass
+
+
+class Burst(object):
+	"""
+	A single set of values and tags of a metric that is sent to telegraf together. The fields can also be read by
+	subscript, as in burst['values'], so that a Burst can be used anywhere that the dict form of a burst is.
+	"""
+
+	__slots__ = ('channel', 'metric', 'values', 'tags')
+
+	def __init__(self, channel, metric, values, tags):
+		"""
+		Creates a new Burst.
+
+		:type channel: ``str``
+		:param channel: The telegraf destination that the burst is sent to.
+		:type metric: ``str``
+		:param metric: The name of the metric.
+		:type values: ``dict[str, Any]``
+		:param values: The values of the metric.
+		:type tags: ``dict[str, str]``
+		:param tags: The tags of the metric.
+		"""
+		self.channel = channel
+		self.metric = metric
+		self.values = values
+		self.tags = tags
+
+	def __getitem__(self, key):
+		if key not in Burst.__slots__:
+			raise KeyError(key)
+		return getattr(self, key)
+
+	def __eq__(self, other):
+		if not isinstance(other, Burst):
+			return NotImplemented
+		return (self.channel, self.metric, self.values, self.tags) == (other.channel, other.metric, other.values, other.tags)
+
+	# bursts are compared by their values and tags, which are mutable dicts
+	__hash__ = None
+
+	def __repr__(self):
+		return "Burst(" + ", ".join(repr(self[k]) for k in Burst.__slots__) + ")"
+
+
 class Endpoint(object):
 
-	def __init__(self, uri, verify_pattern):
+	def __init__(self, uri, verify_pattern, sections=None, time_budget=None, max_overruns=3):
 		"""
 		Create a new Endpoint.
 		:param uri: The uri of the endpoint.
 		:param verify_pattern: The pattern to use to confirm that the contents are correct.
+		:param sections: The parsed sections of the endpoint, by name. Each gives the 'start' and 'end' patterns that
+		the section is found between.
+		:param time_budget: The default number of seconds that extracting each metric may take, for metrics that do not
+		give their own 'time-budget'. If None, metrics without their own budget are not limited.
+		:param max_overruns: The number of times in a row that a metric may go over its time budget before it is
+		disabled.
 		"""
 		self.uri = uri
 		self.verify_pattern = verify_pattern
+		self.sections = sections if sections is not None else {}
+		self.time_budget = time_budget
+		self.max_overruns = max_overruns
+		self.overrun_count = 0
+		self.disabled = set()
+		""":type : set[int]"""
+		self._overruns = {}
+		""":type : dict[int, int]"""
+		# the bursts of each metric from the last time that it was scraped, along with the hash of the text that they
+		# were scraped from and the min_priority they were scraped with
+		self._parse_cache = {}
+		""":type : dict[int, (bytes, int, list[dict[str, Any]])]"""
+		self.reused_count = 0
+
+	def retain_metrics(self, matches):
+		"""
+		Keeps what is known about the metrics that are still scraped after the metrics of the endpoint change, and
+		forgets the rest. This is the cached parse, overruns, and whether it is disabled of each metric.
+
+		:type matches: ``dict[int, int]``
+		:param matches: The old index of each metric that is still scraped, keyed by its new index.
+		"""
+		self._parse_cache = dict((new, self._parse_cache[old]) for new, old in matches.items() if old in self._parse_cache)
+		self._overruns = dict((new, self._overruns[old]) for new, old in matches.items() if old in self._overruns)
+		self.disabled = set(new for new, old in matches.items() if old in self.disabled)
+
+	def locate_sections(self, endpoint_text):
+		"""
+		Finds the text of every section in the endpoint text. The text of a section is everything after the match of
+		its start pattern up to the first match of its end pattern after that. If there is no end pattern, the section
+		runs to the end of the text.
+
+		:param endpoint_text: The text of the endpoint.
+		:return: The text of each section by name. Sections that could not be found have text of None.
+		"""
+		found = {}
+		for name in self.sections:
+			section = self.sections[name]
+			start = section['start'].search(endpoint_text)
+			if start is None:
+				found[name] = None
+				continue
+			end_pos = len(endpoint_text)
+			if section['end'] is not None:
+				end = section['end'].search(endpoint_text, start.end())
+				if end is None:
+					found[name] = None
+					continue
+				end_pos = end.start()
+			found[name] = endpoint_text[start.end():end_pos]
+		return found
+
+	def scrape_metric(self, metric, endpoint_text, idx=0, min_priority=None):
+		"""
+		Gets all bursts of a metric from the endpoint text.
 
-	def scrape_metric(self, metric, endpoint_text, idx=0):
+		:param metric: The parsed metric to scrape.
+		:param endpoint_text: The text of the endpoint.
+		:param idx: The index of the metric within its endpoint. Used for logging.
+		:param min_priority: If given, values of the metric with a priority below this are not included in the bursts.
+		:return: The bursts of the metric, or None if the metric could not be found.
+		"""
+		bursts = list(self.iter_metric(metric, endpoint_text, idx=idx, min_priority=min_priority))
+		if len(bursts) == 0:
+			return None
+		return bursts
+
+	def iter_metric(self, metric, endpoint_text, idx=0, min_priority=None):
+		"""
+		Gets all bursts of a metric from the endpoint text one at a time, as each match is found. The endpoint text is
+		verified immediately rather than when the first burst is requested.
+
+		:param metric: The parsed metric to scrape.
+		:param endpoint_text: The text of the endpoint.
+		:param idx: The index of the metric within its endpoint. Used for logging.
+		:param min_priority: If given, values of the metric with a priority below this are not included in the bursts.
+		:rtype: ``Iterator[Burst]``
+		:return: The bursts of the metric. Nothing is given if the metric could not be found.
+		"""
 		if self.verify_pattern.search(endpoint_text) is None:
 			raise VerificationError("endpoint did not match expected content", endpoint_text)
+		if metric['section'] is not None:
+			endpoint_text = self.locate_sections(endpoint_text).get(metric['section'])
+			if endpoint_text is None:
+				self._warn_section_not_found(metric, idx)
+				return iter(())
+		return self._iter_metric_text(metric, endpoint_text, idx, min_priority)
+
+	def _iter_metric_text(self, metric, endpoint_text, idx, min_priority):
+		"""
+		Gets all bursts of a metric from text that has already been verified.
+		"""
 		dest_channel = metric['dest']
 		metric_name = metric['name']
 		pattern = metric['regex']
 		metric_value_definitions = metric['values']
+		if min_priority is not None:
+			metric_value_definitions = [v for v in metric_value_definitions if v['priority'] >= min_priority]
 		metric_tag_definitions = metric['tags']
 
-		if pattern.search(endpoint_text) is None:
-			warning_text = "metric " + str(idx) + " (" + metric_name + ") for endpoint + '" + self.uri + "'"
-			warning_text += " could not be found. Skipping for this unit of time"
-			_log.warning(warning_text)
-			return None
+		if metric['extraction'] == 'column' and all(v['type'] != 'custom' for v in metric_value_definitions):
+			found = False
+			for burst in self._iter_metric_columns(metric, endpoint_text, metric_value_definitions):
+				found = True
+				yield burst
+			if not found:
+				self._warn_metric_not_found(metric, idx)
+			return
 
-		bursts = []
+		found = False
 		# find all matches
 		matchers = pattern.finditer(endpoint_text)
 		for matcher in matchers:
+			found = True
 			# build the values from the matched items
 			metric_values = {}
 			for value_def in metric_value_definitions:
@@ -65,27 +220,325 @@ class Endpoint(object):
 					tag_value = matcher.group(tag_def['value'])
 				elif tag_type == 'const':
 					tag_value = tag_def['value']
+				elif tag_type == 'lookup':
+					tag_value = tag_def['map'][matcher.group(tag_def['value'])]
 				else:
 					# should be caught during config parsing, but double-check
 					raise ValueError("Bad metric tag definition type: " + repr(tag_type))
 				metric_tags[tag_name] = tag_value
 
-			bursts.append({
-				'channel': dest_channel,
-				'metric': metric_name,
-				'values': metric_values,
-				'tags': metric_tags
-			})
-		return bursts
+			yield Burst(dest_channel, metric_name, metric_values, metric_tags)
+		if not found:
+			self._warn_metric_not_found(metric, idx)
+
+	def _iter_metric_columns(self, metric, endpoint_text, value_defs):
+		"""
+		Gets all bursts of a metric by first collecting the captures of all matches column-by-column, then converting
+		each column with a single call to its converter, and only then building the bursts. Only the converters from
+		util.get_converter() gain from this, as they have fast paths for whole columns, such as converting each distinct
+		last-seen time once; other conversions are still called once per row. The columns are held in memory, but the
+		bursts are only built as they are requested.
+
+		Custom values are not supported, as they require the match object of each row.
+
+		:param metric: The parsed metric to scrape.
+		:param endpoint_text: The text of the endpoint.
+		:param value_defs: The definitions of the values to include.
+		:rtype: ``Iterator[Burst]``
+		:return: The bursts of the metric. Nothing is given if there were no matches.
+		"""
+		pattern = metric['regex']
+		rows = pattern.findall(endpoint_text)
+		if len(rows) == 0:
+			return
+		if pattern.groups == 0:
+			columns = []
+		elif pattern.groups == 1:
+			columns = [rows]
+		else:
+			columns = list(zip(*rows))
+		row_count = len(rows)
+
+		value_names = []
+		value_columns = []
+		for value_def in value_defs:
+			value_names.append(value_def['name'])
+			if value_def['type'] == 'capture':
+				column = columns[value_def['capture'] - 1]
+				conv = value_def['conversion']
+				if hasattr(conv, 'convert_column'):
+					value_columns.append(conv.convert_column(column))
+				else:
+					value_columns.append(list(map(conv, column)))
+			elif value_def['type'] == 'const':
+				value_columns.append([value_def['conversion']] * row_count)
+			else:
+				# should be caught during config parsing, but double-check
+				raise ValueError("Bad metric value definition type for column extraction: " + repr(value_def['type']))
+
+		tag_names = []
+		tag_columns = []
+		for tag_name in metric['tags']:
+			tag_def = metric['tags'][tag_name]
+			tag_names.append(tag_name)
+			if tag_def['type'] == 'capture':
+				tag_columns.append(columns[tag_def['value'] - 1])
+			elif tag_def['type'] == 'const':
+				tag_columns.append([tag_def['value']] * row_count)
+			elif tag_def['type'] == 'lookup':
+				tag_columns.append(list(map(tag_def['map'].__getitem__, columns[tag_def['value'] - 1])))
+			else:
+				# should be caught during config parsing, but double-check
+				raise ValueError("Bad metric tag definition type: " + repr(tag_def['type']))
+
+		dest_channel = metric['dest']
+		metric_name = metric['name']
+		# transpose back to rows; zip() of no columns gives no rows, so those need to be made explicitly
+		value_rows = zip(*value_columns) if len(value_columns) > 0 else [()] * row_count
+		tag_rows = zip(*tag_columns) if len(tag_columns) > 0 else [()] * row_count
+		for value_row, tag_row in zip(value_rows, tag_rows):
+			yield Burst(dest_channel, metric_name, dict(zip(value_names, value_row)), dict(zip(tag_names, tag_row)))
+
+	def _warn_metric_not_found(self, metric, idx):
+		warning_text = "metric " + str(idx) + " (" + metric['name'] + ") for endpoint + '" + self.uri + "'"
+		warning_text += " could not be found. Skipping for this unit of time"
+		_log.warning(warning_text)
+
+	def _warn_section_not_found(self, metric, idx):
+		warning_text = "section '" + metric['section'] + "' of metric " + str(idx) + " (" + metric['name'] + ")"
+		warning_text += " for endpoint '" + self.uri + "' could not be found. Skipping for this unit of time"
+		_log.warning(warning_text)
+
+	def scrape_all_metrics(self, metrics, endpoint_text, min_priority=None):
+		"""
+		Gets all bursts of all metrics from the endpoint text.
+
+		:param metrics: The parsed metrics to scrape.
+		:param endpoint_text: The text of the endpoint.
+		:param min_priority: If given, metrics and values with a priority below this are skipped.
+		:return: The bursts of all metrics that could be found.
+		"""
+		return list(self.iter_all_metrics(metrics, endpoint_text, min_priority=min_priority))
+
+	def iter_all_metrics(self, metrics, endpoint_text, min_priority=None, only=None):
+		"""
+		Gets all bursts of all metrics from the endpoint text one at a time, as each match is found. Each section is
+		located once, and each metric only searches the text of its own section. If the text that a reusable metric
+		searches is the same as the last time it was scraped, the bursts from that time are reused instead of scraping
+		it again; the bursts of reusable metrics are kept for this, so only the bursts of other metrics are never all
+		held in memory at once.
 
-	def scrape_all_metrics(self, metrics, endpoint_text):
+		The endpoint text is verified immediately rather than when the first burst is requested. Anything else that goes
+		wrong, such as a value that its conversion fails on, is only raised when that burst is reached, after every
+		burst before it has been given.
+
+		:param metrics: The parsed metrics to scrape.
+		:param endpoint_text: The text of the endpoint.
+		:param min_priority: If given, metrics and values with a priority below this are skipped.
+		:param only: If given, only the metrics at these indexes are scraped.
+		:rtype: ``Iterator[Burst]``
+		:return: The bursts of all metrics that could be found.
+		"""
 		if self.verify_pattern.search(endpoint_text) is None:
 			raise VerificationError("endpoint did not match expected content", endpoint_text)
+		section_texts = self.locate_sections(endpoint_text)
+		section_texts[None] = endpoint_text
+		return self._iter_all_metrics(metrics, section_texts, min_priority, only)
+
+	def _iter_all_metrics(self, metrics, section_texts, min_priority, only):
+		section_hashes = {}
 		idx = 0
-		all_bursts = []
 		for m in metrics:
-			bursts = self.scrape_metric(m, endpoint_text, idx=idx)
-			if bursts is not None:
-				all_bursts += bursts
+			if idx in self.disabled or (min_priority is not None and m['priority'] < min_priority):
+				idx += 1
+				continue
+			if only is not None and idx not in only:
+				idx += 1
+				continue
+			text = section_texts.get(m['section'])
+			if text is None:
+				self._warn_section_not_found(m, idx)
+				idx += 1
+				continue
+
+			budget = self._budget_of(m)
+			if m['reusable']:
+				if m['section'] not in section_hashes:
+					section_hashes[m['section']] = _hash_text(text)
+				text_hash = section_hashes[m['section']]
+				cached = self._parse_cache.get(idx)
+				if cached is not None and cached[0] == text_hash and cached[1] == min_priority:
+					self.reused_count += 1
+					bursts = cached[2]
+				else:
+					bursts = self._extract_within(m, text, idx, min_priority, budget)
+					if bursts is not None:
+						self._parse_cache[idx] = (text_hash, min_priority, bursts)
+				if bursts is not None:
+					yield from bursts
+			elif budget is not None:
+				# a metric that goes over its budget is skipped entirely rather than partially sent, so its bursts
+				# must all be extracted before any are given
+				bursts = self._extract_within(m, text, idx, min_priority, budget)
+				if bursts is not None:
+					yield from bursts
+			else:
+				yield from self._iter_metric_text(m, text, idx, min_priority)
 			idx += 1
-		return all_bursts
+
+	def extract_metric(self, metric, idx, endpoint_text, min_priority=None, known_hash=None):
+		"""
+		Gets all bursts of a single metric for another Endpoint, such as the one in the main process when this is called
+		in an extraction worker. Nothing about the metric is recorded in this Endpoint; the result is given to
+		record_extraction() of the other one, which keeps the parse cache and overrun counts. The endpoint text must
+		already have been verified.
+
+		:param metric: The parsed metric to scrape.
+		:param idx: The index of the metric within its endpoint.
+		:param endpoint_text: The text of the endpoint.
+		:param min_priority: If given, values of the metric with a priority below this are not included in the bursts.
+		:param known_hash: The hash of the text that the other Endpoint has cached bursts of this metric for, as given
+		by its cached_hash(). If the text is the same, the metric is not extracted again.
+		:rtype: ``(bytes, list[Burst], bool, float)``
+		:return: The hash of the text that the metric searches, or None if the metric is not reusable; the bursts, or
+		None if they are the cached ones or if the metric went over its budget; whether the metric went over its
+		budget; and the number of seconds that extraction took.
+		"""
+		text = endpoint_text
+		if metric['section'] is not None:
+			text = self.locate_sections(endpoint_text).get(metric['section'])
+			if text is None:
+				self._warn_section_not_found(metric, idx)
+				return None, [], False, 0.0
+		text_hash = _hash_text(text) if metric['reusable'] else None
+		if text_hash is not None and text_hash == known_hash:
+			return text_hash, None, False, 0.0
+		start = time.monotonic()
+		bursts = self._collect_within(metric, text, idx, min_priority, self._budget_of(metric))
+		return text_hash, bursts, bursts is None, time.monotonic() - start
+
+	def cached_hash(self, idx, min_priority=None):
+		"""
+		Gets the hash of the text that the cached bursts of a metric were scraped from.
+
+		:param idx: The index of the metric within its endpoint.
+		:param min_priority: The min_priority that the metric is being scraped with. Bursts cached with another one are
+		not used.
+		:rtype: ``bytes``
+		:return: The hash, or None if there are no cached bursts that can be used.
+		"""
+		cached = self._parse_cache.get(idx)
+		if cached is None or cached[1] != min_priority:
+			return None
+		return cached[0]
+
+	def record_extraction(self, metric, idx, min_priority, text_hash, bursts, overran, elapsed):
+		"""
+		Records the result of extract_metric() of another Endpoint as if the metric had been scraped by this one, and
+		gets the bursts to send.
+
+		:param metric: The parsed metric that was scraped.
+		:param idx: The index of the metric within its endpoint.
+		:param min_priority: The min_priority that the metric was scraped with.
+		:param text_hash: The hash, as given by extract_metric().
+		:param bursts: The bursts, as given by extract_metric().
+		:param overran: Whether the metric went over its budget, as given by extract_metric().
+		:param elapsed: The number of seconds that extraction took, as given by extract_metric().
+		:rtype: ``list[Burst]``
+		:return: The bursts of the metric.
+		"""
+		if overran:
+			self._record_overrun(metric, idx, elapsed, self._budget_of(metric))
+			return []
+		self._overruns.pop(idx, None)
+		if bursts is None:
+			self.reused_count += 1
+			cached = self._parse_cache.get(idx)
+			return cached[2] if cached is not None else []
+		if text_hash is not None:
+			self._parse_cache[idx] = (text_hash, min_priority, bursts)
+		return bursts
+
+	def _budget_of(self, metric):
+		return metric['time-budget'] if metric['time-budget'] is not None else self.time_budget
+
+	def _extract_within(self, metric, text, idx, min_priority, budget):
+		"""
+		Gets all bursts of a metric, giving up if it takes longer than the budget, and records whether it did.
+
+		:return: The bursts, or None if the metric went over its budget.
+		"""
+		start = time.monotonic()
+		bursts = self._collect_within(metric, text, idx, min_priority, budget)
+		if bursts is None:
+			self._record_overrun(metric, idx, time.monotonic() - start, budget)
+		else:
+			self._overruns.pop(idx, None)
+		return bursts
+
+	def _collect_within(self, metric, text, idx, min_priority, budget):
+		"""
+		Gets all bursts of a metric, giving up if it takes longer than the budget. Where possible, the extraction is
+		interrupted as soon as the budget runs out, even in the middle of a single regex search; otherwise, the time is
+		only checked between matches.
+
+		:return: The bursts, or None if the metric went over its budget.
+		"""
+		bursts = self._iter_metric_text(metric, text, idx, min_priority)
+		if budget is None:
+			return list(bursts)
+		deadline = time.monotonic() + budget
+		collected = []
+		try:
+			with _interrupt_after(budget):
+				for b in bursts:
+					collected.append(b)
+					if time.monotonic() > deadline:
+						raise ExtractionTimeout()
+		except ExtractionTimeout:
+			return None
+		return collected
+
+	def _record_overrun(self, metric, idx, elapsed, budget):
+		self.overrun_count += 1
+		count = self._overruns.get(idx, 0) + 1
+		self._overruns[idx] = count
+		msg = "metric " + str(idx) + " (" + metric['name'] + ") for endpoint '" + self.uri + "' took more than its "
+		msg += "budget of " + str(budget) + "s (gave up after " + "{:.3f}".format(elapsed) + "s)"
+		if count >= self.max_overruns:
+			self.disabled.add(idx)
+			self._parse_cache.pop(idx, None)
+			_log.error(msg + " " + str(count) + " times in a row; disabling it until the config is reloaded")
+		else:
+			_log.warning(msg + "; skipping for this unit of time")
+
+
+@contextlib.contextmanager
+def _interrupt_after(seconds):
+	"""
+	Raises ExtractionTimeout in the current thread once the given number of seconds have passed, if the platform
+	allows for it. The regex engine checks for signals while it searches, so this can interrupt a single search that
+	would otherwise run for a very long time. Signals can only be handled on the main thread, so nothing is done on
+	any other thread.
+	"""
+	if not hasattr(signal, 'setitimer') or threading.current_thread() is not threading.main_thread():
+		yield
+		return
+	old_handler = signal.signal(signal.SIGALRM, _raise_timeout)
+	try:
+		signal.setitimer(signal.ITIMER_REAL, seconds)
+		yield
+	finally:
+		try:
+			signal.setitimer(signal.ITIMER_REAL, 0)
+		finally:
+			# the alarm can still go off just before it is cancelled, and the handler must be put back even then
+			signal.signal(signal.SIGALRM, old_handler)
+
+
+def _raise_timeout(signum, frame):
+	raise ExtractionTimeout()
+
+
+def _hash_text(text):
+	return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
@@ -0,0 +1,126 @@
+"""
+Extraction of HTML forms from pages, such as the login form.
+"""
+import html.parser
+import logging
+
+_log = logging.getLogger(__name__)
+_log.setLevel(logging.DEBUG)
+
+# input types that are never sent with a form, or that need something that a scraper cannot give
+_UNSENT_INPUT_TYPES = ('button', 'reset', 'file', 'image')
+
+
+class FormParser(html.parser.HTMLParser):
+	"""
+	Parses the first form in an HTML document. Text can be given a piece at a time with feed(); once the end of the form
+	has been parsed, done is set and the rest of the document does not need to be given.
+
+	The form is a dict with 'action', 'method', and 'variables' keys. The action is None if the form does not have one,
+	the method is always in upper case, and the variables are the values that a browser would submit by default,
+	keyed by field name.
+	"""
+
+	def __init__(self):
+		super().__init__(convert_charrefs=True)
+		self.form = None
+		""":type : dict[str, Any]"""
+		self.done = False
+		self._text_field = None
+		self._text = []
+		self._select = None
+		self._option = None
+
+	def handle_starttag(self, tag, attrs):
+		if self.done:
+			return
+		attrs = dict((k, v if v is not None else '') for k, v in attrs)
+		if tag == 'form':
+			if self.form is None:
+				method = attrs.get('method', '').strip().upper()
+				self.form = {'action': attrs.get('action'), 'method': method or 'GET', 'variables': {}}
+			return
+		if self.form is None:
+			return
+		name = attrs.get('name', '')
+		if tag == 'input':
+			input_type = attrs.get('type', 'text').lower()
+			if name == '' or input_type in _UNSENT_INPUT_TYPES:
+				return
+			if input_type in ('checkbox', 'radio'):
+				if 'checked' in attrs:
+					self.form['variables'][name] = attrs.get('value', 'on')
+				return
+			self.form['variables'][name] = attrs.get('value', '')
+		elif tag == 'textarea' and name != '':
+			self._text_field = name
+			self._text = []
+		elif tag == 'select' and name != '':
+			self._select = {'name': name, 'first': None, 'selected': None}
+		elif tag == 'option' and self._select is not None:
+			self._option = {'value': attrs.get('value'), 'selected': 'selected' in attrs}
+			self._text = []
+
+	def handle_endtag(self, tag):
+		if self.done or self.form is None:
+			return
+		if tag == 'form':
+			self._end_option()
+			self._end_select()
+			self.done = True
+		elif tag == 'textarea' and self._text_field is not None:
+			self.form['variables'][self._text_field] = ''.join(self._text)
+			self._text_field = None
+		elif tag == 'option':
+			self._end_option()
+		elif tag == 'select':
+			self._end_option()
+			self._end_select()
+
+	def handle_data(self, data):
+		if self._text_field is not None or self._option is not None:
+			self._text.append(data)
+
+	def _end_option(self):
+		if self._option is None:
+			return
+		value = self._option['value']
+		if value is None:
+			value = ''.join(self._text).strip()
+		if self._select['first'] is None:
+			self._select['first'] = value
+		if self._option['selected']:
+			self._select['selected'] = value
+		self._option = None
+
+	def _end_select(self):
+		if self._select is None:
+			return
+		value = self._select['selected']
+		if value is None:
+			value = self._select['first']
+		if value is not None:
+			self.form['variables'][self._select['name']] = value
+		self._select = None
+
+
+def extract_form(text, chunk_size=4096):
+	"""
+	Gets the first form in an HTML document. The document is parsed a piece at a time, and parsing stops at the end of
+	the form.
+
+	:type text: ``str``
+	:param text: The HTML document.
+	:type chunk_size: ``int``
+	:param chunk_size: The number of characters to parse at a time.
+	:rtype: ``dict[str, Any]``
+	:return: The form, as described in FormParser, or None if the document does not contain a form.
+	"""
+	parser = FormParser()
+	for start in range(0, len(text), chunk_size):
+		parser.feed(text[start:start + chunk_size])
+		if parser.done:
+			break
+	else:
+		parser.close()
+	return parser.form
@@ -38,6 +38,12 @@ def _log_http_response(resp, full):
 		_log.debug("Body: " + str(resp.content))
 
 
+def _new_session():
+	session = requests.Session()
+	session.headers.update(_default_http_headers)
+	return session
+
+
 class AsyncHTTPError(Exception):
 	"""
 	Raised when at least one of the HTTP requests in an asynchronous group fails.
@@ -121,8 +127,23 @@ class HttpAgent(object):
 	def start_new_session(self):
 		if self._session is not None:
 			self._session.close()
-		self._session = requests.Session()
-		self._session.headers.update(_default_http_headers)
+		self._session = _new_session()
+
+	def swap_session(self, session):
+		"""
+		Replaces the current session without closing it, so that it can be put back later.
+
+		:type session: ``requests.Session``
+		:param session: The session to use. If None, a new session is started. This is done here rather than when the
+		session is next needed, so that there is no time in which another thread could start one as well.
+		:rtype: ``requests.Session``
+		:return: The session that was replaced, or None if there was not one.
+		"""
+		if session is None:
+			session = _new_session()
+		old_session = self._session
+		self._session = session
+		return old_session
 
 	def add_async_request(
 			self,
@@ -339,6 +360,50 @@ class HttpAgent(object):
 
 		self._session.cookies.update(cookies)
 
+	@property
+	def cookie_jar(self):
+		"""
+		The cookies of the current session. A session is started if there is not one.
+
+		:rtype: ``requests.cookies.RequestsCookieJar``
+		"""
+		if self._session is None:
+			self.start_new_session()
+		return self._session.cookies
+
+	def copy_cookies(self):
+		"""
+		Gets a copy of the cookies of the current session. Unlike iterating over cookie_jar, this can be done while
+		another thread is making a request that changes the cookies.
+
+		:rtype: ``list[http.cookiejar.Cookie]``
+		"""
+		jar = self.cookie_jar
+		# the jar holds this lock while it changes its cookies, but not while it is iterated over
+		with jar._cookies_lock:
+			return list(jar)
+
+	def cookie_expiry(self):
+		"""
+		Gets the time that the first of the cookies set for the host in the current session expires. Cookies that last
+		until the end of the browser session never expire for the agent, so they are not counted.
+
+		:rtype: ``float``
+		:return: The expiry time as a unix timestamp, or None if no cookie for the host has one.
+		"""
+		if self._session is None:
+			return None
+		expiry = None
+		for cookie in self._session.cookies:
+			if cookie.expires is None:
+				continue
+			domain = cookie.domain.lstrip('.')
+			if domain != '' and not (self._host == domain or self._host.endswith('.' + domain)):
+				continue
+			if expiry is None or cookie.expires < expiry:
+				expiry = cookie.expires
+		return expiry
+
 	@property
 	def log_full_request(self):
 		"""
@@ -479,3 +544,73 @@ class HttpAgent(object):
 		else:
 			prepared = req.prepare()
 		return prepared
+
+
+class RequestCoalescer(object):
+	"""
+	Shares the responses of identical requests made through an HttpAgent, so that a page that is needed more than once
+	is only downloaded once. Only GET requests without a payload are shared; anything else is always sent. Responses
+	are kept until clear() is called, or for as long as the RequestCoalescer is; the scraper uses a new one each tick.
+	"""
+
+	def __init__(self, agent):
+		"""
+		Creates a new RequestCoalescer.
+
+		:type agent: ``HttpAgent``
+		:param agent: The agent that requests are sent with.
+		"""
+		self._agent = agent
+		self._responses = {}
+		""":type : dict[tuple, (int, Any)]"""
+		self.hits = 0
+		self.misses = 0
+
+	def request(self, method, uri, host=None, query=None, payload=None, auth=False, **kwargs):
+		"""
+		Sends an HTTP request, or gives the response of an identical request that was already sent. Takes the same
+		parameters as HttpAgent.request().
+
+		:rtype: ``(int, dict | list | str | None)``
+		:return: A tuple containing the HTTP status code and the response payload.
+		"""
+		if method.upper() != 'GET' or payload is not None:
+			return self._agent.request(method, uri, host=host, query=query, payload=payload, auth=auth, **kwargs)
+		key = self._key(uri, host, query, auth, kwargs)
+		if key in self._responses:
+			self.hits += 1
+			_log.debug("Reusing response for " + method + " " + uri)
+			return self._responses[key]
+		self.misses += 1
+		response = self._agent.request(method, uri, host=host, query=query, payload=payload, auth=auth, **kwargs)
+		self._responses[key] = response
+		return response
+
+	def store(self, uri, response, host=None, query=None, auth=False, **kwargs):
+		"""
+		Adds the response of a GET request that was sent without the RequestCoalescer, so that an identical request
+		made through it gives that response.
+
+		:type uri: ``str``
+		:param uri: The URI that was requested.
+		:type response: ``(int, Any)``
+		:param response: The HTTP status code and response payload, as given by HttpAgent.request().
+		:param host: The host that the request was sent to, as given to HttpAgent.request().
+		:param query: The query parameters of the request, as given to HttpAgent.request().
+		:param auth: The auth of the request, as given to HttpAgent.request().
+		"""
+		self._responses[self._key(uri, host, query, auth, kwargs)] = response
+
+	def clear(self):
+		"""
+		Forgets all responses, so that every request after this is sent again.
+		"""
+		self._responses = {}
+
+	def _key(self, uri, host, query, auth, kwargs):
+		if host is None:
+			host = self._agent.host
+		query_key = None
+		if query is not None:
+			query_key = tuple(sorted((str(k), str(query[k])) for k in query))
+		return 'GET', host, uri, query_key, auth, tuple(sorted(kwargs.items()))
@@ -0,0 +1,202 @@
+"""
+Checks of config regexes for constructs that are likely to make scraping slow, such as ones that can backtrack
+catastrophically.
+"""
+import logging
+import re
+import time
+
+try:
+	from re import _parser as sre_parse
+	from re import _constants as sre_constants
+except ImportError:
+	# before python 3.11
+	import sre_parse
+	import sre_constants
+
+_log = logging.getLogger(__name__)
+_log.setLevel(logging.DEBUG)
+
+LINT_OFF = 'off'
+LINT_WARN = 'warn'
+LINT_REFUSE = 'refuse'
+LINT_MODES = (LINT_OFF, LINT_WARN, LINT_REFUSE)
+
+_REPEATS = tuple(getattr(sre_constants, name) for name in ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT')
+	if hasattr(sre_constants, name))
+
+# characters that character sets are compared over when checking whether they overlap
+_ALPHABET = [chr(c) for c in range(256)]
+
+_CATEGORIES = {
+	sre_constants.CATEGORY_DIGIT: lambda c: c.isdigit(),
+	sre_constants.CATEGORY_NOT_DIGIT: lambda c: not c.isdigit(),
+	sre_constants.CATEGORY_SPACE: lambda c: c.isspace(),
+	sre_constants.CATEGORY_NOT_SPACE: lambda c: not c.isspace(),
+	sre_constants.CATEGORY_WORD: lambda c: c.isalnum() or c == '_',
+	sre_constants.CATEGORY_NOT_WORD: lambda c: not (c.isalnum() or c == '_'),
+}
+
+
+def lint_pattern(pattern):
+	"""
+	Checks a regex for constructs that are likely to be slow. The following are found:
+
+	* Nested quantifiers, such as '(a+)+', where an unbounded repeat contains another unbounded repeat. These can take
+	exponential time to fail to match.
+	* A leading '.*' that is not anchored, which is tried at every position of the text and scans to the end each
+	time.
+	* Adjacent unbounded repeats that can match the same characters, such as '\\s*\\s+' or '[^<]*.*', which can split
+	the same text between them in many ways while backtracking.
+
+	:type pattern: ``re.__Regex``
+	:param pattern: The compiled pattern to check.
+	:rtype: ``list[str]``
+	:return: A description of each problem that was found. Empty if there were none.
+	"""
+	parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+	dotall = bool(pattern.flags & re.DOTALL)
+	problems = []
+	_find_nested_repeats(parsed, problems)
+	first = _edge_item(parsed, last=False)
+	if first is not None and _is_unbounded_repeat(first) and list(first[1][2]) == [(sre_constants.ANY, None)]:
+		problems.append("starts with an unanchored '.*', which scans to the end of the text from every position")
+	_find_overlapping_repeats(parsed, dotall, problems)
+	return problems
+
+
+def time_pattern(pattern, text, repeat=3):
+	"""
+	Measures how long it takes to find every match of a regex in a text.
+
+	:type pattern: ``re.__Regex``
+	:param pattern: The compiled pattern to time.
+	:type text: ``str``
+	:param text: The text to search.
+	:type repeat: ``int``
+	:param repeat: The number of times to search. The fastest is used, to reduce noise from the rest of the system.
+	:rtype: ``float``
+	:return: The number of seconds that it took.
+	"""
+	best = None
+	for _ in range(repeat):
+		start = time.perf_counter()
+		for _ in pattern.finditer(text):
+			pass
+		elapsed = time.perf_counter() - start
+		if best is None or elapsed < best:
+			best = elapsed
+	return best
+
+
+def _subpatterns(op, av):
+	"""Gets the subpatterns that an item of a parsed pattern contains."""
+	if op in _REPEATS:
+		return [av[2]]
+	elif op is sre_constants.SUBPATTERN:
+		return [av[-1]]
+	elif op is sre_constants.BRANCH:
+		return av[1]
+	elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+		return [av[1]]
+	elif op is sre_constants.GROUPREF_EXISTS:
+		return [p for p in av[1:] if p is not None]
+	elif hasattr(sre_constants, 'ATOMIC_GROUP') and op is sre_constants.ATOMIC_GROUP:
+		return [av]
+	return []
+
+
+def _is_unbounded_repeat(item):
+	op, av = item
+	return op in _REPEATS and av[1] == sre_constants.MAXREPEAT
+
+
+def _contains_unbounded_repeat(subpattern):
+	for op, av in subpattern:
+		if _is_unbounded_repeat((op, av)):
+			return True
+		if any(_contains_unbounded_repeat(p) for p in _subpatterns(op, av)):
+			return True
+	return False
+
+
+def _find_nested_repeats(subpattern, problems):
+	for op, av in subpattern:
+		if _is_unbounded_repeat((op, av)):
+			if _contains_unbounded_repeat(av[2]):
+				problems.append("has a nested unbounded quantifier, which can backtrack catastrophically")
+				# one report per outermost repeat is enough
+				continue
+		for p in _subpatterns(op, av):
+			_find_nested_repeats(p, problems)
+
+
+def _edge_item(subpattern, last):
+	"""Gets the first or last item of a parsed pattern, looking inside any groups that it starts or ends with."""
+	items = list(subpattern)
+	while len(items) > 0:
+		op, av = items[-1] if last else items[0]
+		if op is sre_constants.SUBPATTERN:
+			items = list(av[-1])
+			continue
+		return op, av
+	return None
+
+
+def _find_overlapping_repeats(subpattern, dotall, problems):
+	items = list(subpattern)
+	for i in range(len(items)):
+		for p in _subpatterns(*items[i]):
+			_find_overlapping_repeats(p, dotall, problems)
+		if i == 0:
+			continue
+		before = _edge_item([items[i - 1]], last=True)
+		after = _edge_item([items[i]], last=False)
+		if before is None or after is None:
+			continue
+		if not _is_unbounded_repeat(before) or not _is_unbounded_repeat(after):
+			continue
+		before_chars = _single_char_set(before[1][2], dotall)
+		after_chars = _single_char_set(after[1][2], dotall)
+		if before_chars is not None and after_chars is not None and len(before_chars & after_chars) > 0:
+			problems.append("has adjacent unbounded quantifiers that can match the same characters")
+
+
+def _single_char_set(subpattern, dotall):
+	"""
+	Gets the characters that a parsed pattern matches, if it matches exactly one character. Only characters in
+	_ALPHABET are considered.
+	"""
+	items = list(subpattern)
+	if len(items) != 1:
+		return None
+	op, av = items[0]
+	if op is sre_constants.LITERAL:
+		return {chr(av)}
+	elif op is sre_constants.NOT_LITERAL:
+		return set(c for c in _ALPHABET if c != chr(av))
+	elif op is sre_constants.ANY:
+		return set(c for c in _ALPHABET if dotall or c != '\n')
+	elif op is sre_constants.IN:
+		return _in_set(av)
+	return None
+
+
+def _in_set(members):
+	negate = False
+	chars = set()
+	for op, av in members:
+		if op is sre_constants.NEGATE:
+			negate = True
+		elif op is sre_constants.LITERAL:
+			chars.add(chr(av))
+		elif op is sre_constants.RANGE:
+			chars.update(c for c in _ALPHABET if av[0] <= ord(c) <= av[1])
+		elif op is sre_constants.CATEGORY and av in _CATEGORIES:
+			chars.update(c for c in _ALPHABET if _CATEGORIES[av](c))
+		else:
+			# something that cannot be compared, so assume it could match anything
+			chars.update(_ALPHABET)
+	if negate:
+		return set(_ALPHABET) - chars
+	return chars
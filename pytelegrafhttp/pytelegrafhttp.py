@@ -5,9 +5,12 @@ import logging
 import logging.handlers
 import re
 import sys
-from . import scrape, daemon, clock as tickclock, util
+from . import daemon, schedule, snapshot, clock as tickclock, util
 import os
 
+# scrape is imported only where it is used, as it loads requests and the telegraf client, which the commands that only
+# talk to a running scraper do not need
+
 # all new handlers should go in the module-level logger, so we get the package logger
 _log = logging.getLogger('pytelegrafhttp')
 
@@ -19,18 +22,34 @@ class _SystemReload(BaseException):
 
 
 def start(config_file: str='config.py', no_cookies=False, disable_antiflood=False):
+	from . import scrape
 	os_logs = []
 	conf = None
 	main_log = None
 	err_log = None
 	secs_per_tick = 0.0
 	daemon_com = daemon.DaemonCommunicator()
-	scraper = scrape.PageScraper(antiflood=not disable_antiflood)
+	scraper = scrape.TargetGroup(antiflood=not disable_antiflood)
 	clock = tickclock.TickClock()
+	scheduler = schedule.Scheduler()
+	due_endpoints = []
+	# while waiting for the next tick, whether it is waiting and the monotonic time it should wake up at, if known
+	waiting = False
+	wake_time = None
+
+	def start_schedule():
+		nonlocal last_good_tick, due_endpoints
+		last_good_tick = clock.start(secs_per_tick).tick
+		jobs = []
+		for idx, ep in enumerate(scraper.endpoints):
+			interval = ep['interval'] if ep['interval'] is not None else secs_per_tick
+			jobs.append((idx, interval, ep['offset']))
+		scheduler.start(clock.monotonic, jobs)
+		due_endpoints = scheduler.pop_due(clock.monotonic)
 
 	def load_config():
-		nonlocal conf, os_logs, main_log, err_log, secs_per_tick, last_good_tick
-		conf = _config_from_path(config_file)
+		nonlocal conf, os_logs, main_log, err_log, secs_per_tick
+		conf, parsed = _parsed_config_from_path(config_file)
 		main_log = conf.log_main_log_path
 		err_log = conf.log_error_log_path
 		max_num = int(conf.log_file_keep_count)
@@ -47,18 +66,22 @@ def start(config_file: str='config.py', no_cookies=False, disable_antiflood=Fals
 			_log.addHandler(os_log)
 
 		secs_per_tick = int(conf.time_collection_interval)
+		overrun_policy = util.get_config_str(conf, 'time_overrun_policy', tickclock.DEFAULT_OVERRUN_POLICY)
+		if overrun_policy not in tickclock.OVERRUN_POLICIES:
+			msg = "overrun policy must be one of " + ", ".join("'" + p + "'" for p in tickclock.OVERRUN_POLICIES)
+			raise util.ConfigException(msg, 'time_overrun_policy')
+		clock.use_overrun_policy(overrun_policy)
+		scheduler.set_overrun_policy(overrun_policy)
 		daemon_com.load_config(conf)
-		scraper.load_config(conf)
-		last_good_tick = clock.start(secs_per_tick).tick  # must be here because this function is called via signal
+		scraper.load_config(conf, parsed)
+		start_schedule()  # must be here because this function is called via signal
 
 	def reload_scraper_config():
-		nonlocal conf, os_logs, main_log, err_log, secs_per_tick, last_good_tick
 		_log.info("Received SIGHUP; reloading config")
 		_log.removeHandler(err_log)
 		_log.removeHandler(main_log)
 		for ol in os_logs:
 			_log.removeHandler(ol)
-		conf = _config_from_path(config_file)
 		clock.stop()
 		clock.reset()
 
@@ -73,27 +96,68 @@ def start(config_file: str='config.py', no_cookies=False, disable_antiflood=Fals
 		if load_failed:
 			raise SystemExit()
 
+	def status():
+		activity, activity_secs = scraper.activity
+		limit = max(2 * secs_per_tick, 30)
+		if waiting and wake_time is not None:
+			# endpoints can be due much less often than every tick, so waiting is only stuck once the wake-up is overdue
+			stuck = (tickclock.now_monotonic() - wake_time) / 1000000000.0 > limit
+		else:
+			# nothing else that the scraper does should take this long
+			stuck = activity_secs > limit
+		return {
+			'pid': os.getpid(),
+			'tick': clock.tick,
+			'last-good-tick': last_good_tick,
+			'activity': activity,
+			'activity-seconds': activity_secs,
+			'stuck': stuck
+		}
+
 	load_config()
 	_setup_traps()
 	daemon_com.signal_started()
+	daemon_com.start_control(status, {
+		daemon.COMMAND_STATS: lambda: scraper.stats,
+		daemon.COMMAND_FLUSH: lambda: {'written': scraper.save_state()}
+	})
 
 	# main loop
 	try:
 		scraper.setup(no_cookies)
-		last_good_tick = clock.stop().reset().start(secs_per_tick).tick
+		clock.stop().reset()
+		start_schedule()
 		while scraper.running:
 			try:
 				# noinspection PyBroadException
 				try:
-					scraper.run_tick(clock)
+					scraper.run_tick(clock, due_endpoints)
 					last_good_tick = clock.tick
 				except scrape.FatalError as e:
 					raise e
+				except scrape.AuthError:
+					_log.warning("Session expired and could not be recovered in tick " + str(clock.tick))
+					_log.warning("Logging in again before the next tick")
 				except Exception:
 					_log.exception("Problem in tick " + str(clock.tick))
 					_log.error("Last good tick: " + str(last_good_tick))
 				if scraper.running:
-					clock.advance()
+					# any login that is needed soon, including for a session that expired in the tick that just ended,
+					# is done while waiting for the next tick instead of during it
+					# noinspection PyBroadException
+					try:
+						scraper.keep_alive(_seconds_until(scheduler.next_due, secs_per_tick), secs_per_tick)
+					except scrape.FatalError as e:
+						raise e
+					except Exception:
+						_log.exception("Problem logging in after tick " + str(clock.tick))
+					wake_time = scheduler.next_due
+					waiting = True
+					try:
+						clock.advance(wake_time)
+					finally:
+						waiting = False
+					due_endpoints = scheduler.pop_due(clock.monotonic)
 			except _SystemReload:
 				reload_scraper_config()
 		_log.info("Scraper is no longer running.")
@@ -120,6 +184,9 @@ def stop(pid: int, config_file: str='config.py'):
 	conf = _config_from_path(config_file)
 	daemon_com = daemon.DaemonCommunicator()
 	daemon_com.load_config(conf)
+	if daemon.CONTROL_SUPPORTED:
+		daemon_com.send_command(pid, daemon.COMMAND_STOP)
+		return
 	os.kill(pid, signal.SIGTERM)
 	daemon_com.wait_for_termination(pid)
 
@@ -129,11 +196,30 @@ def reload(pid: int, config_file: str='config.py'):
 	conf = _config_from_path(config_file)
 	daemon_com = daemon.DaemonCommunicator()
 	daemon_com.load_config(conf)
+	if daemon.CONTROL_SUPPORTED:
+		daemon_com.send_command(pid, daemon.COMMAND_RELOAD)
+		return
 	daemon_com.signal_reload_start(pid)
 	os.kill(pid, signal.SIGHUP)
 	daemon_com.wait_for_reload(pid)
 
 
+def control(pid: int, command: str, config_file: str='config.py'):
+	"""
+	Sends a command to a running scraper over its control socket.
+
+	:param pid: PID of the scraper.
+	:param command: The command. Must be one of daemon.COMMANDS.
+	:param config_file: The config file, which gives the directory that the control socket is in.
+	:rtype: ``dict[str, Any]``
+	:return: The response of the scraper, with its 'status' and the 'result' of the command if it has one.
+	"""
+	conf = _config_from_path(config_file)
+	daemon_com = daemon.DaemonCommunicator()
+	daemon_com.load_config(conf)
+	return daemon_com.send_command(pid, command)
+
+
 def _handle_signal(signal_name):
 	if signal_name == "SIGHUP":
 		raise _SystemReload()
@@ -156,13 +242,31 @@ def _setup_traps():
 
 
 def _config_from_path(path):
-	from importlib.machinery import SourceFileLoader
-	# We are aware that load_module() has been deprecated,
-	# but it's the only way to do this without bumping the required python version up to 3.5
-	config = SourceFileLoader('config', path).load_module()
+	config, _ = snapshot.load(path, with_parsed=False)
 	return config
 
 
+def _parsed_config_from_path(path):
+	"""
+	Loads a config file along with the parsed form of the config of each of its targets. If the file has not changed
+	since it was last loaded, both are read from its snapshot instead of executing, parsing, and linting it again.
+
+	:type path: ``str``
+	:param path: The path of the config file.
+	:rtype: ``(Any, list[(str, dict[str, Any])])``
+	:return: The config and the parsed targets, as given to TargetGroup.load_config().
+	"""
+	from . import scrape
+	config, parsed = snapshot.load(path)
+	if parsed is None:
+		parsed = scrape.parse_config_targets(config)
+		sample_pages = []
+		for _, target_conf in scrape.get_target_configs(config):
+			sample_pages += [ep['sample-page'] for ep in target_conf.scraper_endpoints if ep.get('sample-page') is not None]
+		snapshot.save(path, config, parsed, sample_pages)
+	return config, parsed
+
+
 def _setup_file_loggers(out_log, err_log, size, max_num):
 	main_file_handler = logging.handlers.RotatingFileHandler(filename=out_log, maxBytes=size, backupCount=max_num)
 	main_file_handler.setFormatter(logging.Formatter(fmt="%(asctime)-22s: [%(levelname)-10s] %(message)s"))
@@ -174,6 +278,22 @@ def _setup_file_loggers(out_log, err_log, size, max_num):
 	return main_file_handler, err_file_handler
 
 
+def _seconds_until(monotonic_time, default):
+	"""
+	Gets the number of seconds from now until a monotonic time.
+
+	:type monotonic_time: ``int``
+	:param monotonic_time: The monotonic time, in nanoseconds. If None, the default is given.
+	:type default: ``float``
+	:param default: The number of seconds to give if there is no time.
+	:rtype: ``float``
+	:return: The number of seconds, which is 0 if the time has already passed.
+	"""
+	if monotonic_time is None:
+		return default
+	return max(monotonic_time - tickclock.now_monotonic(), 0) / 1000000000.0
+
+
 def _size_to_bytes(size):
 	"""
 	Parse a string with a size into a number of bytes. I.e. parses "10m", "10MB", "10 M" and other variations into the
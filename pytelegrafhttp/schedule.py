@@ -0,0 +1,124 @@
+"""
+Scheduling of work that repeats at independent intervals.
+"""
+import heapq
+import logging
+from .clock import next_target, OVERRUN_POLICIES, OVERRUN_REPHASE, DEFAULT_OVERRUN_POLICY
+
+_log = logging.getLogger(__name__)
+_log.setLevel(logging.DEBUG)
+
+
+class Scheduler(object):
+	"""
+	Decides which of a set of repeating jobs are due to run. Each job has its own interval and phase offset, and the
+	next time that each job is due is kept in a min-heap so that finding the next job to run does not require checking
+	all of them.
+
+	Jobs are identified by a key, which can be any hashable value. All times are monotonic times in nanoseconds, as
+	given by clock.now_monotonic().
+	"""
+
+	def __init__(self, overrun_policy=DEFAULT_OVERRUN_POLICY):
+		"""
+		Creates a new Scheduler.
+
+		:type overrun_policy: ``str``
+		:param overrun_policy: What to do when a job is not run until after the time that its next run is due. Must be
+		one of the values in clock.OVERRUN_POLICIES.
+		"""
+		if overrun_policy not in OVERRUN_POLICIES:
+			raise ValueError("Bad overrun policy: " + repr(overrun_policy))
+		self._overrun_policy = overrun_policy
+		self._heap = []
+		""":type : list[(int, int, Any)]"""
+		self._intervals = {}
+		""":type : dict[Any, int]"""
+		self._seq = 0
+		# jobs that are due within this amount of time are considered due now, so that sleeping until a job is due
+		# does not miss it by the few milliseconds of imprecision in waking up.
+		self._tolerance = 10 * 1000000
+
+	def start(self, start_time, jobs):
+		"""
+		Clears all current jobs and schedules the given ones, relative to the given start time.
+
+		:type start_time: ``int``
+		:param start_time: The time that the schedule starts at. Each job is first due at this time plus its offset.
+		:type jobs: ``list[(Any, float, float)]``
+		:param jobs: The jobs to schedule. Each is a tuple containing the key of the job, the number of seconds between
+		each run of the job, and the number of seconds after the start time that the job is first due.
+		:rtype: ``Scheduler``
+		:return: This Scheduler.
+		"""
+		self._heap = []
+		self._intervals = {}
+		for key, interval, offset in jobs:
+			if interval <= 0:
+				raise ValueError("job interval must be greater than 0: " + repr(key))
+			self._intervals[key] = int(interval * 1000000000)
+			self._push(start_time + int(offset * 1000000000), key)
+		_log.debug("Scheduler started with " + str(len(self._intervals)) + " job(s)")
+		return self
+
+	def pop_due(self, now):
+		"""
+		Gets all jobs that are due to run and schedules their next run. If a job's next run would already be in the
+		past, it is scheduled according to the overrun policy.
+
+		:type now: ``int``
+		:param now: The current time.
+		:rtype: ``list[Any]``
+		:return: The keys of the due jobs, in the order that they were first given to start().
+		"""
+		due = []
+		limit = now + self._tolerance
+		while len(self._heap) > 0 and self._heap[0][0] <= limit:
+			due.append(heapq.heappop(self._heap))
+		for due_time, seq, key in due:
+			interval = self._intervals[key]
+			if self._overrun_policy == OVERRUN_REPHASE and due_time + interval <= limit:
+				# the job is being run now, so a new phase is measured from now rather than from when it was due
+				next_time, missed = now + interval, 0
+			else:
+				next_time, missed = next_target(due_time, interval, limit, self._overrun_policy)
+			if missed > 0:
+				_log.debug("Skipping " + str(missed) + " missed run(s) of " + repr(key))
+			self._push(next_time, key, seq)
+		due.sort(key=lambda d: d[1])
+		return [key for due_time, seq, key in due]
+
+	def set_overrun_policy(self, value):
+		"""
+		Sets what to do when a job is not run until after the time that its next run is due.
+		:type value: ``str``
+		:param value: The overrun policy. Must be one of the values in clock.OVERRUN_POLICIES.
+		:rtype: ``Scheduler``
+		:return: This Scheduler.
+		"""
+		if value not in OVERRUN_POLICIES:
+			raise ValueError("Bad overrun policy: " + repr(value))
+		self._overrun_policy = value
+		return self
+
+	@property
+	def next_due(self):
+		"""
+		The time that the next job is due at.
+		:rtype: ``int``
+		:return: The next due time, or None if there are no jobs scheduled.
+		"""
+		if len(self._heap) == 0:
+			return None
+		return self._heap[0][0]
+
+	def __len__(self):
+		return len(self._heap)
+
+	def _push(self, due_time, key, seq=None):
+		# sequence number breaks ties between jobs due at the same time, so keys never need to be compared and jobs
+		# that are due at the same time keep their original order.
+		if seq is None:
+			seq = self._seq
+			self._seq += 1
+		heapq.heappush(self._heap, (due_time, seq, key))
@@ -3,7 +3,7 @@ Contains scraper class for system.
 """
 from .clock import TickClock
 from .endpoint import Endpoint
-from . import util, http
+from . import util, http, aggregate, lint, workers, forms, state
 import base64
 import re
 import time
@@ -13,12 +13,31 @@ import logging
 from .clock import now_ts
 import pickle
 import html
+import os
+import threading
+import types
 from telegraf.client import TelegrafClient
 
 
 _log = logging.getLogger(__name__)
 _log.setLevel(logging.DEBUG)
 
+# number of the most recent session lifetimes that are used to predict when a session will expire
+_SESSION_LIFETIMES_KEPT = 5
+
+# how long the page gotten by the session probe at startup can stand in for a request made by the first tick
+_PROBE_REUSE_SECONDS = 10.0
+
+# stands in for a session probe config that is not given, which probes the first endpoint
+_DEFAULT_PROBE = object()
+
+# the config keys that each target in scraper_targets can give for itself; everything else is shared by all targets
+TARGET_KEYS = (
+	'scraper_use_ssl', 'scraper_host', 'scraper_username', 'scraper_password', 'scraper_login_steps',
+	'scraper_logged_out_pattern', 'scraper_bot_kicked_pattern', 'scraper_endpoints', 'scraper_session_probe',
+	'scraper_regex_lint', 'scraper_regex_time_budget', 'env_state_file', 'env_cookies_file'
+)
+
 
 class FatalError(Exception):
 	"""
@@ -82,10 +101,85 @@ class AuthError(Exception):
 		super().__init__(msg)
 
 
+class _TargetLogAdapter(logging.LoggerAdapter):
+	"""
+	Puts the name of the target that a message is about at the start of it.
+	"""
+
+	def process(self, msg, kwargs):
+		return "[" + self.extra['target'] + "] " + str(msg), kwargs
+
+
+class TelegrafOutputs(object):
+	"""
+	The telegraf clients that metrics are sent to, keyed by destination name. Can be shared by several PageScrapers, so
+	that they send through the same clients.
+	"""
+
+	def __init__(self):
+		self._clients = {}
+		""":type : dict[str, TelegrafClient]"""
+		self._confs = {}
+
+	def update(self, tele_confs):
+		"""
+		Sets the destinations. Clients are only created for destinations that are new or have changed.
+
+		:type tele_confs: ``dict[str, dict[str, Any]]``
+		:param tele_confs: The parsed destinations.
+		"""
+		clients = {}
+		for tele in tele_confs:
+			client_conf = tele_confs[tele]
+			if tele in self._clients and _same_config(client_conf, self._confs.get(tele)):
+				clients[tele] = self._clients[tele]
+			else:
+				clients[tele] = TelegrafClient(port=client_conf['port'], tags=client_conf['tags'])
+		self._clients = clients
+		self._confs = tele_confs
+
+	def get(self, name):
+		"""
+		Gets the client of a destination.
+
+		:type name: ``str``
+		:param name: The name of the destination.
+		:rtype: ``TelegrafClient``
+		:return: The client, or None if there is no such destination.
+		"""
+		return self._clients.get(name)
+
+	@property
+	def clients(self):
+		"""
+		:rtype: ``dict[str, TelegrafClient]``
+		:return: The clients, keyed by destination name.
+		"""
+		return dict(self._clients)
+
+
 class PageScraper(object):
 
-	def __init__(self, antiflood):
+	def __init__(self, antiflood, name=None, outputs=None, pool=None):
+		"""
+		Creates a new PageScraper.
+
+		:type antiflood: ``bool``
+		:param antiflood: Whether to wait between the requests of multi-request operations such as logging in.
+		:type name: ``str``
+		:param name: The name of the target that this scraper scrapes, when it is one of several. Its statistics are
+		tagged with it.
+		:type outputs: ``TelegrafOutputs``
+		:param outputs: The telegraf clients to send through, if they are shared with other scrapers. If not given, the
+		scraper has its own.
+		:type pool: ``workers.ExtractionPool``
+		:param pool: The extraction pool to use, if it is shared with other scrapers; see use_pool(). If not given, the
+		scraper starts its own as configured.
+		"""
 		self._antiflood = antiflood
+		self._name = name
+		# with several targets, each message says which one it is about
+		self._log = _log if name is None else _TargetLogAdapter(_log, {'target': name})
 		self._client = http.HttpAgent('localhost', request_payload='form', response_payload='text')
 		self._running = False
 		self._agent = False
@@ -93,54 +187,167 @@ class PageScraper(object):
 		self._password = None
 		self._login_steps = None
 		self._endpoints = None
+		self._endpoint_scrapers = []
 		self._logged_in = False
 		self._login_response = None
 		self._login_form = None
 		self._cookies_file = None
 		self._state_file = None
 		self._save_frequency = 0
+		# monotonic time of the last save of the state, or None before the first tick
+		self._last_save = None
 		self._logged_out_pattern = None
 		self._bot_kicked_pattern = None
-		self._telegraf_clients = {}
+		self._outputs = outputs if outputs is not None else TelegrafOutputs()
+		self._stats_dest = None
+		self._stats = _new_stats()
+		self._shed_priority = 0
+		self._shed_cadence = 1
+		self._shedding = False
+		self._shed_ticks = 0
+		self._endpoint_costs = {}
+		self._pool = pool if pool is not None else workers.ExtractionPool(0, 0)
+		self._pool_shared = pool is not None
+		# the index in the pool of the first endpoint of this scraper, when the pool is shared
+		self._pool_offset = 0
+		self._requests = None
+		self._login_cost = None
+		self._relogged_in_tick = False
+		self._session_start = None
+		self._session_lifetimes = []
+		self._login_form_schema = None
+		self._session_probe = None
+		self._probe_response = None
+		self._state = None
+		self._last_tick = None
+		self._last_values = {}
+		# state is also saved from the control thread when a flush is requested, so the main thread holds this while it
+		# changes state that is saved by iterating over it
+		self._state_lock = threading.RLock()
+		self._activity = ('starting', time.monotonic())
+		# the config that the session and the extraction pool were set up with, to tell if a reload changes them
+		self._session_conf = None
+		self._pool_conf = None
 		super().__init__()
 
-	def load_config(self, conf):
-		# try to load config before setting values, so a later one being invalid does not leave us in a
+	def load_config(self, conf, parsed=None):
+		"""
+		Sets up the scraper from a config. Only the parts of the scraper whose config changed are rebuilt.
+
+		:type conf: ``module``
+		:param conf: The config.
+		:type parsed: ``dict[str, Any]``
+		:param parsed: The config as already given by parse_config(), such as from a config snapshot. If not given, the
+		config is parsed.
+		"""
+		# parse the whole config before setting values, so a later one being invalid does not leave us in a
 		# partially-updated state
-		logged_out_pattern = util.get_config_regex(conf, 'scraper_logged_out_pattern')
-		bot_kicked_pattern = util.get_config_regex(conf, 'scraper_bot_kicked_pattern')
-		ssl = util.get_config_bool(conf, 'scraper_use_ssl')
-		host = util.get_config_str(conf, 'scraper_host')
-		user = util.get_config_str(conf, 'scraper_username')
-		passwd = util.get_config_str(conf, 'scraper_password')
-		login_steps = parse_config_login_steps(conf.scraper_login_steps, 'scraper_login_steps')
-		endpoints = parse_config_endpoints(conf.scraper_endpoints, 'scraper_endpoints')
-		tele_confs = parse_config_telegraf_clients(conf.scraper_telegraf_destinations, 'scraper_telegraf_destinations')
-		cookies_file = util.get_config_str(conf, 'env_cookies_file')
-		state_file = util.get_config_str(conf, 'env_state_file')
-		save_freq = util.get_config_int(conf, 'time_save_frequency')
-		full_response_logging = util.get_config_bool(conf, 'log_full_http_responses')
-		full_request_logging = util.get_config_bool(conf, 'log_full_http_requests')
-
-		self._logged_out_pattern = logged_out_pattern
-		self._bot_kicked_pattern = bot_kicked_pattern
-		self._client.ssl = ssl
-		self._client.host = host
-		self._client.log_full_response = full_response_logging
-		self._client.log_full_request = full_request_logging
-		self._user = user
-		self._password = base64.b85encode(passwd.encode('utf-8'))
-		self._login_steps = login_steps
+		if parsed is None:
+			parsed = parse_config(conf)
+
+		# only what changed is rebuilt, so that a reload does not throw away the session, connections, or caches
+		session_conf = (parsed['ssl'], parsed['host'], parsed['user'], parsed['passwd'], parsed['login_steps'])
+		session_changed = self._session_conf is None or not _same_config(session_conf, self._session_conf)
+		pool_conf = (parsed['worker_count'], parsed['worker_timeout'], parsed['metric_budget'], parsed['endpoints'])
+		pool_changed = self._pool_conf is None or not _same_config(pool_conf, self._pool_conf)
+
+		self._logged_out_pattern = parsed['logged_out_pattern']
+		self._bot_kicked_pattern = parsed['bot_kicked_pattern']
+		self._client.ssl = parsed['ssl']
+		self._client.host = parsed['host']
+		self._client.log_full_response = parsed['full_response_logging']
+		self._client.log_full_request = parsed['full_request_logging']
+		self._user = parsed['user']
+		self._password = base64.b85encode(parsed['passwd'].encode('utf-8'))
+		self._login_steps = parsed['login_steps']
+		self._session_probe = parsed['session_probe']
+		self._session_conf = session_conf
+		self._update_endpoints(parsed['endpoints'], parsed['metric_budget'], parsed['max_overruns'])
+		if self._state is not None and parsed['state_file'] != self._state_file:
+			self._state.flush()
+			self._close_state()
+		self._cookies_file = parsed['cookies_file']
+		self._state_file = parsed['state_file']
+		self._save_frequency = parsed['save_freq']
+		self._stats_dest = parsed['stats_dest']
+		self._shed_priority = parsed['shed_priority']
+		self._shed_cadence = parsed['shed_cadence']
+		self._shedding = False
+		self._shed_ticks = 0
+		self._outputs.update(parsed['tele_confs'])
+		if pool_changed and not self._pool_shared:
+			self._pool.shutdown()
+			self._pool = workers.ExtractionPool(parsed['worker_count'], parsed['worker_timeout'])
+			if parsed['worker_count'] > 0:
+				self._pool.start(parsed['endpoints'], parsed['metric_budget'])
+			self._pool_conf = pool_conf
+		if session_changed:
+			self._logged_in = False
+			self._login_form_schema = None
+			self._client.start_new_session()
+		else:
+			self._log.info("Login config unchanged; keeping session")
+
+	def _update_endpoints(self, endpoints, time_budget, max_overruns):
+		"""
+		Sets the endpoints that are scraped. The Endpoint of an endpoint whose page, verification, and sections are the
+		same as one that is already scraped is kept, along with the cached parses, overruns, and measured cost of every
+		metric in it that is also the same.
+
+		:type endpoints: ``list[dict[str, Any]]``
+		:param endpoints: The parsed endpoints.
+		:type time_budget: ``float``
+		:param time_budget: The default time budget of each metric, as given to Endpoint.
+		:type max_overruns: ``int``
+		:param max_overruns: The number of overruns before a metric is disabled, as given to Endpoint.
+		"""
+		old_endpoints = self._endpoints if self._endpoints is not None else []
+		unused = list(range(len(old_endpoints)))
+		scrapers = []
+		costs = {}
+		kept = 0
+		for idx, ep in enumerate(endpoints):
+			old_idx = None
+			for i in unused:
+				old = old_endpoints[i]
+				same_page = ep['endpoint'] == old['endpoint'] and ep['verify-pattern'] == old['verify-pattern']
+				if same_page and _same_config(ep['sections'], old['sections']):
+					old_idx = i
+					break
+			if old_idx is None:
+				scrapers.append(Endpoint(ep['endpoint'], ep['verify-pattern'], ep['sections'], time_budget, max_overruns))
+				continue
+			unused.remove(old_idx)
+			endpoint = self._endpoint_scrapers[old_idx]
+			endpoint.time_budget = time_budget
+			endpoint.max_overruns = max_overruns
+			endpoint.retain_metrics(_match_metrics(ep['metrics'], old_endpoints[old_idx]['metrics']))
+			scrapers.append(endpoint)
+			if old_idx in self._endpoint_costs:
+				costs[idx] = self._endpoint_costs[old_idx]
+			kept += 1
+		if len(old_endpoints) > 0:
+			self._log.info("Kept " + str(kept) + " endpoint(s) and rebuilt " + str(len(endpoints) - kept))
 		self._endpoints = endpoints
-		self._logged_in = False
-		self._cookies_file = cookies_file
-		self._state_file = state_file
-		self._save_frequency = save_freq
-		self._telegraf_clients = {}
-		for tele in tele_confs:
-			client_conf = tele_confs[tele]
-			self._telegraf_clients[tele] = TelegrafClient(port=client_conf['port'], tags=client_conf['tags'])
-		self._client.start_new_session()
+		# kept between ticks so that each can reuse the parses of sections that have not changed
+		self._endpoint_scrapers = scrapers
+		self._endpoint_costs = costs
+
+	def use_pool(self, pool, offset):
+		"""
+		Sets the shared extraction pool that metrics are extracted with. The pool is started by its owner, with the
+		endpoints of every scraper that shares it.
+
+		:type pool: ``workers.ExtractionPool``
+		:param pool: The pool.
+		:type offset: ``int``
+		:param offset: The index in the endpoints that the pool was started with of the first endpoint of this scraper.
+		"""
+		if not self._pool_shared:
+			self._pool.shutdown()
+		self._pool = pool
+		self._pool_shared = True
+		self._pool_offset = offset
 
 	def setup(self, no_cookies=False):
 		"""
@@ -151,45 +358,126 @@ class PageScraper(object):
 		else:
 			loaded_cookies = False
 
+		# the saved state can be out of date, so the saved session is checked against the server if possible
+		if loaded_cookies and self._session_probe is not None:
+			self._logged_in = self._probe_session()
+
 		if not loaded_cookies or not self._logged_in:
-			_log.info("Attempting initial login...")
-			self._login()
-			_log.info("Login successful")
+			self._log.info("Attempting initial login...")
+			self._timed_login()
+			self._log.info("Login successful")
 		self._running = True
 
-	def run_tick(self, clock):
+	def run_tick(self, clock, endpoints=None, deadline=None):
 		"""
 		:type clock: TickClock
 		:param clock: Current tick.
+		:type endpoints: ``list[int]``
+		:param endpoints: The indexes of the endpoints to scrape this tick. If not given, all endpoints are scraped.
+		:type deadline: ``float``
+		:param deadline: The monotonic time that the tick should end by, as given by time.monotonic(). If not given, it
+		is one tick speed less the lateness of the tick from now. Give it when the tick is shared with other work that
+		has already used some of it.
 		"""
 		if not self._running:
 			raise StateError("Not currently running; call setup() first")
+		self._set_activity("starting tick " + str(clock.tick))
+		# a session that expires partway through the tick is recovered by the time it should end
+		if deadline is None:
+			deadline = _tick_deadline(clock)
+		self._relogged_in_tick = False
 		if not self._logged_in:
-			_log.warning("Not logged in; attempting login...")
-			self._login()
-			_log.info("Login successful")
-			return
-		if clock.tick % self._save_frequency == 0 and clock.tick != 0:
+			self._log.warning("Not logged in; attempting login...")
+			self._timed_login()
+			self._log.info("Login successful")
+			if time.monotonic() >= deadline:
+				return
+		# the scheduler wakes up for whichever endpoint is due next, so ticks are not evenly spaced; the state is saved
+		# by the time since the last save rather than by counting ticks
+		if self._last_save is None:
+			self._last_save = time.monotonic()
+		elif time.monotonic() - self._last_save >= self._save_frequency * clock.speed.total_seconds():
 			self._save_state()
 
-		for endpoint_data in self._endpoints:
-			try:
-				uri = endpoint_data['endpoint']
-				verify = endpoint_data['verify-pattern']
-				endpoint = Endpoint(uri, verify)
-				metrics = endpoint_data['metrics']
-				ts = now_ts(ms=True) * 1000000  # influx db has nano-second precision
-				status, endpoint_text = self._client.request('GET', endpoint.uri)
-				bursts = endpoint.scrape_all_metrics(metrics, endpoint_text)
-				_log.info("Got metrics for " + endpoint.uri + "; sending...")
-				for b in bursts:
-					self._send_metric_burst(b['channel'], ts, b['metric'], b['values'], b['tags'])
-			except util.VerificationError as e:
-				if self._bot_kicked_pattern.search(e.content) is not None:
-					raise BotKickedError("automated client was kicked/banned from the server: " + e.content)
-				elif self._logged_out_pattern.search(e.content) is not None:
-					self._logged_in = False
-					raise AuthError("login is no longer valid")
+		if endpoints is None:
+			endpoints = range(len(self._endpoints))
+
+		shedding = self._update_shedding(clock)
+		endpoints = self._select_endpoints(clock, endpoints, shedding, deadline)
+		# shed metrics and values still run at a reduced cadence so that they do not go dark entirely
+		min_priority = None
+		if shedding and self._shed_ticks % self._shed_cadence != 0:
+			min_priority = self._shed_priority
+
+		# endpoints that share a page only download it once per tick
+		self._requests = http.RequestCoalescer(self._client)
+		if self._probe_response is not None:
+			uri, response, probe_time = self._probe_response
+			if time.monotonic() - probe_time <= _PROBE_REUSE_SECONDS:
+				self._requests.store(uri, response)
+			self._probe_response = None
+		try:
+			# every conversion in the tick is done relative to the same time
+			with util.tick_time(clock.time):
+				if self._pool.running:
+					self._scrape_endpoints_pooled(endpoints, min_priority, deadline)
+				else:
+					for endpoint_idx in endpoints:
+						self._retry_after_login(deadline, self._scrape_endpoint, endpoint_idx, min_priority)
+		finally:
+			self._stats['request-cache-hits'] += self._requests.hits
+			self._stats['request-cache-misses'] += self._requests.misses
+			# pages are not kept in memory between ticks
+			self._requests = None
+		self._last_tick = (clock.tick, clock.time)
+		self._send_stats(clock)
+		self._set_activity("waiting for next tick")
+
+	def keep_alive(self, idle, lookahead):
+		"""
+		Logs in ahead of time if the session is expected to expire before the next tick is over, so that the tick does not
+		have to. Expiry is predicted from the expiry of the session cookies and from how long sessions have lasted
+		before. This should be called between ticks; nothing is done if the last login took longer than the time until
+		the next tick starts.
+
+		:type idle: ``float``
+		:param idle: The number of seconds until the next tick starts.
+		:type lookahead: ``float``
+		:param lookahead: The number of seconds that the next tick lasts.
+		:rtype: ``bool``
+		:return: Whether the scraper logged in.
+		"""
+		if not self._running:
+			return False
+		if self._logged_in:
+			expiry = self._predict_session_expiry()
+			if expiry is None:
+				return False
+			remaining = expiry - time.time()
+			if remaining > idle + lookahead:
+				return False
+			reason = "Session expected to expire in " + str(round(remaining, 2)) + "s"
+		else:
+			reason = "Not logged in"
+		if self._login_cost is not None and self._login_cost > idle:
+			self._log.debug(reason + ", but there is not enough time to log in before the next tick")
+			return False
+		self._log.info(reason + "; logging in before the next tick...")
+		# logging in from an existing session may not give the pages that the login steps expect, so the login is done
+		# in a new session. The old one is put back if the login fails, as it may well still be valid
+		old_session = self._client.swap_session(None)
+		try:
+			self._timed_login()
+		except Exception:
+			_close_session(self._client.swap_session(old_session))
+			raise
+		else:
+			_close_session(old_session)
+		finally:
+			self._set_activity("waiting for next tick")
+		self._stats['keepalive-logins'] += 1
+		self._log.info("Login successful")
+		return True
 
 	def cleanup(self):
 		"""
@@ -197,6 +485,214 @@ class PageScraper(object):
 		"""
 		if self._running:
 			self._save_state()
+		self._close_state()
+		if not self._pool_shared:
+			self._pool.shutdown()
+
+	def _scrape_endpoint(self, endpoint_idx, min_priority):
+		endpoint_data = self._endpoints[endpoint_idx]
+		try:
+			start_time = time.monotonic()
+			endpoint = self._endpoint_scrapers[endpoint_idx]
+			metrics = endpoint_data['metrics']
+			self._set_activity("scraping " + endpoint.uri)
+			ts = now_ts(ms=True) * 1000000  # influx db has nano-second precision
+			status, endpoint_text = self._requests.request('GET', endpoint.uri)
+			# bursts are sent as they are scraped rather than all being collected first, so a value that fails to
+			# convert partway through the page stops the rest of it from being sent but not what was sent before it
+			bursts = endpoint.iter_all_metrics(metrics, endpoint_text, min_priority=min_priority)
+			self._log.info("Got " + endpoint.uri + "; sending metrics...")
+			self._send_endpoint_bursts(endpoint_idx, ts, bursts, min_priority)
+			self._record_endpoint_cost(endpoint_idx, time.monotonic() - start_time)
+		except util.VerificationError as e:
+			self._check_verification_error(e)
+
+	def _scrape_endpoints_pooled(self, endpoints, min_priority, deadline):
+		"""
+		Scrapes endpoints with their metrics extracted by the worker pool. All pages are requested first, with each one
+		given to the workers as soon as it arrives, and then the bursts of each are sent in order. If requesting a page
+		fails, the bursts of the pages that were already requested are still sent before the error is raised, as they
+		would have been when scraping serially.
+		"""
+		jobs = []
+		fetch_error = None
+		try:
+			try:
+				for endpoint_idx in endpoints:
+					start_time = time.monotonic()
+					endpoint = self._endpoint_scrapers[endpoint_idx]
+					self._set_activity("fetching " + endpoint.uri)
+					ts = now_ts(ms=True) * 1000000  # influx db has nano-second precision
+					endpoint_text = self._retry_after_login(deadline, self._fetch_verified_page, endpoint)
+					if endpoint_text is None:
+						continue
+					metrics = self._endpoints[endpoint_idx]['metrics']
+					job = self._pool.submit(self._pool_offset + endpoint_idx, endpoint, metrics, endpoint_text, min_priority)
+					jobs.append((endpoint_idx, ts, time.monotonic() - start_time, job))
+			except Exception as e:
+				fetch_error = e
+
+			for endpoint_idx, ts, fetch_cost, job in jobs:
+				start_time = time.monotonic()
+				self._set_activity("extracting " + self._endpoints[endpoint_idx]['endpoint'])
+				bursts = job.bursts()
+				self._log.info("Got " + self._endpoints[endpoint_idx]['endpoint'] + "; sending metrics...")
+				self._send_endpoint_bursts(endpoint_idx, ts, bursts, min_priority)
+				self._record_endpoint_cost(endpoint_idx, fetch_cost + time.monotonic() - start_time)
+			if fetch_error is not None:
+				raise fetch_error
+		finally:
+			for job in jobs:
+				job[3].close()
+
+	def _fetch_verified_page(self, endpoint):
+		"""
+		Gets the page of an endpoint and checks that it has the expected content.
+
+		:type endpoint: ``Endpoint``
+		:param endpoint: The endpoint to get the page of.
+		:rtype: ``str``
+		:return: The text of the page, or None if it did not have the expected content.
+		"""
+		status, endpoint_text = self._requests.request('GET', endpoint.uri)
+		if endpoint.verify_pattern.search(endpoint_text) is None:
+			e = util.VerificationError("endpoint did not match expected content", endpoint_text)
+			self._check_verification_error(e)
+			return None
+		return endpoint_text
+
+	def _retry_after_login(self, deadline, func, *args):
+		"""
+		Calls a function that scrapes an endpoint. If the session turns out to have expired, the scraper logs in again
+		and the function is called once more, as long as there is time for it before the deadline. Nothing from the
+		endpoint has been sent when the session is found to have expired, as pages are verified before any metrics are
+		extracted from them.
+
+		:type deadline: ``float``
+		:param deadline: The monotonic time that the tick should end by.
+		:type func: ``Callable``
+		:param func: The function to call.
+		:param args: The arguments to call func with.
+		:return: Whatever func returns.
+		"""
+		try:
+			return func(*args)
+		except AuthError:
+			if not self._recover_login(deadline):
+				raise
+		return func(*args)
+
+	def _recover_login(self, deadline):
+		"""
+		Logs in again after the session expired partway through a tick. This is only done once per tick, and only if the
+		last login took less time than is left in the tick; otherwise the login is left for the start of the next tick.
+
+		:type deadline: ``float``
+		:param deadline: The monotonic time that the tick should end by.
+		:rtype: ``bool``
+		:return: Whether the scraper logged in again.
+		"""
+		if self._relogged_in_tick:
+			self._log.warning("Session expired again after logging in during this tick; giving up until next tick")
+			return False
+		remaining = deadline - time.monotonic()
+		if remaining <= 0 or (self._login_cost is not None and self._login_cost > remaining):
+			msg = "Session expired, but only " + str(round(max(remaining, 0), 2)) + "s are left in the tick"
+			self._log.warning(msg + "; logging in next tick")
+			return False
+		self._log.warning("Session expired during tick; logging in again...")
+		self._relogged_in_tick = True
+		cost = self._timed_login()
+		# pages fetched before the login show the logged-out content
+		self._requests.clear()
+		self._stats['relogins'] += 1
+		self._stats['relogin-seconds'] = cost
+		self._log.info("Logged in again after " + str(round(cost, 2)) + "s; resuming tick")
+		return True
+
+	def _timed_login(self):
+		"""
+		Logs in and records how long it took.
+
+		:rtype: ``float``
+		:return: The number of seconds the login took.
+		"""
+		start_time = time.monotonic()
+		self._login()
+		self._login_cost = time.monotonic() - start_time
+		self._session_start = time.time()
+		return self._login_cost
+
+	def _probe_session(self):
+		"""
+		Checks whether the current session is logged in by requesting a single page. If it is, the page is kept so that
+		the first tick can use it instead of requesting it again.
+
+		:rtype: ``bool``
+		:return: Whether the session is logged in.
+		"""
+		uri = self._session_probe['endpoint']
+		self._log.info("Checking saved session with " + uri + "...")
+		try:
+			response = self._client.request('GET', uri)
+		except Exception as e:
+			self._log.warning("Could not check saved session (" + str(e) + "); logging in")
+			return False
+		status, text = response
+		if self._bot_kicked_pattern.search(text) is not None:
+			raise BotKickedError("automated client was kicked/banned from the server: " + text)
+		if self._logged_out_pattern.search(text) is not None:
+			self._log.info("Saved session is logged out")
+			return False
+		if self._session_probe['verify-pattern'].search(text) is None:
+			self._log.info("Saved session gave an unexpected page")
+			return False
+		self._log.info("Saved session is still logged in")
+		self._probe_response = (uri, response, time.monotonic())
+		return True
+
+	def _record_session_end(self):
+		"""
+		Records how long the current session lasted, now that it has been found to have expired. The session could have
+		expired at any point since the last request, so this is an upper bound.
+		"""
+		if self._session_start is None:
+			return
+		lifetime = time.time() - self._session_start
+		self._log.info("Session expired after " + str(round(lifetime, 2)) + "s")
+		self._session_lifetimes = (self._session_lifetimes + [lifetime])[-_SESSION_LIFETIMES_KEPT:]
+		self._session_start = None
+
+	def _predict_session_expiry(self):
+		"""
+		Predicts when the current session will expire, from whichever of the session cookie expiry and the shortest
+		session seen so far comes first.
+
+		:rtype: ``float``
+		:return: The predicted expiry as a unix timestamp, or None if there is nothing to predict it from.
+		"""
+		expiry = self._client.cookie_expiry()
+		if self._session_start is not None and len(self._session_lifetimes) > 0:
+			observed = self._session_start + min(self._session_lifetimes)
+			if expiry is None or observed < expiry:
+				expiry = observed
+		return expiry
+
+	def _send_endpoint_bursts(self, endpoint_idx, ts, bursts, min_priority):
+		endpoint_data = self._endpoints[endpoint_idx]
+		bursts = aggregate.iter_aggregations(endpoint_data['aggregations'], bursts)
+		for b in bursts:
+			self._send_metric_burst(b.channel, ts, b.metric, b.values, b.tags)
+		if min_priority is not None:
+			self._count_shed_metrics(endpoint_data['metrics'], min_priority)
+
+	def _check_verification_error(self, e):
+		if self._bot_kicked_pattern.search(e.content) is not None:
+			raise BotKickedError("automated client was kicked/banned from the server: " + e.content)
+		elif self._logged_out_pattern.search(e.content) is not None:
+			self._logged_in = False
+			self._record_session_end()
+			raise AuthError("login is no longer valid")
 
 	def antiflood_wait(self):
 		"""For multi-request operations, make sure we don't overload the server."""
@@ -206,44 +702,185 @@ class PageScraper(object):
 			secs = random.uniform(2.5, 6.5)
 			time.sleep(secs)
 
+	def _update_shedding(self, clock):
+		"""
+		Checks whether work should be shed this tick, which is the case for as long as the clock is running behind.
+
+		:type clock: TickClock
+		:param clock: Current tick.
+		:rtype: ``bool``
+		:return: Whether to shed work.
+		"""
+		shedding = clock.is_slow
+		if shedding and not self._shedding:
+			msg = "Tick " + str(clock.tick) + " started " + str(clock.lateness.total_seconds()) + "s late; shedding work"
+			msg += " with priority below " + str(self._shed_priority)
+			self._log.warning(msg)
+		elif not shedding and self._shedding:
+			self._log.info("Back on schedule; no longer shedding work")
+			self._shed_ticks = 0
+		self._shedding = shedding
+		if shedding:
+			self._shed_ticks += 1
+		self._stats['shedding'] = 1 if shedding else 0
+		return shedding
+
+	def _select_endpoints(self, clock, endpoints, shedding, deadline):
+		"""
+		Gets the endpoints to scrape this tick. When shedding, endpoints below the shed priority are only scraped if
+		their measured cost fits in the time left in the tick after the rest are scraped, with higher priority endpoints
+		getting the time first.
+
+		:type clock: TickClock
+		:param clock: Current tick.
+		:type endpoints: ``list[int]``
+		:param endpoints: The indexes of the endpoints that are due.
+		:type shedding: ``bool``
+		:param shedding: Whether work is being shed.
+		:type deadline: ``float``
+		:param deadline: The monotonic time that the tick should end by.
+		:rtype: ``list[int]``
+		:return: The indexes of the endpoints to scrape.
+		"""
+		if not shedding:
+			return list(endpoints)
+		budget = max(deadline - time.monotonic(), 0.0)
+		selected = set()
+		optional = []
+		for idx in endpoints:
+			if self._endpoints[idx]['priority'] >= self._shed_priority:
+				selected.add(idx)
+				budget -= self._endpoint_costs.get(idx, 0.0)
+			else:
+				optional.append(idx)
+		optional.sort(key=lambda i: self._endpoints[i]['priority'], reverse=True)
+		for idx in optional:
+			cost = self._endpoint_costs.get(idx, 0.0)
+			if cost <= budget:
+				selected.add(idx)
+				budget -= cost
+			else:
+				self._log.info("Shedding endpoint " + self._endpoints[idx]['endpoint'] + " for tick " + str(clock.tick))
+				self._stats['shed-endpoints'] += 1
+		return [idx for idx in endpoints if idx in selected]
+
+	def _count_shed_metrics(self, metrics, min_priority):
+		for m in metrics:
+			if m['priority'] < min_priority:
+				self._stats['shed-metrics'] += 1
+			else:
+				self._stats['shed-values'] += len([v for v in m['values'] if v['priority'] < min_priority])
+
+	def _record_endpoint_cost(self, endpoint_idx, cost):
+		# exponentially-weighted so that the estimate follows changes in cost without jumping on a single outlier
+		prev = self._endpoint_costs.get(endpoint_idx)
+		if prev is None:
+			self._endpoint_costs[endpoint_idx] = cost
+		else:
+			self._endpoint_costs[endpoint_idx] = (0.3 * cost) + (0.7 * prev)
+
+	def _send_stats(self, clock):
+		"""
+		Sends statistics on the operation of the scraper to the stats destination, if one is configured.
+
+		:type clock: TickClock
+		:param clock: Current tick.
+		"""
+		if self._stats_dest is None:
+			return
+		ts = now_ts(ms=True) * 1000000
+		lateness = clock.lateness_stats
+		values = dict(self._stats)
+		values['tick-lateness'] = clock.lateness.total_seconds()
+		values['late-ticks'] = lateness['late-ticks']
+		values['missed-ticks'] = lateness['missed-ticks']
+		target_tags = {'target': self._name} if self._name is not None else {}
+		self._send_metric_burst(self._stats_dest, ts, 'pytelegrafhttp', values, target_tags)
+		for idx in self._endpoint_costs:
+			tags = dict(target_tags, endpoint=self._endpoints[idx]['endpoint'], index=str(idx))
+			endpoint = self._endpoint_scrapers[idx]
+			values = {
+				'cost': self._endpoint_costs[idx],
+				'reused-metrics': endpoint.reused_count,
+				'overruns': endpoint.overrun_count,
+				'disabled-metrics': len(endpoint.disabled)
+			}
+			self._send_metric_burst(self._stats_dest, ts, 'pytelegrafhttp-endpoint', values, tags)
+
 	def _send_metric_burst(self, channel, timestamp, metric, values, tags):
-		if channel not in self._telegraf_clients:
-			_log.warning("No configured telegraf client for channel '" + channel + "'")
+		client = self._outputs.get(channel)
+		if client is None:
+			self._log.warning("No configured telegraf client for channel '" + channel + "'")
 			return
-		client = self._telegraf_clients[channel]
 		client.metric(metric, values, tags=tags, timestamp=timestamp)
+		last = {'values': values, 'tags': tags, 'timestamp': timestamp}
+		with self._state_lock:
+			self._last_values[_series_key(channel, metric, tags)] = last
 
 	def _login(self):
-		self._login_response = None
-		self._login_form = None
+		self._set_activity("logging in")
 		try:
-			for step in self._login_steps:
-				if step['type'] == 'attempt':
-					self._login_attempt_get(step['endpoint'])
-					self.antiflood_wait()
-				elif step['type'] == 'resp-extract':
-					if step['extract-type'] == 'form-vars':
-						self._login_extract_response_form(step['inject'])
-					else:
-						raise ValueError("Bad login step extract-type: " + step['extract-type'])
-				elif step['type'] == 'submit-form':
-					self._login_submit_form()
-					self.antiflood_wait()
-				elif step['type'] == 'verify':
-					if not self._login_verify_response(step['pattern']):
-						self._running = False
-						raise LoginError("Verification of login failed!")
-					else:
-						self._logged_in = True
-				elif step['type'] == 'bounce-transfer':
-					self._login_bounce_transfer(step['pattern'])
-					self.antiflood_wait()
-				else:
-					raise ValueError("Bad login step type: " + step['type'])
+			if self._login_form_schema is not None:
+				if self._login_with_cached_form():
+					return
+				self._log.info("Login with cached form failed verification; doing full login")
+				self._login_form_schema = None
+			self._run_login_steps(self._login_steps)
 		finally:
 			self._login_response = None
 			self._login_form = None
 
+	def _login_with_cached_form(self):
+		"""
+		Logs in by submitting the login form that was extracted during the last full login, skipping every step before
+		the form is submitted.
+
+		:rtype: ``bool``
+		:return: Whether the login was verified.
+		"""
+		submit_idx = [step['type'] for step in self._login_steps].index('submit-form')
+		self._login_form = self._fill_login_form(self._login_form_schema)
+		try:
+			self._run_login_steps(self._login_steps[submit_idx:], fatal=False)
+		except LoginError as e:
+			self._log.debug("Cached login form failed: " + str(e))
+			return False
+		return True
+
+	def _run_login_steps(self, steps, fatal=True):
+		"""
+		Runs login steps in order.
+
+		:type steps: ``list[dict[str, Any]]``
+		:param steps: The parsed login steps.
+		:type fatal: ``bool``
+		:param fatal: Whether failing verification stops the scraper. A LoginError is raised either way.
+		"""
+		for step in steps:
+			if step['type'] == 'attempt':
+				self._login_attempt_get(step['endpoint'])
+				self.antiflood_wait()
+			elif step['type'] == 'resp-extract':
+				if step['extract-type'] == 'form-vars':
+					self._login_extract_response_form(step['inject'])
+				else:
+					raise ValueError("Bad login step extract-type: " + step['extract-type'])
+			elif step['type'] == 'submit-form':
+				self._login_submit_form()
+				self.antiflood_wait()
+			elif step['type'] == 'verify':
+				if not self._login_verify_response(step['pattern']):
+					if fatal:
+						self._running = False
+					raise LoginError("Verification of login failed!")
+				else:
+					self._logged_in = True
+			elif step['type'] == 'bounce-transfer':
+				self._login_bounce_transfer(step['pattern'])
+				self.antiflood_wait()
+			else:
+				raise ValueError("Bad login step type: " + step['type'])
+
 	def _login_bounce_transfer(self, pattern):
 		m = pattern.search(self._login_response)
 		if m is None:
@@ -282,45 +919,43 @@ class PageScraper(object):
 		status, self._login_response = self._client.request(meth, uri, host=host, query=params, payload=payload)
 
 	def _login_extract_response_form(self, injections):
-		# first, find the form element
-		m = re.search(r'<form.*?</form>', self._login_response, re.DOTALL)
-		if not m:
-			raise LoginError("Could not extract form response; regex failed")
-		form_text = m.group(0)
-		form_open_tag = re.search(r'<form [^>]+>', form_text, re.DOTALL).group(0)
-		form_action = re.search(r' action="([^"]+)"', form_open_tag, re.DOTALL).group(1)
-
-		form_action = self._parse_link(form_action)
-
-		form_method_m = re.search(r' method="([^"]+)"', form_open_tag, re.DOTALL)
-		if form_method_m:
-			form_method = form_method_m.group(1).upper()
-		else:
-			form_method = 'GET'
-
-		# only input elements for now
-		inputs = re.findall(r'<input [^>]+>', form_text, re.DOTALL)
-		form_variables = {}
-		for input_element in inputs:
-			input_name = re.search(r' name="([^"]+)"', input_element, re.DOTALL).group(1)
-			input_value_m = re.search(r' value="([^"]+)"', input_element, re.DOTALL)
-			if input_value_m:
-				input_value = input_value_m.group(1)
-			else:
-				input_value = ''
-			if input_name in injections:
-				var_name = injections[input_name]
-				if var_name == 'username':
-					input_value = self._user
-				elif var_name == 'password':
-					input_value = base64.b85decode(self._password).decode('utf-8')
-				else:
-					raise LoginError("Bad variable name in form injections")
-			form_variables[input_name] = input_value
+		form = forms.extract_form(self._login_response)
+		if form is None:
+			raise LoginError("Could not extract form response; no form found")
+		if form['action'] is None:
+			raise LoginError("Could not extract form response; form has no action")
+		schema = {
+			'action': self._parse_link(form['action']),
+			'method': form['method'],
+			'variables': form['variables'],
+			'inject': injections
+		}
+		self._login_form = self._fill_login_form(schema)
+		# a form with the same fields is submitted on the next login, as long as there is only one form to submit
+		if [step['type'] for step in self._login_steps].count('submit-form') == 1:
+			self._login_form_schema = schema
+
+	def _fill_login_form(self, schema):
+		"""
+		Creates a login form to submit, with the credentials injected into it.
 
-		self._login_form = {
-			'action': form_action,
-			'method': form_method,
+		:type schema: ``dict[str, Any]``
+		:param schema: The extracted form, with the names of its variables to inject the credentials into.
+		:rtype: ``dict[str, Any]``
+		:return: The form to submit.
+		"""
+		form_variables = dict(schema['variables'])
+		for input_name in schema['inject']:
+			var_name = schema['inject'][input_name]
+			if var_name == 'username':
+				form_variables[input_name] = self._user
+			elif var_name == 'password':
+				form_variables[input_name] = base64.b85decode(self._password).decode('utf-8')
+			else:
+				raise LoginError("Bad variable name in form injections")
+		return {
+			'action': schema['action'],
+			'method': schema['method'],
 			'variables': form_variables
 		}
 
@@ -346,41 +981,606 @@ class PageScraper(object):
 
 		return components
 
+	def save_state(self):
+		"""
+		Saves the state now rather than waiting for the next save. Can be called from any thread.
+
+		:rtype: ``int``
+		:return: The number of values that were written, or 0 if the scraper is not running.
+		"""
+		with self._state_lock:
+			if not self._running:
+				return 0
+			return self._save_state()
+
 	def _save_state(self):
-		self._client.save_cookies(self._cookies_file)
-		_log.info("Wrote cookies to '" + self._cookies_file + "'")
-		state = {'logged_in': self._logged_in}
-		with open(self._state_file, 'wb') as f:
-			pickle.dump(state, f)
-			_log.info("Wrote state to '" + self._state_file + "'")
+		with self._state_lock:
+			store = self._open_state()
+			cookies = dict((_cookie_key(c), c) for c in self._client.copy_cookies())
+			store.replace_section('cookies', cookies)
+			store.set('login', 'logged-in', self._logged_in)
+			store.set('login', 'session-start', self._session_start)
+			store.set('login', 'session-lifetimes', list(self._session_lifetimes))
+			if self._last_tick is not None:
+				store.set('clock', 'tick', self._last_tick[0])
+				store.set('clock', 'time', self._last_tick[1])
+			store.replace_section('values', dict(self._last_values))
+			written = store.flush()
+		self._last_save = time.monotonic()
+		self._log.info("Wrote state to '" + self._state_file + "' (" + str(written) + " changed value(s))")
+		return written
 
 	def _load_state(self):
-		loaded_cookies = False
-		try:
-			self._client.load_cookies(self._cookies_file)
-			loaded_cookies = True
-			_log.info("Read cookies from '" + self._cookies_file + "'")
-		except FileNotFoundError:
-			_log.debug("Cookies file not found at '" + self._cookies_file + "'; skipping")
+		store = self._open_state()
+		jar = self._client.cookie_jar
+		cookies = store.items('cookies')
+		if len(cookies) == 0 and self._cookies_file is not None:
+			# saved by an older version that kept cookies in their own file
+			try:
+				self._client.load_cookies(self._cookies_file)
+				self._log.info("Imported cookies from '" + self._cookies_file + "'")
+			except FileNotFoundError:
+				self._log.debug("Cookies file not found at '" + self._cookies_file + "'; skipping")
+		for c in cookies.values():
+			jar.set_cookie(c)
+		loaded_cookies = len(jar) > 0
+
+		self._logged_in = store.get('login', 'logged-in', self._logged_in)
+		self._session_start = store.get('login', 'session-start', self._session_start)
+		self._session_lifetimes = store.get('login', 'session-lifetimes', self._session_lifetimes)
+		self._last_values = store.items('values')
+		last_time = store.get('clock', 'time')
+		if last_time is not None:
+			self._log.info("Last collection was tick " + str(store.get('clock', 'tick')) + " at " + str(last_time))
+		return loaded_cookies
 
-		try:
-			with open(self._state_file, 'rb') as f:
-				state = pickle.load(f)
-			_log.info("Read state from '" + self._state_file + "'")
-			self._logged_in = state['logged_in']
-		except FileNotFoundError:
-			_log.debug("State file not found at '" + self._state_file + "'; skipping")
+	def _open_state(self):
+		"""
+		Opens the state store if it is not already open. A state file written by an older version, which pickled the
+		state instead, is read and moved aside to the same path with '.bak' added, and its state is imported.
 
-		return loaded_cookies
+		:rtype: ``state.StateStore``
+		:return: The state store.
+		"""
+		if self._state is not None:
+			return self._state
+		legacy = None
+		if os.path.exists(self._state_file) and not state.is_database(self._state_file):
+			try:
+				with open(self._state_file, 'rb') as f:
+					legacy = pickle.load(f)
+				self._log.info("Importing state from old state file '" + self._state_file + "'")
+			except Exception as e:
+				self._log.warning("Could not read old state file '" + self._state_file + "': " + str(e))
+			os.replace(self._state_file, self._state_file + '.bak')
+		self._state = state.StateStore(self._state_file)
+		if legacy is not None:
+			self._state.set('login', 'logged-in', legacy.get('logged_in', False))
+			self._state.set('login', 'session-start', legacy.get('session-start'))
+			self._state.set('login', 'session-lifetimes', legacy.get('session-lifetimes', []))
+		return self._state
+
+	def _close_state(self):
+		with self._state_lock:
+			if self._state is not None:
+				self._state.close()
+				self._state = None
+
+	def _set_activity(self, activity):
+		self._activity = (activity, time.monotonic())
+
+	@property
+	def activity(self):
+		"""
+		What the scraper is doing, for reporting to controllers.
+
+		:rtype: ``(str, float)``
+		:return: A description of what the scraper is doing, and the number of seconds it has been doing it for.
+		"""
+		activity, start = self._activity
+		return activity, time.monotonic() - start
+
+	@property
+	def stats(self):
+		"""
+		:rtype: ``dict[str, int | float]``
+		:return: The statistics on the operation of the scraper that are sent to the stats destination.
+		"""
+		return dict(self._stats)
 
 	@property
 	def running(self):
 		return self._running
 
+	@property
+	def endpoints(self):
+		"""
+		:rtype: ``list[dict[str, Any]]``
+		:return: The parsed endpoints that are scraped.
+		"""
+		return self._endpoints
+
 	@property
 	def username(self):
 		return self._user
 
+	@property
+	def name(self):
+		"""
+		:rtype: ``str``
+		:return: The name of the target that this scraper scrapes, or None if it is the only one.
+		"""
+		return self._name
+
+
+class TargetGroup(object):
+	"""
+	Scrapes several targets, each with its own PageScraper, from one process. The scrapers share their telegraf clients
+	and extraction pool, and are driven by the same clock; everything to do with a session, including the state file,
+	is kept separately for each target.
+
+	The endpoints of all targets are numbered together, in the order that the targets are configured in, so that they
+	can be scheduled as one. A problem with one target does not stop the others from being scraped: a target whose
+	setup fails is set up again at the start of the next tick, and a target that has a fatal error is not scraped again
+	until the config is reloaded. When there is only one target, problems are raised as they are by PageScraper.
+	"""
+
+	def __init__(self, antiflood):
+		"""
+		Creates a new TargetGroup.
+
+		:type antiflood: ``bool``
+		:param antiflood: Whether the scrapers wait between the requests of multi-request operations.
+		"""
+		self._antiflood = antiflood
+		self._outputs = TelegrafOutputs()
+		self._pool = workers.ExtractionPool(0, 0)
+		self._pool_conf = None
+		self._scrapers = []
+		""":type : list[PageScraper]"""
+		self._endpoints = []
+		# the index of the scraper and the index in it of each endpoint
+		self._endpoint_owners = []
+		self._needs_setup = set()
+		self._failed = set()
+		self._no_cookies = False
+		self._running = False
+
+	def load_config(self, conf, parsed=None):
+		"""
+		Sets up the targets from a config. The scraper of a target that was already configured is kept, along with its
+		session; targets that are no longer configured have their state saved and are dropped.
+
+		:type conf: ``module``
+		:param conf: The config.
+		:type parsed: ``list[(str, dict[str, Any])]``
+		:param parsed: The targets as already given by parse_config_targets(), such as from a config snapshot. If not
+		given, the config is parsed.
+		"""
+		if parsed is None:
+			parsed = parse_config_targets(conf)
+
+		old_scrapers = dict((s.name, s) for s in self._scrapers)
+		scrapers = []
+		for name, target_parsed in parsed:
+			scraper = old_scrapers.pop(name, None)
+			if scraper is None:
+				scraper = PageScraper(self._antiflood, name=name, outputs=self._outputs, pool=self._pool)
+				self._needs_setup.add(scraper)
+			scraper.load_config(conf, target_parsed)
+			scrapers.append(scraper)
+		for name, scraper in old_scrapers.items():
+			_log.info("Target " + repr(name) + " is no longer configured; dropping it")
+			scraper.cleanup()
+			self._needs_setup.discard(scraper)
+		# the config of a failed target may have been fixed
+		self._needs_setup.update(self._failed)
+		self._failed = set()
+
+		endpoints = []
+		owners = []
+		offsets = []
+		for idx, scraper in enumerate(scrapers):
+			offsets.append(len(endpoints))
+			endpoints.extend(scraper.endpoints)
+			owners.extend((idx, ep_idx) for ep_idx in range(len(scraper.endpoints)))
+
+		# the settings of the pool are not per-target, so every target has the same ones
+		shared = parsed[0][1]
+		pool_conf = (shared['worker_count'], shared['worker_timeout'], shared['metric_budget'], endpoints)
+		if self._pool_conf is None or not _same_config(pool_conf, self._pool_conf):
+			self._pool.shutdown()
+			self._pool = workers.ExtractionPool(shared['worker_count'], shared['worker_timeout'])
+			if shared['worker_count'] > 0:
+				self._pool.start(endpoints, shared['metric_budget'])
+			self._pool_conf = pool_conf
+		for scraper, offset in zip(scrapers, offsets):
+			scraper.use_pool(self._pool, offset)
+
+		self._scrapers = scrapers
+		self._endpoints = endpoints
+		self._endpoint_owners = owners
+
+	def setup(self, no_cookies=False):
+		"""
+		Restores the state of every target and logs in to each one that needs it.
+
+		:type no_cookies: ``bool``
+		:param no_cookies: Whether to skip loading the saved state.
+		"""
+		self._no_cookies = no_cookies
+		self._running = True
+		for scraper in self._scrapers:
+			self._setup_scraper(scraper)
+
+	def run_tick(self, clock, endpoints=None):
+		"""
+		Scrapes the due endpoints of every target, one target after the other.
+
+		:type clock: TickClock
+		:param clock: Current tick.
+		:type endpoints: ``list[int]``
+		:param endpoints: The indexes of the endpoints to scrape this tick, numbered across all targets. If not given,
+		all endpoints are scraped.
+		"""
+		if not self._running:
+			raise StateError("Not currently running; call setup() first")
+		# the targets share the tick, so each one only has what is left of it after the ones before
+		deadline = _tick_deadline(clock)
+		if endpoints is None:
+			endpoints = range(len(self._endpoints))
+		due = [[] for _ in self._scrapers]
+		for idx in endpoints:
+			scraper_idx, ep_idx = self._endpoint_owners[idx]
+			due[scraper_idx].append(ep_idx)
+		for scraper, scraper_endpoints in zip(self._scrapers, due):
+			if scraper in self._failed or (scraper in self._needs_setup and not self._setup_scraper(scraper)):
+				continue
+			try:
+				scraper.run_tick(clock, scraper_endpoints, deadline)
+			except FatalError as e:
+				self._fail(scraper, e)
+			except Exception:
+				if len(self._scrapers) == 1:
+					raise
+				_log.exception("Problem in tick " + str(clock.tick) + " of target " + repr(scraper.name))
+
+	def keep_alive(self, idle, lookahead):
+		"""
+		Logs in to each target whose session is expected to expire before the next tick is over, as in
+		PageScraper.keep_alive(). The time that each login takes is taken out of the time that the targets after it
+		have.
+
+		:type idle: ``float``
+		:param idle: The number of seconds until the next tick starts.
+		:type lookahead: ``float``
+		:param lookahead: The number of seconds that the next tick lasts.
+		:rtype: ``bool``
+		:return: Whether any target logged in.
+		"""
+		logged_in = False
+		for scraper in self._scrapers:
+			if scraper in self._failed or scraper in self._needs_setup:
+				continue
+			start = time.monotonic()
+			try:
+				logged_in = scraper.keep_alive(idle, lookahead) or logged_in
+			except FatalError as e:
+				self._fail(scraper, e)
+			except Exception:
+				if len(self._scrapers) == 1:
+					raise
+				_log.exception("Problem keeping the session of target " + repr(scraper.name) + " alive")
+			idle = max(idle - (time.monotonic() - start), 0.0)
+		return logged_in
+
+	def cleanup(self):
+		"""
+		Prepare for shutdown.
+		"""
+		for scraper in self._scrapers:
+			scraper.cleanup()
+		self._pool.shutdown()
+
+	def save_state(self):
+		"""
+		Saves the state of every target now. Can be called from any thread.
+
+		:rtype: ``int``
+		:return: The number of values that were written.
+		"""
+		return sum(scraper.save_state() for scraper in list(self._scrapers))
+
+	def _setup_scraper(self, scraper):
+		"""
+		Sets up the scraper of a target. A problem is only raised if it is the only target.
+
+		:rtype: ``bool``
+		:return: Whether the scraper was set up.
+		"""
+		try:
+			scraper.setup(self._no_cookies)
+		except FatalError as e:
+			self._needs_setup.discard(scraper)
+			self._fail(scraper, e)
+			return False
+		except Exception:
+			if len(self._scrapers) == 1:
+				raise
+			self._needs_setup.add(scraper)
+			_log.exception("Could not set up target " + repr(scraper.name) + "; trying again next tick")
+			return False
+		self._needs_setup.discard(scraper)
+		return True
+
+	def _fail(self, scraper, e):
+		"""
+		Stops scraping a target after a fatal error. The error is raised again if no targets are left.
+		"""
+		self._failed.add(scraper)
+		if len(self._failed) >= len(self._scrapers):
+			raise e
+		_log.error("Target " + repr(scraper.name) + " stopped until the config is reloaded: " + str(e))
+
+	@property
+	def activity(self):
+		"""
+		What the target that most recently started doing something is doing, for reporting to controllers.
+
+		:rtype: ``(str, float)``
+		:return: A description of what the scraper is doing, and the number of seconds it has been doing it for.
+		"""
+		scrapers = list(self._scrapers)
+		if len(scrapers) == 0:
+			return 'starting', 0.0
+		latest = min(scrapers, key=lambda s: s.activity[1])
+		activity, secs = latest.activity
+		if len(scrapers) > 1:
+			activity = latest.name + ": " + activity
+		return activity, secs
+
+	@property
+	def stats(self):
+		"""
+		:rtype: ``dict[str, Any]``
+		:return: The statistics of the scrapers. With one target, these are its statistics; with several, they are
+		the totals, and the statistics of each target are given in 'targets', keyed by target name.
+		"""
+		scrapers = list(self._scrapers)
+		if len(scrapers) == 1:
+			return scrapers[0].stats
+		totals = {}
+		per_target = {}
+		for scraper in scrapers:
+			target_stats = scraper.stats
+			per_target[scraper.name] = target_stats
+			for k, v in target_stats.items():
+				totals[k] = totals.get(k, 0) + v
+		totals['targets'] = per_target
+		return totals
+
+	@property
+	def running(self):
+		return self._running and len(self._failed) < len(self._scrapers)
+
+	@property
+	def endpoints(self):
+		"""
+		:rtype: ``list[dict[str, Any]]``
+		:return: The parsed endpoints of every target, in the order that they are numbered in.
+		"""
+		return self._endpoints
+
+	@property
+	def targets(self):
+		"""
+		:rtype: ``list[PageScraper]``
+		:return: The scraper of each target.
+		"""
+		return list(self._scrapers)
+
+
+def _tick_deadline(clock):
+	"""
+	Gets the monotonic time, as given by time.monotonic(), that a tick that starts now should end by. This is one
+	tick speed from now, less however late the tick started.
+
+	:type clock: TickClock
+	:param clock: Current tick.
+	:rtype: ``float``
+	"""
+	return time.monotonic() + max(clock.speed.total_seconds() - clock.lateness.total_seconds(), 0.0)
+
+
+def _new_stats():
+	return {
+		'shedding': 0,
+		'shed-endpoints': 0,
+		'shed-metrics': 0,
+		'shed-values': 0,
+		'request-cache-hits': 0,
+		'request-cache-misses': 0,
+		'relogins': 0,
+		'relogin-seconds': 0.0,
+		'keepalive-logins': 0
+	}
+
+
+def parse_config(conf):
+	"""
+	Parses and checks the config of the scraper, including linting the regexes of the endpoints.
+
+	:type conf: ``module``
+	:param conf: The config.
+	:rtype: ``dict[str, Any]``
+	:return: The parsed config, as given to PageScraper.load_config(). It can be pickled if every conversion in it can.
+	"""
+	logged_out_pattern = util.get_config_regex(conf, 'scraper_logged_out_pattern')
+	bot_kicked_pattern = util.get_config_regex(conf, 'scraper_bot_kicked_pattern')
+	ssl = util.get_config_bool(conf, 'scraper_use_ssl')
+	host = util.get_config_str(conf, 'scraper_host')
+	user = util.get_config_str(conf, 'scraper_username')
+	passwd = util.get_config_str(conf, 'scraper_password')
+	login_steps = parse_config_login_steps(conf.scraper_login_steps, 'scraper_login_steps')
+	lint_mode = util.get_config_str(conf, 'scraper_regex_lint', lint.LINT_WARN)
+	if lint_mode not in lint.LINT_MODES:
+		msg = "regex lint mode must be one of " + ", ".join(repr(x) for x in lint.LINT_MODES)
+		raise util.ConfigException(msg, 'scraper_regex_lint')
+	time_budget = util.get_config_float(conf, 'scraper_regex_time_budget', 0.1)
+	endpoints = parse_config_endpoints(conf.scraper_endpoints, 'scraper_endpoints', lint_mode, time_budget)
+	session_probe = _DEFAULT_PROBE
+	if hasattr(conf, 'scraper_session_probe'):
+		session_probe = conf.scraper_session_probe
+	session_probe = parse_config_session_probe(session_probe, endpoints, 'scraper_session_probe')
+	tele_confs = parse_config_telegraf_clients(conf.scraper_telegraf_destinations, 'scraper_telegraf_destinations')
+	cookies_file = util.get_config_str(conf, 'env_cookies_file', None)
+	state_file = util.get_config_str(conf, 'env_state_file')
+	save_freq = util.get_config_int(conf, 'time_save_frequency')
+	full_response_logging = util.get_config_bool(conf, 'log_full_http_responses')
+	full_request_logging = util.get_config_bool(conf, 'log_full_http_requests')
+	stats_dest = util.get_config_str(conf, 'scraper_stats_destination', None)
+	metric_budget = None
+	if getattr(conf, 'scraper_metric_time_budget', None) is not None:
+		metric_budget = util.get_config_float(conf, 'scraper_metric_time_budget')
+	max_overruns = util.get_config_int(conf, 'scraper_metric_max_overruns', 3)
+	worker_count = util.get_config_int(conf, 'scraper_extraction_workers', 0)
+	worker_timeout = util.get_config_float(conf, 'scraper_extraction_timeout', 30.0)
+	shed_priority = util.get_config_int(conf, 'scraper_shed_priority', 0)
+	shed_cadence = util.get_config_int(conf, 'scraper_shed_cadence', 5)
+
+	if stats_dest is not None and stats_dest not in tele_confs:
+		raise util.ConfigException("not a configured telegraf destination: " + stats_dest, 'scraper_stats_destination')
+	if shed_cadence < 1:
+		raise util.ConfigException("shed cadence must be at least 1", 'scraper_shed_cadence')
+	if metric_budget is not None and metric_budget <= 0:
+		raise util.ConfigException("metric time budget must be greater than 0", 'scraper_metric_time_budget')
+	if max_overruns < 1:
+		raise util.ConfigException("max overruns must be at least 1", 'scraper_metric_max_overruns')
+	if worker_count < 0:
+		raise util.ConfigException("extraction workers must not be negative", 'scraper_extraction_workers')
+	if worker_timeout <= 0:
+		raise util.ConfigException("extraction timeout must be greater than 0", 'scraper_extraction_timeout')
+
+	return {
+		'logged_out_pattern': logged_out_pattern,
+		'bot_kicked_pattern': bot_kicked_pattern,
+		'ssl': ssl,
+		'host': host,
+		'user': user,
+		'passwd': passwd,
+		'login_steps': login_steps,
+		'endpoints': endpoints,
+		'session_probe': session_probe,
+		'tele_confs': tele_confs,
+		'cookies_file': cookies_file,
+		'state_file': state_file,
+		'save_freq': save_freq,
+		'full_response_logging': full_response_logging,
+		'full_request_logging': full_request_logging,
+		'stats_dest': stats_dest,
+		'metric_budget': metric_budget,
+		'max_overruns': max_overruns,
+		'worker_count': worker_count,
+		'worker_timeout': worker_timeout,
+		'shed_priority': shed_priority,
+		'shed_cadence': shed_cadence
+	}
+
+
+def parse_config_targets(conf):
+	"""
+	Parses and checks the config of every target, as given by get_target_configs().
+
+	:type conf: ``module``
+	:param conf: The config.
+	:rtype: ``list[(str, dict[str, Any])]``
+	:return: The name and parsed config of each target, as given to TargetGroup.load_config(). The parsed config of
+	each target is as given by parse_config().
+	"""
+	parsed = []
+	for idx, (name, target_conf) in enumerate(get_target_configs(conf)):
+		try:
+			parsed.append((name, parse_config(target_conf)))
+		except util.ConfigException as e:
+			if name is None:
+				raise
+			# a problem with a key that the target gives is reported against the target
+			key = e.key
+			base_key = re.match(r'\w*', key).group(0)
+			if base_key in vars(target_conf):
+				key = "scraper_targets[" + str(idx) + "][" + repr(base_key) + "]" + key[len(base_key):]
+			raise util.ConfigException("in target " + repr(name) + ": " + str(e), key)
+	return parsed
+
+
+def get_target_configs(conf):
+	"""
+	Gets the config of each target. Each entry in scraper_targets gives a 'name' and any of TARGET_KEYS, and takes the
+	rest of the config from the top level of it. A target that does not give a state file uses the top-level one with
+	'-' and its name put before the extension, and does not import cookies from the old cookies file unless it gives
+	one. If there is no scraper_targets, the top level of the config is the only target, and has no name.
+
+	:type conf: ``module``
+	:param conf: The config.
+	:rtype: ``list[(str, Any)]``
+	:return: The name and config of each target. The config of each has the same attributes as a config module.
+	"""
+	targets = getattr(conf, 'scraper_targets', None)
+	if targets is None:
+		return [(None, conf)]
+	key_path = 'scraper_targets'
+	if isinstance(targets, (str, dict)) or len(targets) == 0:
+		raise util.ConfigException("targets must be a non-empty list", key_path)
+	state_file = util.get_config_str(conf, 'env_state_file')
+	configs = []
+	state_files = {}
+	for idx, target in enumerate(targets):
+		key = key_path + "[" + str(idx) + "]"
+		try:
+			name = str(target['name'])
+		except KeyError:
+			raise util.ConfigException("target must contain 'name' key", key)
+		except TypeError:
+			raise util.ConfigException("target must be a dict", key)
+		if name in [c[0] for c in configs]:
+			raise util.ConfigException("target name is not unique: " + repr(name), key + "['name']")
+		values = {}
+		for k in target:
+			if k == 'name':
+				continue
+			if k not in TARGET_KEYS:
+				raise util.ConfigException("not a key that can be given for a target: " + repr(k), key)
+			values[k] = target[k]
+		if 'env_state_file' not in values:
+			root, ext = os.path.splitext(state_file)
+			values['env_state_file'] = root + '-' + name + ext
+		target_state_file = os.path.abspath(str(values['env_state_file']))
+		if target_state_file in state_files:
+			msg = "target has the same state file as target " + repr(state_files[target_state_file])
+			raise util.ConfigException(msg, key + "['env_state_file']")
+		state_files[target_state_file] = name
+		# the old cookies file has the cookies of only one session, which is not for every target
+		hidden = ('env_cookies_file',) if 'env_cookies_file' not in values else ()
+		configs.append((name, _TargetConfig(conf, values, hidden)))
+	return configs
+
+
+class _TargetConfig(object):
+	"""
+	The config of one target. Has the values that the target gives, and takes everything else from the config.
+	"""
+
+	def __init__(self, conf, values, hidden=()):
+		self.__dict__.update(values)
+		self._conf = conf
+		self._hidden = hidden
+
+	def __getattr__(self, name):
+		# only called for names that the target does not give
+		if name.startswith('__') or name in self._hidden:
+			raise AttributeError(name)
+		return getattr(self._conf, name)
+
 
 def parse_config_login_steps(steps, key_path):
 	parsed_steps = []
@@ -446,7 +1646,88 @@ def parse_config_login_steps(steps, key_path):
 	return parsed_steps
 
 
-def parse_config_endpoints(endpoints, key_path):
+def _same_config(a, b):
+	"""
+	Checks whether two parsed config values are the same. Functions, such as lambda conversions, are the same if they
+	have the same code, as loading the config file again creates new ones.
+	"""
+	if isinstance(a, dict):
+		return isinstance(b, dict) and a.keys() == b.keys() and all(_same_config(a[k], b[k]) for k in a)
+	if isinstance(a, (list, tuple)):
+		return type(a) == type(b) and len(a) == len(b) and all(_same_config(x, y) for x, y in zip(a, b))
+	if isinstance(a, types.FunctionType) and isinstance(b, types.FunctionType):
+		if a.__closure__ is not None or b.__closure__ is not None:
+			return a is b
+		return a.__code__ == b.__code__ and a.__defaults__ == b.__defaults__
+	return a == b
+
+
+def _match_metrics(metrics, old_metrics):
+	"""
+	Finds the metrics that are the same in a new and old version of an endpoint.
+
+	:rtype: ``dict[int, int]``
+	:return: The index of each old metric that is the same as a new metric, keyed by the index of the new metric.
+	"""
+	matches = {}
+	unused = list(range(len(old_metrics)))
+	for idx, m in enumerate(metrics):
+		for old_idx in unused:
+			if _same_config(m, old_metrics[old_idx]):
+				matches[idx] = old_idx
+				unused.remove(old_idx)
+				break
+	return matches
+
+
+def _cookie_key(cookie):
+	return cookie.domain + ';' + cookie.path + ';' + cookie.name
+
+
+def _close_session(session):
+	if session is not None:
+		session.close()
+
+
+def _series_key(channel, metric, tags):
+	return channel + ';' + metric + ';' + ','.join(k + '=' + str(tags[k]) for k in sorted(tags))
+
+
+def parse_config_session_probe(probe, endpoints, key_path):
+	"""
+	Parses the session probe config. The probe can be None to not probe, or a dict with an 'endpoint' and, unless the
+	endpoint is one of the configured endpoints, a 'verify-pattern'. _DEFAULT_PROBE is the first configured endpoint.
+
+	:rtype: ``dict[str, Any]``
+	:return: The parsed probe, with its 'endpoint' and compiled 'verify-pattern'; or None if there is none.
+	"""
+	if probe is None:
+		return None
+	if probe is _DEFAULT_PROBE:
+		if len(endpoints) == 0:
+			return None
+		return {'endpoint': endpoints[0]['endpoint'], 'verify-pattern': endpoints[0]['verify-pattern']}
+	try:
+		uri = str(probe['endpoint'])
+	except KeyError:
+		raise util.ConfigException("session probe must contain 'endpoint' key", key_path)
+	except TypeError:
+		raise util.ConfigException("session probe must be a dict or None", key_path)
+	if 'verify-pattern' in probe:
+		try:
+			pattern = re.compile(probe['verify-pattern'], re.DOTALL)
+		except re.error as e:
+			raise util.ConfigException("session probe verify pattern regex is not compilable; " + str(e), key_path + "['verify-pattern']")
+	else:
+		matching = [ep for ep in endpoints if ep['endpoint'] == uri]
+		if len(matching) == 0:
+			msg = "session probe must contain 'verify-pattern' if its endpoint is not a configured endpoint"
+			raise util.ConfigException(msg, key_path)
+		pattern = matching[0]['verify-pattern']
+	return {'endpoint': uri, 'verify-pattern': pattern}
+
+
+def parse_config_endpoints(endpoints, key_path, lint_mode=lint.LINT_WARN, time_budget=0.1):
 	parsed_endpoints = []
 	idx = 0
 	for ep_data in endpoints:
@@ -469,12 +1750,119 @@ def parse_config_endpoints(endpoints, key_path):
 		except KeyError:
 			raise util.ConfigException("endpoint data must contain 'metrics' list", key)
 
+		try:
+			parsed_ep['priority'] = int(ep_data.get('priority', 0))
+		except ValueError:
+			raise util.ConfigException("endpoint priority not a valid int", key + "['priority']")
+
+		parsed_ep['interval'] = None
+		if 'interval' in ep_data:
+			try:
+				parsed_ep['interval'] = float(ep_data['interval'])
+			except ValueError:
+				raise util.ConfigException("endpoint interval not a valid number", key + "['interval']")
+			if parsed_ep['interval'] <= 0:
+				raise util.ConfigException("endpoint interval must be greater than 0", key + "['interval']")
+
+		try:
+			parsed_ep['offset'] = float(ep_data.get('offset', 0))
+		except ValueError:
+			raise util.ConfigException("endpoint offset not a valid number", key + "['offset']")
+		if parsed_ep['offset'] < 0:
+			raise util.ConfigException("endpoint offset must not be negative", key + "['offset']")
+
+		parsed_ep['sections'] = parse_config_sections(ep_data.get('sections', {}), key + "['sections']")
 		parsed_ep['metrics'] = parse_config_metrics(ep_metrics, key + "['metrics']")
+		for m_idx, m in enumerate(parsed_ep['metrics']):
+			if m['section'] is not None and m['section'] not in parsed_ep['sections']:
+				msg = "metric section is not one of the endpoint's sections: " + repr(m['section'])
+				raise util.ConfigException(msg, key + "['metrics'][" + str(m_idx) + "]['section']")
+		if lint_mode != lint.LINT_OFF:
+			_lint_endpoint(parsed_ep, ep_data.get('sample-page'), key, lint_mode == lint.LINT_REFUSE, time_budget)
+		parsed_ep['aggregations'] = parse_config_aggregations(ep_data.get('aggregations', []), key + "['aggregations']")
 		parsed_endpoints.append(parsed_ep)
 		idx += 1
 	return parsed_endpoints
 
 
+def _lint_endpoint(endpoint, sample_path, key, refuse, time_budget):
+	"""
+	Checks the regexes of a parsed endpoint for constructs that are likely to be slow, and times each metric's regex
+	against a recorded sample of the endpoint's page if one is given. Problems are logged as warnings, or cause the
+	config to be refused.
+
+	The static checks are all done before any timing. A pattern with a problem in its construction is never run
+	against the sample, in either mode, as it could take far longer than the budget to finish.
+	"""
+	patterns = [(key + "['verify-pattern']", endpoint['verify-pattern'])]
+	for name in endpoint['sections']:
+		for edge in ('start', 'end'):
+			edge_pattern = endpoint['sections'][name][edge]
+			if edge_pattern is not None:
+				patterns.append((key + "['sections'][" + repr(name) + "]['" + edge + "']", edge_pattern))
+	for m_idx, m in enumerate(endpoint['metrics']):
+		patterns.append((key + "['metrics'][" + str(m_idx) + "]['regex']", m['regex']))
+
+	flagged = set()
+	for pattern_key, pattern in patterns:
+		for problem in lint.lint_pattern(pattern):
+			_report_lint_problem("regex " + problem, pattern_key, refuse)
+			flagged.add(pattern_key)
+
+	if sample_path is None:
+		return
+	section_keys = [k for k in flagged if k.startswith(key + "['sections']")]
+	if len(section_keys) > 0:
+		_log.warning(key + ": not timing regexes against the sample page, as " + section_keys[0] + " has problems")
+		return
+	try:
+		with open(sample_path, 'r', encoding='utf-8') as fp:
+			sample = fp.read()
+	except OSError as e:
+		raise util.ConfigException("could not read sample page: " + str(e), key + "['sample-page']")
+	sections = Endpoint(endpoint['endpoint'], endpoint['verify-pattern'], endpoint['sections']).locate_sections(sample)
+	sections[None] = sample
+	for m_idx, m in enumerate(endpoint['metrics']):
+		text = sections.get(m['section'])
+		m_key = key + "['metrics'][" + str(m_idx) + "]['regex']"
+		if text is None or m_key in flagged:
+			continue
+		cost = lint.time_pattern(m['regex'], text)
+		_log.debug("Metric regex " + key + "['metrics'][" + str(m_idx) + "] took " + str(cost) + "s on sample page")
+		if cost > time_budget:
+			msg = "regex took {:.3f}s against the sample page, over the budget of {:.3f}s".format(cost, time_budget)
+			_report_lint_problem(msg, m_key, refuse)
+
+
+def _report_lint_problem(msg, key, refuse):
+	if refuse:
+		raise util.ConfigException(msg, key)
+	_log.warning(key + ": " + msg)
+
+
+def parse_config_sections(sections, key_path):
+	parsed_sections = {}
+	for name in sections:
+		key = key_path + "[" + repr(name) + "]"
+		sec_data = sections[name]
+		parsed_sec = {}
+		try:
+			parsed_sec['start'] = re.compile(sec_data['start'], re.DOTALL)
+		except KeyError:
+			raise util.ConfigException("section must contain 'start' pattern", key)
+		except re.error as e:
+			raise util.ConfigException("section start pattern regex is not compilable; " + str(e), key + "['start']")
+
+		parsed_sec['end'] = None
+		if sec_data.get('end') is not None:
+			try:
+				parsed_sec['end'] = re.compile(sec_data['end'], re.DOTALL)
+			except re.error as e:
+				raise util.ConfigException("section end pattern regex is not compilable; " + str(e), key + "['end']")
+		parsed_sections[str(name)] = parsed_sec
+	return parsed_sections
+
+
 def parse_config_metric_values(values, key_path):
 	idx = 0
 	parsed_values = []
@@ -511,8 +1899,18 @@ def parse_config_metric_values(values, key_path):
 			msg = "metric value 'type' must be one of 'CUSTOM', 'VALUE', or 'CAPTURE-*' formats"
 			raise util.ConfigException(msg, key + "['type']")
 
+		try:
+			parsed_v['priority'] = int(v.get('priority', 0))
+		except ValueError:
+			raise util.ConfigException("metric value priority not a valid int", key + "['priority']")
+
+		if parsed_v['type'] != 'const' and isinstance(v_conv, str):
+			try:
+				v_conv = util.get_converter(v_conv)
+			except ValueError as e:
+				raise util.ConfigException(str(e), key + "['conversion']")
 		if parsed_v['type'] != 'const' and type(v_conv) is not type and not callable(v_conv):
-			msg = "metric value conversion be a type or a callable when type is not 'VALUE'"
+			msg = "metric value conversion be a converter name, a type, or a callable when type is not 'VALUE'"
 			raise util.ConfigException(msg, key + "['conversion']")
 		parsed_v['conversion'] = v_conv
 
@@ -538,9 +1936,20 @@ def parse_config_metrics(metrics, key_path):
 			raise util.ConfigException("endpoint metric must contain 'dest' key", key)
 
 		try:
-			parsed_met['regex'] = re.compile(''.join(m['regex']), re.DOTALL)
+			regex = ''.join(m['regex'])
 		except KeyError:
 			raise util.ConfigException("endpoint metric must contain 'regex' list", key)
+
+		template = None
+		if m.get('template') is not None:
+			template = parse_config_metric_template(m['template'], key + "['template']")
+			if regex.count(template['placeholder']) != 1:
+				msg = "metric regex must contain the template placeholder exactly once"
+				raise util.ConfigException(msg, key + "['regex']")
+			regex = regex.replace(template['placeholder'], template['regex'])
+
+		try:
+			parsed_met['regex'] = re.compile(regex, re.DOTALL)
 		except re.error as e:
 			raise util.ConfigException("metric regex not compilable; " + str(e), key + "['regex']")
 
@@ -554,13 +1963,128 @@ def parse_config_metrics(metrics, key_path):
 		except KeyError:
 			raise util.ConfigException("endpoint metric must contain 'tags' map", key)
 
+		try:
+			parsed_met['priority'] = int(m.get('priority', 0))
+		except ValueError:
+			raise util.ConfigException("endpoint metric priority not a valid int", key + "['priority']")
+
+		parsed_met['extraction'] = str(m.get('extraction', 'row')).lower()
+		if parsed_met['extraction'] not in ('row', 'column'):
+			raise util.ConfigException("metric extraction must be one of 'row' or 'column'", key + "['extraction']")
+
+		parsed_met['time-budget'] = None
+		if m.get('time-budget') is not None:
+			try:
+				parsed_met['time-budget'] = float(m['time-budget'])
+			except ValueError:
+				raise util.ConfigException("metric time budget not a valid number", key + "['time-budget']")
+			if parsed_met['time-budget'] <= 0:
+				raise util.ConfigException("metric time budget must be greater than 0", key + "['time-budget']")
+
+		parsed_met['section'] = m.get('section')
+		if parsed_met['section'] is not None:
+			parsed_met['section'] = str(parsed_met['section'])
+
 		parsed_met['values'] = parse_config_metric_values(ep_metric_values, key + "['values']")
 		parsed_met['tags'] = parse_config_metric_tags(ep_metric_tags, key + "['tags']")
+		if template is not None:
+			_apply_metric_template(parsed_met, template, key)
+		# bursts can only be reused when the same text always gives the same values
+		parsed_met['reusable'] = all(_is_pure_conversion(v) for v in parsed_met['values'])
 		parsed_metrics.append(parsed_met)
 		idx += 1
 	return parsed_metrics
 
 
+def parse_config_metric_template(template, key_path):
+	parsed_template = {}
+	try:
+		parsed_template['placeholder'] = str(template['placeholder'])
+	except KeyError:
+		raise util.ConfigException("metric template must contain 'placeholder'", key_path)
+	if parsed_template['placeholder'] == '':
+		raise util.ConfigException("metric template placeholder must not be empty", key_path + "['placeholder']")
+
+	try:
+		instances = template['instances']
+	except KeyError:
+		raise util.ConfigException("metric template must contain 'instances' list", key_path)
+	if len(instances) == 0:
+		raise util.ConfigException("metric template must have at least one instance", key_path + "['instances']")
+
+	# each tag maps the text that matched the placeholder to the value of the tag for that instance
+	tags = {}
+	tag_names = None
+	matches = []
+	idx = 0
+	for inst in instances:
+		key = key_path + "['instances'][" + str(idx) + "]"
+		try:
+			match = str(inst['match'])
+		except KeyError:
+			raise util.ConfigException("metric template instance must contain 'match'", key)
+		if match in matches:
+			raise util.ConfigException("duplicate metric template instance: " + repr(match), key + "['match']")
+		matches.append(match)
+		inst_tags = inst.get('tags', {})
+		if tag_names is None:
+			tag_names = set(inst_tags)
+		elif set(inst_tags) != tag_names:
+			raise util.ConfigException("every metric template instance must have the same tags", key + "['tags']")
+		for t in inst_tags:
+			tags.setdefault(str(t), {})[match] = str(inst_tags[t])
+		idx += 1
+	parsed_template['tags'] = tags
+
+	# longest first, so that an instance that is a prefix of another does not hide it
+	matches.sort(key=len, reverse=True)
+	parsed_template['regex'] = '(?P<' + _TEMPLATE_GROUP + '>' + '|'.join(re.escape(x) for x in matches) + ')'
+	return parsed_template
+
+
+_TEMPLATE_GROUP = '_template'
+
+
+def _apply_metric_template(metric, template, key):
+	"""
+	Adjusts the values and tags of a parsed metric for the template that its regex was created from. Capture groups
+	are given in terms of the regex as written in the config, so those after the placeholder are moved back by the
+	group that the placeholder was replaced with. Every tag of the template is added as a tag that is looked up from
+	the text that the placeholder matched.
+	"""
+	template_group = metric['regex'].groupindex[_TEMPLATE_GROUP]
+
+	def remap(group):
+		return group + 1 if group >= template_group else group
+
+	for value_def in metric['values']:
+		if value_def['type'] == 'capture':
+			value_def['capture'] = remap(value_def['capture'])
+	for tag_name in metric['tags']:
+		tag_def = metric['tags'][tag_name]
+		if tag_def['type'] == 'capture':
+			tag_def['value'] = remap(tag_def['value'])
+	for tag_name in template['tags']:
+		if tag_name in metric['tags']:
+			msg = "metric template tag is also a metric tag: " + repr(tag_name)
+			raise util.ConfigException(msg, key + "['template']")
+		metric['tags'][tag_name] = {
+			'type': 'lookup',
+			'value': template_group,
+			'map': template['tags'][tag_name]
+		}
+
+
+def _is_pure_conversion(value_def):
+	conv = value_def['conversion']
+	if value_def['type'] == 'const':
+		return True
+	if isinstance(conv, util.Converter):
+		return not conv.time_dependent
+	# types such as int and float only depend on their input; any other callable could depend on anything
+	return value_def['type'] == 'capture' and type(conv) is type
+
+
 def parse_config_metric_tags(tags, key_path):
 	parsed_tags = {}
 	for name in tags:
@@ -584,6 +2108,77 @@ def parse_config_metric_tags(tags, key_path):
 	return parsed_tags
 
 
+def parse_config_aggregations(aggregations, key_path):
+	parsed_aggs = []
+	idx = 0
+	for agg in aggregations:
+		parsed_agg = {}
+		key = key_path + '[' + str(idx) + ']'
+		try:
+			parsed_agg['dest'] = str(agg['dest'])
+		except KeyError:
+			raise util.ConfigException("aggregation must contain 'dest' key", key)
+
+		try:
+			parsed_agg['name'] = str(agg['name'])
+		except KeyError:
+			raise util.ConfigException("aggregation must contain 'name' key", key)
+
+		try:
+			parsed_agg['source'] = str(agg['source'])
+		except KeyError:
+			raise util.ConfigException("aggregation must contain 'source' key", key)
+
+		parsed_agg['group-by'] = [str(t) for t in agg.get('group-by', [])]
+		agg_tags = agg.get('tags', {})
+		parsed_agg['tags'] = {str(t): str(agg_tags[t]) for t in agg_tags}
+		parsed_agg['drop-source'] = bool(agg.get('drop-source', False))
+
+		try:
+			agg_values = agg['values']
+		except KeyError:
+			raise util.ConfigException("aggregation must contain 'values' list", key)
+
+		parsed_agg['values'] = parse_config_aggregation_values(agg_values, key + "['values']")
+		parsed_aggs.append(parsed_agg)
+		idx += 1
+	return parsed_aggs
+
+
+def parse_config_aggregation_values(values, key_path):
+	parsed_values = []
+	idx = 0
+	for v in values:
+		parsed_v = {}
+		key = key_path + '[' + str(idx) + ']'
+		try:
+			parsed_v['name'] = str(v['name'])
+		except KeyError:
+			raise util.ConfigException("aggregation value must contain 'name'", key)
+
+		try:
+			parsed_v['field'] = str(v['field'])
+		except KeyError:
+			raise util.ConfigException("aggregation value must contain 'field'", key)
+
+		try:
+			func = str(v['function']).lower()
+		except KeyError:
+			raise util.ConfigException("aggregation value must contain 'function'", key)
+
+		if func in ('sum', 'count', 'min', 'max', 'mean'):
+			parsed_v['function'] = {'type': func}
+		elif re.match(r'p\d+(\.\d+)?$', func) is not None and float(func[1:]) <= 100:
+			parsed_v['function'] = {'type': 'percentile', 'percentile': float(func[1:])}
+		else:
+			msg = "aggregation function must be one of 'sum', 'count', 'min', 'max', 'mean', or 'p0'-'p100'"
+			raise util.ConfigException(msg, key + "['function']")
+
+		parsed_values.append(parsed_v)
+		idx += 1
+	return parsed_values
+
+
 def parse_config_telegraf_clients(clients, key_path):
 	parsed_clients = {}
 	for name in clients:
@@ -0,0 +1,173 @@
+"""
+Snapshots of the config, so that a config file that has not changed is not executed, parsed, and linted again each
+time the scraper starts or reloads.
+
+A snapshot holds the values of the config module together with the parsed form of it, pickled; compiled regexes are
+pickled as their source and flags, and conversions as the built-in converters they name. It is kept in the __pycache__
+directory next to the config file, and is only used if the content of the config file, the sample pages it names, the
+source of this package, and the version of Python are all the same as when it was made. Snapshots are only made for
+a config that sets env_config_snapshot to True, as a config that reads anything else when it is executed, such as
+environment variables, would have stale values read back from its snapshot. A config that cannot be pickled, such as
+one with lambda conversions, is never snapshotted.
+"""
+import hashlib
+import importlib.util
+import logging
+import os
+import pickle
+import sys
+import types
+
+_log = logging.getLogger(__name__)
+_log.setLevel(logging.DEBUG)
+
+# changed whenever what is stored in a snapshot changes
+_FORMAT_VERSION = 3
+
+
+class ConfigSnapshot(object):
+	"""
+	The values of a config module, as read from a snapshot. Has the same attributes as the module did.
+	"""
+
+	def __init__(self, path, values):
+		"""
+		Creates a new ConfigSnapshot.
+
+		:type path: ``str``
+		:param path: The path of the config file.
+		:type values: ``dict[str, Any]``
+		:param values: The public values of the config module, keyed by name.
+		"""
+		self.__dict__.update(values)
+		self.__file__ = path
+
+
+def load(path, with_parsed=True):
+	"""
+	Loads a config file, from its snapshot if it has an up-to-date one. Otherwise, the file is executed.
+
+	:type path: ``str``
+	:param path: The path of the config file.
+	:type with_parsed: ``bool``
+	:param with_parsed: Whether to read the parsed form of the config from the snapshot. Reading it recompiles every
+	regex in it, which is not needed by something that only uses the values of the config.
+	:rtype: ``(Any, list[(str, dict[str, Any])])``
+	:return: The config, and its parsed form if it was read from a snapshot or None if it was not.
+	"""
+	with open(path, 'rb') as fp:
+		source = fp.read()
+	key = _snapshot_key(source)
+	snapshot_path = get_snapshot_path(path)
+	try:
+		with open(snapshot_path, 'rb') as fp:
+			header = pickle.load(fp)
+			if header['key'] != key or not all(_file_stamp(p) == stamp for p, stamp in header['sources']):
+				_log.debug("Config snapshot '" + snapshot_path + "' is out of date")
+				return exec_config(path), None
+			values = pickle.load(fp)
+			parsed = pickle.load(fp) if with_parsed else None
+	except FileNotFoundError:
+		return exec_config(path), None
+	except Exception as e:
+		# the rest of the snapshot is only read if the header matches, so this is a damaged file
+		_log.warning("Could not read config snapshot '" + snapshot_path + "': " + str(e))
+		return exec_config(path), None
+	_log.debug("Loaded config from snapshot '" + snapshot_path + "'")
+	return ConfigSnapshot(path, values), parsed
+
+
+def save(path, conf, parsed, sources=()):
+	"""
+	Makes a snapshot of a config file. Nothing is saved if the config does not have env_config_snapshot set to True, or
+	if it cannot be pickled.
+
+	:type path: ``str``
+	:param path: The path of the config file.
+	:type conf: ``module``
+	:param conf: The config, as executed from the file.
+	:type parsed: ``list[(str, dict[str, Any])]``
+	:param parsed: The parsed form of the config, as the name and parsed config of each target.
+	:type sources: ``list[str]``
+	:param sources: The paths of other files that the parsed form depends on. The snapshot is out of date if any of
+	them change.
+	:rtype: ``bool``
+	:return: Whether the snapshot was saved.
+	"""
+	if not getattr(conf, 'env_config_snapshot', False):
+		return False
+	values = dict((k, v) for k, v in vars(conf).items() if not k.startswith('_') and not isinstance(v, types.ModuleType))
+	with open(path, 'rb') as fp:
+		source = fp.read()
+	header = {'key': _snapshot_key(source), 'sources': [(p, _file_stamp(p)) for p in sources]}
+	try:
+		data = pickle.dumps(header, protocol=pickle.HIGHEST_PROTOCOL)
+		data += pickle.dumps(values, protocol=pickle.HIGHEST_PROTOCOL)
+		data += pickle.dumps(parsed, protocol=pickle.HIGHEST_PROTOCOL)
+	except (pickle.PicklingError, AttributeError, TypeError) as e:
+		_log.debug("Config cannot be snapshotted: " + str(e))
+		return False
+
+	snapshot_path = get_snapshot_path(path)
+	temp_path = snapshot_path + '.tmp'
+	try:
+		os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+		# the snapshot has everything that is in the config, including the password
+		fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+		with os.fdopen(fd, 'wb') as fp:
+			fp.write(data)
+		os.replace(temp_path, snapshot_path)
+	except OSError as e:
+		_log.debug("Could not save config snapshot '" + snapshot_path + "': " + str(e))
+		return False
+	_log.debug("Saved config snapshot '" + snapshot_path + "'")
+	return True
+
+
+def exec_config(path):
+	"""
+	Executes a config file.
+
+	:type path: ``str``
+	:param path: The path of the config file.
+	:rtype: ``module``
+	:return: The config module.
+	"""
+	spec = importlib.util.spec_from_file_location('config', path)
+	config = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(config)
+	return config
+
+
+def get_snapshot_path(path):
+	"""
+	Gets where the snapshot of a config file is kept.
+
+	:type path: ``str``
+	:param path: The path of the config file.
+	:rtype: ``str``
+	:return: The path of the snapshot.
+	"""
+	directory, name = os.path.split(os.path.abspath(path))
+	return os.path.join(directory, '__pycache__', name + '.snapshot')
+
+
+def _snapshot_key(source):
+	"""
+	Gets the key that a snapshot of a config file is valid for, from the content of the file and everything else that
+	the parsed form of it depends on.
+	"""
+	package_dir = os.path.dirname(os.path.abspath(__file__))
+	modules = sorted(name for name in os.listdir(package_dir) if name.endswith('.py'))
+	code = [(name, _file_stamp(os.path.join(package_dir, name))) for name in modules]
+	h = hashlib.blake2b(source, digest_size=16)
+	h.update(repr((_FORMAT_VERSION, tuple(sys.version_info[:2]), code)).encode('utf-8'))
+	return h.hexdigest()
+
+
+def _file_stamp(path):
+	try:
+		st = os.stat(path)
+	except OSError:
+		return None
+	return st.st_mtime_ns, st.st_size
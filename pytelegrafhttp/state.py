@@ -0,0 +1,190 @@
+"""
+Persistent state of the scraper, kept in an SQLite database so that it is saved atomically and can be read back
+safely after a crash.
+"""
+import logging
+import os
+import pickle
+import sqlite3
+
+_log = logging.getLogger(__name__)
+_log.setLevel(logging.DEBUG)
+
+_SQLITE_HEADER = b'SQLite format 3\x00'
+
+
+class StateStore(object):
+	"""
+	Key-value store of state, grouped into sections. Values are any picklable object. All values are read when the
+	store is opened; set() only changes the copy in memory, and flush() writes the values whose pickled form has changed
+	since they were last written, in a single transaction.
+
+	The database is in WAL mode, so a crash during a write leaves the last committed state readable.
+	"""
+
+	def __init__(self, path):
+		"""
+		Opens a StateStore, creating the database if it does not exist. A file that is not a readable database is moved
+		aside to the same path with '.corrupt' added, and an empty store is created in its place.
+
+		:type path: ``str``
+		:param path: The path of the database file.
+		"""
+		self._path = path
+		self._values = {}
+		""":type : dict[(str, str), Any]"""
+		self._saved = {}
+		""":type : dict[(str, str), bytes]"""
+		self._deleted = set()
+		try:
+			self._conn = self._open()
+		except sqlite3.DatabaseError as e:
+			_log.error("State database '" + path + "' is unreadable (" + str(e) + "); moving it aside")
+			os.replace(path, path + '.corrupt')
+			self._values = {}
+			self._saved = {}
+			self._conn = self._open()
+
+	def get(self, section, key, default=None):
+		"""
+		Gets a value.
+
+		:type section: ``str``
+		:param section: The section of the value.
+		:type key: ``str``
+		:param key: The key of the value.
+		:param default: What to give if there is no value.
+		:return: The value.
+		"""
+		return self._values.get((section, key), default)
+
+	def items(self, section):
+		"""
+		Gets every value in a section.
+
+		:type section: ``str``
+		:param section: The section to get.
+		:rtype: ``dict[str, Any]``
+		:return: The values, keyed by their keys.
+		"""
+		return dict((k[1], v) for k, v in self._values.items() if k[0] == section)
+
+	def set(self, section, key, value):
+		"""
+		Sets a value. It is not written until flush() is called.
+
+		:type section: ``str``
+		:param section: The section of the value.
+		:type key: ``str``
+		:param key: The key of the value.
+		:param value: The value. Must be picklable.
+		"""
+		self._values[(section, key)] = value
+		self._deleted.discard((section, key))
+
+	def delete(self, section, key):
+		"""
+		Removes a value. It is not removed from the database until flush() is called.
+
+		:type section: ``str``
+		:param section: The section of the value.
+		:type key: ``str``
+		:param key: The key of the value.
+		"""
+		if (section, key) in self._values:
+			del self._values[(section, key)]
+			self._deleted.add((section, key))
+
+	def replace_section(self, section, values):
+		"""
+		Sets every value in a section, removing any that are not given.
+
+		:type section: ``str``
+		:param section: The section to set.
+		:type values: ``dict[str, Any]``
+		:param values: The new values, keyed by their keys.
+		"""
+		for key in self.items(section):
+			if key not in values:
+				self.delete(section, key)
+		for key in values:
+			self.set(section, key, values[key])
+
+	def flush(self):
+		"""
+		Writes every value that has changed since it was last written, and removes deleted values.
+
+		:rtype: ``int``
+		:return: The number of rows that were written or removed.
+		"""
+		changed = []
+		for k, v in self._values.items():
+			data = pickle.dumps(v, protocol=pickle.HIGHEST_PROTOCOL)
+			if self._saved.get(k) != data:
+				changed.append((k, data))
+		deleted = [k for k in self._deleted if k in self._saved]
+		if len(changed) == 0 and len(deleted) == 0:
+			self._deleted = set()
+			return 0
+		with self._conn:
+			self._conn.executemany(
+				"INSERT OR REPLACE INTO state (section, key, value) VALUES (?, ?, ?)",
+				[(k[0], k[1], sqlite3.Binary(data)) for k, data in changed]
+			)
+			self._conn.executemany("DELETE FROM state WHERE section = ? AND key = ?", deleted)
+		for k, data in changed:
+			self._saved[k] = data
+		for k in deleted:
+			del self._saved[k]
+		self._deleted = set()
+		_log.debug("Wrote " + str(len(changed)) + " and removed " + str(len(deleted)) + " state value(s)")
+		return len(changed) + len(deleted)
+
+	def close(self):
+		"""
+		Closes the database. Values that have not been flushed are not written.
+		"""
+		if self._conn is not None:
+			self._conn.close()
+			self._conn = None
+
+	def _open(self):
+		# the owner of the store is responsible for not using it from more than one thread at a time
+		conn = sqlite3.connect(self._path, check_same_thread=False)
+		try:
+			conn.execute("PRAGMA journal_mode=WAL")
+			# with WAL, a crash can only lose the last commits, never corrupt the database
+			conn.execute("PRAGMA synchronous=NORMAL")
+			conn.execute(
+				"CREATE TABLE IF NOT EXISTS state (section TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL,"
+				+ " PRIMARY KEY (section, key))"
+			)
+			conn.commit()
+			for section, key, data in conn.execute("SELECT section, key, value FROM state"):
+				data = bytes(data)
+				try:
+					self._values[(section, key)] = pickle.loads(data)
+				except Exception as e:
+					_log.warning("Skipping unreadable state value " + section + "/" + key + ": " + str(e))
+					continue
+				self._saved[(section, key)] = data
+		except sqlite3.DatabaseError:
+			conn.close()
+			raise
+		return conn
+
+
+def is_database(path):
+	"""
+	Checks whether a file is an SQLite database.
+
+	:type path: ``str``
+	:param path: The path of the file.
+	:rtype: ``bool``
+	:return: Whether the file starts with the SQLite header. False if it does not exist.
+	"""
+	try:
+		with open(path, 'rb') as f:
+			return f.read(len(_SQLITE_HEADER)) == _SQLITE_HEADER
+	except FileNotFoundError:
+		return False
@@ -0,0 +1,94 @@
+from pytelegrafhttp import aggregate, scrape, util
+from unittest import TestCase
+
+
+class AggregateTest(TestCase):
+
+	def setUp(self):
+		self.bursts = [
+			_health_burst('flandre', 'na', online=1, files=100, quality=4000),
+			_health_burst('remilia', 'na', online=1, files=300, quality=6000),
+			_health_burst('sakuya', 'eu', online=0, files=50),
+			_health_burst('meiling', 'eu', online=1, files=25, quality=8000),
+		]
+
+	def test_fleet_totals(self):
+		agg = _parse_aggregation([
+			{'name': 'clients', 'field': 'files', 'function': 'count'},
+			{'name': 'online', 'field': 'online', 'function': 'sum'},
+			{'name': 'files', 'field': 'files', 'function': 'sum'},
+			{'name': 'quality-mean', 'field': 'quality', 'function': 'mean'},
+			{'name': 'quality-min', 'field': 'quality', 'function': 'min'},
+			{'name': 'quality-max', 'field': 'quality', 'function': 'max'},
+		])
+
+		result = aggregate.aggregate_bursts(agg, self.bursts)
+
+		self.assertEqual(len(result), 1)
+		v = result[0]['values']
+		self.assertEqual(v['clients'], 4)
+		self.assertEqual(v['online'], 3)
+		self.assertEqual(v['files'], 475)
+		self.assertEqual(v['quality-mean'], 6000.0)
+		self.assertEqual(v['quality-min'], 4000)
+		self.assertEqual(v['quality-max'], 8000)
+		self.assertEqual(result[0]['metric'], 'hath-fleet')
+		self.assertEqual(result[0]['channel'], 'hath-fleet-stats')
+
+	def test_group_by(self):
+		agg = _parse_aggregation([{'name': 'files', 'field': 'files', 'function': 'sum'}], group_by=['region'])
+
+		result = aggregate.aggregate_bursts(agg, self.bursts)
+
+		by_region = {b['tags']['region']: b['values']['files'] for b in result}
+		self.assertEqual(by_region, {'na': 400, 'eu': 75})
+
+	def test_percentile(self):
+		agg = _parse_aggregation([
+			{'name': 'files-p50', 'field': 'files', 'function': 'p50'},
+			{'name': 'files-p100', 'field': 'files', 'function': 'p100'},
+		])
+
+		v = aggregate.aggregate_bursts(agg, self.bursts)[0]['values']
+
+		self.assertEqual(v['files-p50'], 75.0)
+		self.assertEqual(v['files-p100'], 300)
+
+	def test_drop_source(self):
+		agg = _parse_aggregation([{'name': 'files', 'field': 'files', 'function': 'sum'}], drop_source=True)
+
+		result = aggregate.apply_aggregations([agg], self.bursts)
+
+		self.assertEqual(len(result), 1)
+		self.assertEqual(result[0]['metric'], 'hath-fleet')
+
+	def test_keep_source(self):
+		agg = _parse_aggregation([{'name': 'files', 'field': 'files', 'function': 'sum'}])
+
+		result = aggregate.apply_aggregations([agg], self.bursts)
+
+		self.assertEqual(len(result), 5)
+
+	def test_bad_function(self):
+		with self.assertRaises(util.ConfigException):
+			_parse_aggregation([{'name': 'files', 'field': 'files', 'function': 'median'}])
+
+
+def _parse_aggregation(values, group_by=None, drop_source=False):
+	return scrape.parse_config_aggregations([{
+		'dest': 'hath-fleet-stats',
+		'name': 'hath-fleet',
+		'source': 'hath-health',
+		'group-by': group_by if group_by is not None else [],
+		'values': values,
+		'drop-source': drop_source
+	}], '')[0]
+
+
+def _health_burst(host, region, **values):
+	return {
+		'channel': 'hath-client-net-stats',
+		'metric': 'hath-health',
+		'values': values,
+		'tags': {'host': host, 'region': region}
+	}
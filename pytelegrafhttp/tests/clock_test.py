@@ -0,0 +1,163 @@
+from pytelegrafhttp import clock, schedule
+from unittest import TestCase, skipUnless
+import os
+import signal
+import threading
+import time
+
+
+class _TestSignal(BaseException):
+
+	def __init__(self, signum):
+		super().__init__()
+		self.signum = signum
+
+
+def _raise_test_signal(signum, frame):
+	raise _TestSignal(signum)
+
+
+@skipUnless(hasattr(signal, 'SIGHUP'), "requires POSIX signals")
+class CriticalSectionTest(TestCase):
+
+	def setUp(self):
+		self._old_handlers = {
+			signal.SIGHUP: signal.signal(signal.SIGHUP, _raise_test_signal),
+			signal.SIGTERM: signal.signal(signal.SIGTERM, _raise_test_signal)
+		}
+
+	def tearDown(self):
+		for sig in self._old_handlers:
+			signal.signal(sig, self._old_handlers[sig])
+
+	def test_sighup_deferred_until_exit(self):
+		self._assert_signal_deferred(signal.SIGHUP)
+
+	def test_sigterm_deferred_until_exit(self):
+		self._assert_signal_deferred(signal.SIGTERM)
+
+	def test_handlers_restored(self):
+		with clock._CriticalSection():
+			pass
+
+		self.assertIs(signal.getsignal(signal.SIGHUP), _raise_test_signal)
+		self.assertIs(signal.getsignal(signal.SIGTERM), _raise_test_signal)
+
+	def test_signal_sent_from_other_thread_deferred(self):
+		# the thread is started before the section, as the control thread is, so that it does not inherit anything the
+		# section does to the main thread.
+		entered = threading.Event()
+
+		def send():
+			entered.wait(5)
+			os.kill(os.getpid(), signal.SIGTERM)
+
+		sender = threading.Thread(target=send)
+		sender.start()
+		completed = False
+		with self.assertRaises(_TestSignal) as ctx:
+			with clock._CriticalSection():
+				entered.set()
+				sender.join()
+				time.sleep(0.01)
+				completed = True
+
+		self.assertTrue(completed)
+		self.assertEqual(ctx.exception.signum, signal.SIGTERM)
+
+	def test_signals_after_raising_handler_still_delivered(self):
+		received = []
+		signal.signal(signal.SIGTERM, lambda signum, frame: received.append(signum))
+
+		with self.assertRaises(_TestSignal) as ctx:
+			with clock._CriticalSection():
+				os.kill(os.getpid(), signal.SIGHUP)
+				os.kill(os.getpid(), signal.SIGTERM)
+
+		self.assertEqual(ctx.exception.signum, signal.SIGHUP)
+		self.assertEqual(received, [signal.SIGTERM])
+
+	def test_advance_interrupted_after_update(self):
+		tc = clock.TickClock(limiter_enabled=False).start(60)
+
+		with self.assertRaises(_TestSignal):
+			with clock._CriticalSection():
+				os.kill(os.getpid(), signal.SIGHUP)
+				tc.advance()
+
+		self.assertEqual(tc.tick, 1)
+
+	def _assert_signal_deferred(self, signum):
+		completed = False
+		with self.assertRaises(_TestSignal) as ctx:
+			with clock._CriticalSection():
+				os.kill(os.getpid(), signum)
+				# give the interpreter a chance to run any pending handlers
+				for _ in range(1000):
+					pass
+				completed = True
+
+		self.assertTrue(completed)
+		self.assertEqual(ctx.exception.signum, signum)
+
+
+class TickClockTest(TestCase):
+
+	def test_advance_increments_tick(self):
+		tc = clock.TickClock(limiter_enabled=False).start(60)
+
+		tc.advance().advance()
+
+		self.assertEqual(tc.tick, 2)
+		self.assertFalse(tc.is_slow)
+
+	def test_advance_requires_running(self):
+		tc = clock.TickClock()
+
+		with self.assertRaises(ValueError):
+			tc.advance()
+
+	def test_late_tick_stats(self):
+		tc = clock.TickClock(overrun_policy=clock.OVERRUN_CATCH_UP).start(0.02)
+
+		time.sleep(0.05)
+		tc.advance()
+
+		self.assertTrue(tc.is_slow)
+		self.assertGreater(tc.lateness.total_seconds(), 0.02)
+		stats = tc.lateness_stats
+		self.assertEqual(stats['ticks'], 1)
+		self.assertEqual(stats['late-ticks'], 1)
+
+	def test_skip_policy_drops_missed_ticks(self):
+		tc = clock.TickClock(overrun_policy=clock.OVERRUN_SKIP).start(0.1)
+
+		time.sleep(0.25)
+		tc.advance()
+
+		self.assertEqual(tc.missed, 2)
+		self.assertEqual(tc.lateness_stats['missed-ticks'], 2)
+		self.assertGreaterEqual(tc.monotonic, tc.target)
+
+	def test_default_overrun_policy_matches_scheduler(self):
+		self.assertEqual(clock.TickClock().overrun_policy, schedule.Scheduler()._overrun_policy)
+		self.assertEqual(clock.TickClock.from_json({'tick': 3, 'active': False}).overrun_policy, clock.DEFAULT_OVERRUN_POLICY)
+
+	def test_bad_overrun_policy(self):
+		with self.assertRaises(ValueError):
+			clock.TickClock(overrun_policy='panic')
+
+
+class NextTargetTest(TestCase):
+
+	def test_on_schedule(self):
+		self.assertEqual(clock.next_target(100, 60, 130, clock.OVERRUN_SKIP), (160, 0))
+
+	def test_catch_up(self):
+		self.assertEqual(clock.next_target(100, 60, 290, clock.OVERRUN_CATCH_UP), (160, 0))
+
+	def test_skip(self):
+		self.assertEqual(clock.next_target(100, 60, 290, clock.OVERRUN_SKIP), (340, 3))
+
+	def test_rephase(self):
+		self.assertEqual(clock.next_target(100, 60, 290, clock.OVERRUN_REPHASE), (290, 0))
@@ -0,0 +1,103 @@
+from pytelegrafhttp import daemon
+from types import SimpleNamespace
+from unittest import TestCase, skipUnless
+import os
+import signal
+import tempfile
+import threading
+
+
+@skipUnless(daemon.CONTROL_SUPPORTED, "unix sockets are not supported")
+class DaemonControlTest(TestCase):
+
+	def setUp(self):
+		tmp = tempfile.TemporaryDirectory()
+		self.addCleanup(tmp.cleanup)
+		self.conf = SimpleNamespace(env_daemon_files_dir=tmp.name)
+		self.stuck = False
+		self.flushed = 0
+		self.server = _Communicator(self)
+		self.server.load_config(self.conf)
+		self.server.signal_started()
+		self.server.start_control(self._status, {
+			daemon.COMMAND_STATS: lambda: {'shed-endpoints': 2},
+			daemon.COMMAND_FLUSH: self._flush
+		}, timeout=1)
+		self.addCleanup(self.server.stop_control)
+		self.client = daemon.DaemonCommunicator()
+		self.client.load_config(self.conf)
+
+	def test_status(self):
+		response = self.client.send_command(os.getpid(), daemon.COMMAND_STATUS)
+
+		self.assertEqual(response['status']['tick'], 7)
+		self.assertEqual(response['status']['activity'], 'scraping /high')
+
+	def test_stats_and_flush(self):
+		stats = self.client.send_command(os.getpid(), daemon.COMMAND_STATS)
+		flush = self.client.send_command(os.getpid(), daemon.COMMAND_FLUSH)
+
+		self.assertEqual(stats['result'], {'shed-endpoints': 2})
+		self.assertEqual(flush['result'], {'written': 3})
+		self.assertEqual(self.flushed, 1)
+
+	def test_reload_completes_on_acknowledgement(self):
+		response = self.client.send_command(os.getpid(), daemon.COMMAND_RELOAD, timeout=5)
+
+		self.assertEqual(response['state'], 'done')
+		self.assertEqual(self.server.signals, [signal.SIGHUP])
+
+	def test_stop_completes_on_termination(self):
+		response = self.client.send_command(os.getpid(), daemon.COMMAND_STOP, timeout=5)
+
+		self.assertEqual(response['state'], 'done')
+		self.assertEqual(self.server.signals, [signal.SIGTERM])
+		self.server.acknowledger.join()
+		self.assertFalse(os.path.exists(os.path.join(self.conf.env_daemon_files_dir, str(os.getpid()) + '.sock')))
+
+	def test_stuck_process_reported_right_away(self):
+		self.stuck = True
+		self.server.acknowledge = False
+
+		with self.assertRaises(daemon.ControlError) as cm:
+			self.client.send_command(os.getpid(), daemon.COMMAND_STOP, timeout=5)
+
+		self.assertIn("tick 7, scraping /high for 120.0s", str(cm.exception))
+
+	def test_unknown_command(self):
+		with self.assertRaises(daemon.ControlError):
+			self.client.send_command(os.getpid(), 'explode')
+
+	def test_not_running(self):
+		with self.assertRaises(daemon.ControlError):
+			self.client.send_command(os.getpid() + 1000000, daemon.COMMAND_STATUS)
+
+	def _status(self):
+		return {'tick': 7, 'activity': 'scraping /high', 'activity-seconds': 120.0, 'stuck': self.stuck}
+
+	def _flush(self):
+		self.flushed += 1
+		return {'written': 3}
+
+
+class _Communicator(daemon.DaemonCommunicator):
+	"""
+	Communicator that acknowledges stops and reloads itself instead of signaling the test process.
+	"""
+
+	def __init__(self, test):
+		super().__init__()
+		self.signals = []
+		self.acknowledge = True
+		self.acknowledger = None
+
+	def _signal_self(self, signum):
+		self.signals.append(signum)
+		if not self.acknowledge:
+			return
+		# termination stops the server, which waits for this handler, so it has to be done from another thread
+		if signum == signal.SIGHUP:
+			self.acknowledger = threading.Thread(target=self.signal_reload_completed)
+		else:
+			self.acknowledger = threading.Thread(target=self.signal_terminated)
+		self.acknowledger.start()
@@ -1,9 +1,10 @@
-from pytelegrafhttp.endpoint import Endpoint
-from pytelegrafhttp.util import check_online
+from pytelegrafhttp.endpoint import Endpoint, Burst, ExtractionTimeout
+from pytelegrafhttp.util import check_online, VerificationError
 from pytelegrafhttp.clock import now
-from pytelegrafhttp import scrape
-from unittest import TestCase
+from pytelegrafhttp import endpoint, scrape, util
+from unittest import TestCase, mock, skipUnless
 import re
+import signal
 from datetime import timedelta
 
 
@@ -346,4 +347,315 @@ def _create_body_text(*clients, **kwargs):
 </tr>'''
 	for client in clients:
 		text += _create_client_text(**client)
-	return text
\ No newline at end of file
+	return text
+
+
+class EndpointConverterNameTest(TestCase):
+
+	def test_named_converters(self):
+		endpoint = Endpoint('/myuri/endpoint', re.compile('F@H Miss% shows the percentage of requests'))
+		metric = scrape.parse_config_metrics([{
+			'dest': 'hath-client-net-stats',
+			'name': 'hath-health',
+			'regex': [
+				r'<tr>\s*',
+				r'<td><a [^>]*>([^<]+)</a></td>\s*',
+				r'<td>[^<]+</td>\s*',
+				r'<td [^>]*>Online</td>\s*',
+				r'<td>[^<]*</td>\s*',
+				r'<td>([^<]*)</td>\s*',
+				r'<td>([^<]+)</td>\s*',
+				r'<td [^>]*>[^<]+</td>\s*',
+				r'<td>[^<]*</td>\s*',
+				r'<td>[^<]*</td>\s*',
+				r'<td>[^<]*</td>\s*',
+				r'<td [^>]*>[^<]+</td>\s*',
+				r'<td>[^<]+</td>\s*',
+				r'<td>([^<]+)</td>\s*',
+			],
+			'values': [
+				{'name': 'online', 'conversion': 'online-within:5m', 'type': 'CAPTURE-2'},
+				{'name': 'files', 'conversion': 'int-commas', 'type': 'CAPTURE-3'},
+				{'name': 'hitrate', 'conversion': 'per-min', 'type': 'CAPTURE-4'}
+			],
+			'tags': {'host': 'CAPTURE-1'}
+		}], '')[0]
+		text = _create_body_text(dict(files=61234, hitrate=2.6))
+
+		v = endpoint.scrape_metric(metric, text)[0]['values']
+
+		self.assertEqual(v, {'online': 1, 'files': 61234, 'hitrate': 2.6})
+
+	def test_unknown_converter_name(self):
+		from pytelegrafhttp.util import ConfigException
+		with self.assertRaises(ConfigException):
+			scrape.parse_config_metric_values([{'name': 'x', 'conversion': 'nope', 'type': 'CAPTURE-1'}], '')
+
+	def test_argument_to_converter_without_one(self):
+		from pytelegrafhttp.util import ConfigException
+		with self.assertRaises(ConfigException) as ctx:
+			scrape.parse_config_metric_values([{'name': 'x', 'conversion': 'int:5', 'type': 'CAPTURE-1'}], 'values')
+
+		self.assertEqual(ctx.exception.key, "values[0]['conversion']")
+
+
+class EndpointColumnExtractionTest(TestCase):
+
+	def setUp(self):
+		self.endpoint = Endpoint('/myuri/endpoint', re.compile('F@H Miss% shows the percentage of requests'))
+		self.text = _create_body_text(
+			dict(id='1', name='flandre', files=1234567, quality=3953, hitrate=2.6),
+			dict(id='2', name='remilia', online=False, files=50),
+			dict(id='3', name='sakuya', files=12, trust=-4, hathrate=0.5)
+		)
+
+	def test_matches_row_extraction(self):
+		for metric in (_client_stats_metric, _offline_client_stats_metric, _network_stats_metric):
+			column_metric = dict(metric, extraction='column')
+
+			expected = self.endpoint.scrape_metric(metric, self.text)
+			actual = self.endpoint.scrape_metric(column_metric, self.text)
+
+			self.assertEqual(actual, expected)
+
+	def test_named_converters(self):
+		metric = dict(_client_stats_metric, extraction='column', values=scrape.parse_config_metric_values([
+			{'name': 'files', 'conversion': 'int-commas', 'type': 'CAPTURE-4'},
+			{'name': 'hitrate', 'conversion': 'float', 'type': 'CAPTURE-7'},
+		], ''))
+
+		bursts = self.endpoint.scrape_metric(metric, self.text)
+
+		self.assertEqual([b['values']['files'] for b in bursts], [1234567, 12])
+		self.assertEqual([b['values']['hitrate'] for b in bursts], [2.6, 1.2])
+		self.assertEqual([b['tags']['host'] for b in bursts], ['flandre', 'sakuya'])
+
+	def test_not_found(self):
+		metric = dict(_client_stats_metric, extraction='column')
+		text = _create_body_text(dict(online=False))
+
+		self.assertIsNone(self.endpoint.scrape_metric(metric, text))
+
+
+class EndpointSectionTest(TestCase):
+
+	def setUp(self):
+		sections = scrape.parse_config_sections({
+			'network': {'start': r'<th>F@H Region</th>', 'end': r'</table>'},
+			'clients': {'start': r'Your Active Clients'}
+		}, '')
+		self.endpoint = Endpoint('/myuri/endpoint', re.compile('F@H Miss% shows the percentage of requests'), sections)
+		self.network_metric = dict(_network_stats_metric, section='network', reusable=True)
+		self.client_metric = dict(_client_stats_metric, section='clients', reusable=True)
+
+	def test_metric_only_searches_its_section(self):
+		text = _create_body_text()
+
+		self.assertEqual(len(self.endpoint.scrape_all_metrics([self.network_metric], text)), 2)
+		self.assertEqual(self.endpoint.scrape_all_metrics([dict(self.network_metric, section='clients')], text), [])
+
+	def test_unchanged_section_reuses_parse(self):
+		metrics = [self.network_metric, self.client_metric]
+		self.endpoint.scrape_all_metrics(metrics, _create_body_text(dict(files=100)))
+
+		bursts = self.endpoint.scrape_all_metrics(metrics, _create_body_text(dict(files=200)))
+
+		self.assertEqual(self.endpoint.reused_count, 1)
+		self.assertEqual([b['values']['files'] for b in bursts if b['metric'] == 'hath-health'], [200])
+
+	def test_changed_section_parsed_again(self):
+		metrics = [self.network_metric]
+		self.endpoint.scrape_all_metrics(metrics, _create_body_text())
+
+		bursts = self.endpoint.scrape_all_metrics(metrics, _create_body_text(regions=[{'region': 'Global', 'quality': 1}]))
+
+		self.assertEqual(self.endpoint.reused_count, 0)
+		self.assertEqual(len(bursts), 1)
+
+	def test_time_dependent_metric_not_reusable(self):
+		metric = scrape.parse_config_metrics([{
+			'dest': 'd',
+			'name': 'n',
+			'regex': [r'<td>([^<]+)</td>'],
+			'values': [{'name': 'online', 'conversion': 'online-within:5m', 'type': 'CAPTURE-1'}],
+			'tags': {}
+		}], '')[0]
+
+		self.assertFalse(metric['reusable'])
+
+	def test_unknown_section(self):
+		with self.assertRaises(util.ConfigException):
+			scrape.parse_config_endpoints([{
+				'endpoint': '/e',
+				'verify-pattern': 'x',
+				'sections': {'clients': {'start': 'Clients'}},
+				'metrics': [{'dest': 'd', 'name': 'n', 'regex': ['x'], 'values': [], 'tags': {}, 'section': 'regions'}]
+			}], '')
+
+
+class EndpointStreamingTest(TestCase):
+
+	def setUp(self):
+		self.endpoint = Endpoint('/myuri/endpoint', re.compile('F@H Miss% shows the percentage of requests'))
+		self.text = _create_body_text(dict(id='1', name='flandre'), dict(id='2', name='remilia'))
+
+	def test_bursts_given_one_at_a_time(self):
+		bursts = self.endpoint.iter_all_metrics([_client_stats_metric], self.text)
+
+		first = next(bursts)
+
+		self.assertIsInstance(first, Burst)
+		self.assertEqual(first.tags['host'], 'flandre')
+		self.assertEqual(first['tags'], first.tags)
+		self.assertEqual(next(bursts).tags['host'], 'remilia')
+
+	def test_verified_before_iteration(self):
+		with self.assertRaises(VerificationError):
+			self.endpoint.iter_all_metrics([_client_stats_metric], '<p>banned</p>')
+
+	def test_bursts_not_hashable(self):
+		first = next(self.endpoint.iter_all_metrics([_client_stats_metric], self.text))
+
+		with self.assertRaises(TypeError):
+			hash(first)
+
+	def test_not_found_gives_nothing(self):
+		text = _create_body_text(dict(online=False))
+
+		self.assertEqual(list(self.endpoint.iter_metric(_client_stats_metric, text)), [])
+		self.assertIsNone(self.endpoint.scrape_metric(_client_stats_metric, text))
+
+
+class EndpointTemplateTest(TestCase):
+
+	def setUp(self):
+		self.endpoint = Endpoint('/myuri/endpoint', re.compile('F@H Miss% shows the percentage of requests'))
+		self.text = _create_body_text(regions=[
+			{'region': 'Asia and Oceania', 'quality': 7445},
+			{'region': 'Global', 'quality': 7865},
+			{'region': 'Moon', 'quality': 1}
+		])
+
+	def test_one_burst_per_instance(self):
+		metric = _template_metric()
+
+		bursts = self.endpoint.scrape_metric(metric, self.text)
+
+		self.assertEqual({b['tags']['region']: b['values']['quality'] for b in bursts}, {'asia': 7445, 'global': 7865})
+
+	def test_captures_around_placeholder(self):
+		metric = _template_metric(prefix=r'(<tr>)\s*', tags={'row': 'CAPTURE-1'})
+
+		bursts = self.endpoint.scrape_metric(metric, self.text)
+
+		self.assertEqual([b['values']['quality'] for b in bursts], [7445, 7865])
+		self.assertEqual([b['tags']['row'] for b in bursts], ['<tr>', '<tr>'])
+
+	def test_column_extraction(self):
+		metric = _template_metric(extraction='column')
+
+		bursts = self.endpoint.scrape_metric(metric, self.text)
+
+		self.assertEqual([b['tags']['region'] for b in bursts], ['asia', 'global'])
+
+	def test_placeholder_missing(self):
+		with self.assertRaises(util.ConfigException):
+			_template_metric(placeholder='{nope}')
+
+	def test_instances_need_same_tags(self):
+		with self.assertRaises(util.ConfigException):
+			_template_metric(instances=[
+				{'match': 'Global', 'tags': {'region': 'global'}},
+				{'match': 'Asia and Oceania', 'tags': {}}
+			])
+
+
+def _template_metric(prefix='', tags=None, extraction='row', placeholder='{region}', instances=None):
+	if instances is None:
+		instances = [
+			{'match': 'Asia and Oceania', 'tags': {'region': 'asia'}},
+			{'match': 'Global', 'tags': {'region': 'global'}}
+		]
+	return scrape.parse_config_metrics([{
+		'dest': 'hath-net',
+		'name': 'hath-net',
+		'extraction': extraction,
+		'template': {'placeholder': placeholder, 'instances': instances},
+		'regex': [
+			prefix,
+			r'<td>{region}</td>\s*',
+			r'<td [^>]*>[^ ]+ Gbit/s</td>\s*',
+			r'<td [^>]*>=</td>\s*',
+			r'<td [^>]*>([^ ]+) MB/s</td>\s*',
+			r'<td [^>]*>[^<]+</td>\s*',
+			r'<td [^>]*>[^<]+</td>\s*',
+			r'<td [^>]*>[^<]+</td>\s*',
+			r'<td [^>]*>([^<]+)</td>',
+		],
+		'values': [
+			{'name': 'load', 'conversion': 'int', 'type': 'CAPTURE-' + ('2' if prefix else '1')},
+			{'name': 'quality', 'conversion': 'int', 'type': 'CAPTURE-' + ('3' if prefix else '2')}
+		],
+		'tags': tags if tags is not None else {}
+	}], '')[0]
+
+
+class EndpointTimeBudgetTest(TestCase):
+
+	def setUp(self):
+		self.endpoint = Endpoint('/myuri/endpoint', re.compile('verify'), max_overruns=2)
+		self.text = 'verify <b>12</b> ' + ('a' * 40)
+		self.metrics = scrape.parse_config_metrics([
+			{
+				'dest': 'd',
+				'name': 'slow',
+				'regex': [r'(a+)+b'],
+				'values': [{'name': 'v', 'conversion': 1, 'type': 'VALUE'}],
+				'tags': {},
+				'time-budget': 0.05
+			},
+			{
+				'dest': 'd',
+				'name': 'fast',
+				'regex': [r'<b>(\d+)</b>'],
+				'values': [{'name': 'v', 'conversion': 'int', 'type': 'CAPTURE-1'}],
+				'tags': {},
+				'time-budget': 0.05
+			}
+		], '')
+
+	def test_overrun_skips_only_that_metric(self):
+		with self.assertLogs('pytelegrafhttp.endpoint', 'WARNING'):
+			bursts = self.endpoint.scrape_all_metrics(self.metrics, self.text)
+
+		self.assertEqual([b.metric for b in bursts], ['fast'])
+		self.assertEqual(self.endpoint.overrun_count, 1)
+		self.assertEqual(self.endpoint.disabled, set())
+
+	def test_disabled_after_repeated_overruns(self):
+		with self.assertLogs('pytelegrafhttp.endpoint', 'WARNING'):
+			self.endpoint.scrape_all_metrics(self.metrics, self.text)
+			self.endpoint.scrape_all_metrics(self.metrics, self.text)
+
+		self.assertEqual(self.endpoint.disabled, {0})
+		bursts = self.endpoint.scrape_all_metrics(self.metrics, self.text)
+		self.assertEqual(self.endpoint.overrun_count, 2)
+		self.assertEqual([b.metric for b in bursts], ['fast'])
+
+	@skipUnless(hasattr(signal, 'setitimer'), "requires interval timers")
+	def test_handler_restored_when_alarm_goes_off_as_it_is_cancelled(self):
+		old_handler = signal.getsignal(signal.SIGALRM)
+		setitimer = signal.setitimer
+
+		def late_alarm(which, seconds):
+			if seconds == 0:
+				endpoint._raise_timeout(signal.SIGALRM, None)
+			return setitimer(which, seconds)
+
+		with mock.patch.object(endpoint.signal, 'setitimer', late_alarm):
+			with self.assertRaises(ExtractionTimeout):
+				with endpoint._interrupt_after(10):
+					pass
+
+		signal.setitimer(signal.ITIMER_REAL, 0)
+		self.assertIs(signal.getsignal(signal.SIGALRM), old_handler)
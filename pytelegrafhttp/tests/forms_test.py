@@ -0,0 +1,66 @@
+from pytelegrafhttp import forms
+from unittest import TestCase
+
+
+class ExtractFormTest(TestCase):
+
+	def test_login_form(self):
+		form = forms.extract_form(_LOGIN_PAGE)
+
+		self.assertEqual(form['action'], 'https://forums.e-hentai.org/index.php?act=Login&CODE=01')
+		self.assertEqual(form['method'], 'POST')
+		self.assertEqual(form['variables'], {
+			'referer': 'https://e-hentai.org/hentaiathome.php', 'b': '', 'bt': '', 'UserName': '', 'PassWord': '',
+			'CookieDate': '1', 'ipb_login_submit': 'Login!'
+		})
+
+	def test_single_quoted_and_unnamed_inputs(self):
+		form = forms.extract_form("<form action='/go'><input type='hidden' name='a' value='x &amp; y'><input></form>")
+
+		self.assertEqual(form['action'], '/go')
+		self.assertEqual(form['method'], 'GET')
+		self.assertEqual(form['variables'], {'a': 'x & y'})
+
+	def test_unchecked_boxes_and_buttons_not_sent(self):
+		text = '<form action="/go"><input type="checkbox" name="a"><input type="checkbox" name="b" checked>'
+		text += '<input type="button" name="c" value="x"></form>'
+
+		form = forms.extract_form(text)
+
+		self.assertEqual(form['variables'], {'b': 'on'})
+
+	def test_textarea_and_select(self):
+		text = '<form action="/go"><textarea name="t">some text</textarea><select name="s"><option>one</option>'
+		text += '<option value="2" selected>two</option></select><select name="f"><option value="1">a</option>'
+		text += '</select></form>'
+
+		form = forms.extract_form(text)
+
+		self.assertEqual(form['variables'], {'t': 'some text', 's': '2', 'f': '1'})
+
+	def test_only_first_form(self):
+		form = forms.extract_form('<form action="/a"><input name="x"></form><form action="/b"><input name="y"></form>')
+
+		self.assertEqual(form['action'], '/a')
+		self.assertEqual(form['variables'], {'x': ''})
+
+	def test_stops_after_form(self):
+		parser = forms.FormParser()
+		parser.feed('<form action="/a"><input name="x"></form>')
+
+		self.assertTrue(parser.done)
+
+	def test_no_form(self):
+		self.assertIsNone(forms.extract_form('<p>requires you to log on.</p>'))
+
+
+_LOGIN_PAGE = """<html><body><p>This page requires you to log on.</p>
+<form action="https://forums.e-hentai.org/index.php?act=Login&amp;CODE=01" method="post" name="LOGIN">
+<input type="hidden" name="referer" value="https://e-hentai.org/hentaiathome.php" />
+<input type="hidden" name="b" value="" />
+<input type="hidden" name="bt" value="" />
+<table><tr><td>User:</td><td><input type="text" name="UserName" size="20" maxlength="64" /></td></tr>
+<tr><td>Pass:</td><td><input type="password" name="PassWord" size="20" maxlength="64" /></td></tr></table>
+<input type="hidden" name="CookieDate" value="1" />
+<input type="submit" name="ipb_login_submit" value="Login!" />
+</form></body></html>"""
@@ -0,0 +1,71 @@
+from pytelegrafhttp import daemon
+from unittest import TestCase, skipUnless
+import os
+import subprocess
+import sys
+import tempfile
+
+
+_REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+# subcommands that only talk to a running scraper
+_CONTROL_SUBCOMMANDS = ('stop', 'reload-config', 'status', 'stats', 'flush')
+
+# modules that only the scraper itself needs
+_SCRAPER_MODULES = (
+	'requests', 'telegraf', 'dateparser', 'pytelegrafhttp.scrape', 'pytelegrafhttp.http', 'pytelegrafhttp.workers'
+)
+
+
+def _import_times(*args):
+	"""
+	Runs Python with import times reported, and gives the time that each module took to import by itself, in
+	microseconds, keyed by module name.
+	"""
+	env = dict(os.environ)
+	env['PYTHONPATH'] = _REPO_DIR + os.pathsep + env.get('PYTHONPATH', '')
+	result = subprocess.run(
+		[sys.executable, '-X', 'importtime'] + list(args),
+		stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=env, universal_newlines=True, timeout=60
+	)
+	times = {}
+	for line in result.stderr.splitlines():
+		if not line.startswith('import time:') or 'self [us]' in line:
+			continue
+		self_us, _, name = line[len('import time:'):].split('|')
+		times[name.strip()] = int(self_us)
+	return times
+
+
+@skipUnless(daemon.CONTROL_SUPPORTED, "commands are sent with signals, which would reach whatever process has the pid")
+class ImportTimeTest(TestCase):
+
+	@classmethod
+	def setUpClass(cls):
+		baseline = _import_times('-c', 'pass')
+		scraper = _import_times('-c', 'import pytelegrafhttp.scrape')
+		cls.scraper_cost = sum(t for name, t in scraper.items() if name not in baseline)
+		cls.baseline = baseline
+
+	def setUp(self):
+		tmp = tempfile.TemporaryDirectory()
+		self.addCleanup(tmp.cleanup)
+		os.mkdir(os.path.join(tmp.name, 'daemon'))
+		with open(os.path.join(_REPO_DIR, 'config.example.py'), 'r') as fp:
+			source = fp.read()
+		self.config = os.path.join(tmp.name, 'config.py')
+		with open(self.config, 'w') as fp:
+			fp.write(source + "\ninstall_dir = " + repr(tmp.name) + "\nenv_daemon_files_dir = install_dir + '/daemon'\n")
+
+	def test_control_subcommands_do_not_load_scraper(self):
+		for cmd in _CONTROL_SUBCOMMANDS:
+			with self.subTest(cmd=cmd):
+				# there is no scraper with this pid listening, so the command fails once everything it needs is loaded
+				times = _import_times('-m', 'pytelegrafhttp', cmd, '99999', '--config', self.config)
+
+				self.assertIn('pytelegrafhttp.daemon', times)
+				loaded = [m for m in times if any(m == s or m.startswith(s + '.') for s in _SCRAPER_MODULES)]
+				self.assertEqual(loaded, [])
+				cost = sum(t for name, t in times.items() if name not in self.baseline)
+				# the cap is relative to what the scraper loads, so that it holds on slow machines too
+				self.assertLess(cost, self.scraper_cost / 2)
@@ -0,0 +1,78 @@
+from pytelegrafhttp import lint, scrape, util
+from unittest import TestCase
+import os
+import re
+import tempfile
+
+
+class LintPatternTest(TestCase):
+
+	def test_clean_pattern(self):
+		self.assertEqual(_lint(r'<td [^>]*>([^<]+)</td>\s*<td>([^ ]+) / min</td>'), [])
+
+	def test_nested_quantifier(self):
+		self.assertEqual(len(_lint(r'<td>(\w+\s*)+</td>')), 1)
+
+	def test_leading_dot_star(self):
+		self.assertEqual(len(_lint(r'.*<td>(\d+)</td>')), 1)
+
+	def test_anchored_dot_star_allowed(self):
+		self.assertEqual(_lint(r'^.*<td>(\d+)</td>'), [])
+
+	def test_overlapping_adjacent_quantifiers(self):
+		self.assertEqual(len(_lint(r'<td>([^<]*)\s*</td>')), 1)
+		self.assertEqual(len(_lint(r'<td>(\d+)\s*\s+</td>')), 1)
+
+	def test_disjoint_adjacent_quantifiers_allowed(self):
+		self.assertEqual(_lint(r'<td>(\d+)\s*[a-z]+</td>'), [])
+
+
+class LintEndpointTest(TestCase):
+
+	def test_refuse(self):
+		with self.assertRaises(util.ConfigException) as ctx:
+			scrape.parse_config_endpoints([_endpoint(r'(a+)+b')], 'eps', lint_mode=lint.LINT_REFUSE)
+		self.assertEqual(ctx.exception.key, "eps[0]['metrics'][0]['regex']")
+
+	def test_warn(self):
+		with self.assertLogs('pytelegrafhttp.scrape', 'WARNING'):
+			eps = scrape.parse_config_endpoints([_endpoint(r'(a+)+b')], 'eps', lint_mode=lint.LINT_WARN)
+		self.assertEqual(len(eps), 1)
+
+	def test_off(self):
+		eps = scrape.parse_config_endpoints([_endpoint(r'(a+)+b')], 'eps', lint_mode=lint.LINT_OFF)
+		self.assertEqual(len(eps), 1)
+
+	def test_time_budget(self):
+		fd, path = tempfile.mkstemp(suffix='.html')
+		with os.fdopen(fd, 'w') as fp:
+			fp.write('verify ' + ('<td>1</td>' * 1000))
+		self.addCleanup(os.remove, path)
+		ep = dict(_endpoint(r'<td>(\d+)</td>'), **{'sample-page': path})
+
+		scrape.parse_config_endpoints([ep], 'eps', lint_mode=lint.LINT_REFUSE, time_budget=10)
+		with self.assertRaises(util.ConfigException):
+			scrape.parse_config_endpoints([ep], 'eps', lint_mode=lint.LINT_REFUSE, time_budget=0)
+
+	def test_warn_does_not_time_flagged_pattern(self):
+		fd, path = tempfile.mkstemp(suffix='.html')
+		with os.fdopen(fd, 'w') as fp:
+			fp.write('verify ' + ('a' * 40))
+		self.addCleanup(os.remove, path)
+		ep = dict(_endpoint(r'(a+)+b'), **{'sample-page': path})
+
+		with self.assertLogs('pytelegrafhttp.scrape', 'WARNING'):
+			eps = scrape.parse_config_endpoints([ep], 'eps', lint_mode=lint.LINT_WARN, time_budget=0)
+		self.assertEqual(len(eps), 1)
+
+
+def _lint(pattern):
+	return lint.lint_pattern(re.compile(pattern, re.DOTALL))
+
+
+def _endpoint(regex):
+	return {
+		'endpoint': '/e',
+		'verify-pattern': 'verify',
+		'metrics': [{'dest': 'd', 'name': 'n', 'regex': [regex], 'values': [], 'tags': {}}]
+	}
@@ -0,0 +1,65 @@
+from pytelegrafhttp.schedule import Scheduler
+from pytelegrafhttp import clock
+from unittest import TestCase
+
+_SEC = 1000000000
+
+
+class SchedulerTest(TestCase):
+
+	def setUp(self):
+		self.start = 1000 * _SEC
+		self.scheduler = Scheduler().start(self.start, [('health', 30, 0), ('network', 300, 0), ('late', 30, 10)])
+
+	def test_all_due_at_start(self):
+		due = self.scheduler.pop_due(self.start)
+
+		self.assertEqual(due, ['health', 'network'])
+		self.assertEqual(self.scheduler.next_due, self.start + 10 * _SEC)
+
+	def test_independent_intervals(self):
+		runs = {'health': 0, 'network': 0, 'late': 0}
+		now = self.start
+		while now < self.start + 600 * _SEC:
+			for key in self.scheduler.pop_due(now):
+				runs[key] += 1
+			now = self.scheduler.next_due
+
+		self.assertEqual(runs, {'health': 20, 'network': 2, 'late': 20})
+
+	def test_missed_runs_are_skipped(self):
+		self.scheduler.pop_due(self.start)
+
+		due = self.scheduler.pop_due(self.start + 95 * _SEC)
+
+		self.assertEqual(due, ['health', 'late'])
+		self.assertEqual(self.scheduler.next_due, self.start + 100 * _SEC)
+
+	def test_missed_runs_caught_up(self):
+		self.scheduler.set_overrun_policy(clock.OVERRUN_CATCH_UP)
+		self.scheduler.pop_due(self.start)
+
+		first = self.scheduler.pop_due(self.start + 95 * _SEC)
+		second = self.scheduler.pop_due(self.start + 95 * _SEC)
+
+		self.assertEqual(first, ['health', 'late'])
+		self.assertEqual(second, ['health', 'late'])
+
+	def test_missed_runs_rephased(self):
+		self.scheduler.set_overrun_policy(clock.OVERRUN_REPHASE)
+		self.scheduler.pop_due(self.start)
+
+		self.scheduler.pop_due(self.start + 95 * _SEC)
+
+		self.assertEqual(self.scheduler.next_due, self.start + 125 * _SEC)
+
+	def test_within_tolerance_is_due(self):
+		self.scheduler.pop_due(self.start)
+
+		due = self.scheduler.pop_due(self.start + 9995 * _SEC // 1000)
+
+		self.assertEqual(due, ['late'])
+
+	def test_bad_interval(self):
+		with self.assertRaises(ValueError):
+			Scheduler().start(self.start, [('bad', 0, 0)])
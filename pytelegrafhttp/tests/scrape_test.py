@@ -0,0 +1,880 @@
+from pytelegrafhttp import scrape, util
+from unittest import TestCase
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+import http.cookiejar
+import importlib.util
+import os
+import pickle
+import tempfile
+import threading
+import time
+
+
+class PageScraperSheddingTest(TestCase):
+
+	def setUp(self):
+		self.scraper = _create_scraper(scraper_stats_destination='stats', scraper_shed_priority=1)
+		self.agent = _FakeAgent({
+			'/high': _PAGE,
+			'/low': _PAGE,
+			'/lower': _PAGE
+		})
+		self.scraper._client = self.agent
+		self.sent = _capture_bursts(self.scraper)
+
+	def test_no_shedding_when_on_time(self):
+		self.scraper.run_tick(_FakeClock())
+
+		self.assertEqual(self.agent.requested, ['/high', '/low', '/lower'])
+		self.assertEqual(len([b for b in self.sent if b[1] == 'counts']), 3)
+
+	def test_no_stats_without_destination(self):
+		scraper = _create_scraper(scraper_stats_destination=None, scraper_shed_priority=1)
+		scraper._client = self.agent
+		sent = _capture_bursts(scraper)
+
+		scraper.run_tick(_FakeClock(is_slow=True))
+
+		self.assertIsNone(scraper._stats_dest)
+		self.assertNotIn('pytelegrafhttp', [b[1] for b in sent])
+
+	def test_low_priority_endpoints_shed_when_slow(self):
+		self.scraper._endpoint_costs = {0: 20.0, 1: 30.0, 2: 10.0}
+
+		self.scraper.run_tick(_FakeClock(is_slow=True, lateness=5.0))
+
+		# 35 seconds left in the tick after the high priority endpoint; only room for one of the others, and the
+		# higher priority one gets it first
+		self.assertEqual(self.agent.requested, ['/high', '/low'])
+		stats = [b for b in self.sent if b[1] == 'pytelegrafhttp'][0][2]
+		self.assertEqual(stats['shed-endpoints'], 1)
+		self.assertEqual(stats['shedding'], 1)
+
+	def test_low_priority_values_shed_at_reduced_cadence(self):
+		shed_ticks = []
+		for tick in range(1, 6):
+			self.sent.clear()
+			self.scraper.run_tick(_FakeClock(tick=tick, is_slow=True))
+			values = [b[2] for b in self.sent if b[1] == 'counts'][0]
+			shed_ticks.append('slow' not in values)
+
+		self.assertEqual(shed_ticks, [True, True, True, True, False])
+
+	def test_shedding_stops_when_back_on_schedule(self):
+		self.scraper.run_tick(_FakeClock(tick=1, is_slow=True))
+		self.sent.clear()
+
+		self.scraper.run_tick(_FakeClock(tick=2))
+
+		values = [b[2] for b in self.sent if b[1] == 'counts'][0]
+		self.assertIn('slow', values)
+		stats = [b for b in self.sent if b[1] == 'pytelegrafhttp'][0][2]
+		self.assertEqual(stats['shedding'], 0)
+
+
+class PageScraperCoalescingTest(TestCase):
+
+	def test_shared_page_downloaded_once_per_tick(self):
+		scraper = _create_scraper(
+			scraper_stats_destination='stats',
+			scraper_endpoints=[_endpoint_conf('/shared', 1), _endpoint_conf('/shared', 0)]
+		)
+		agent = _FakeAgent({'/shared': _PAGE})
+		scraper._client = agent
+		sent = _capture_bursts(scraper)
+
+		scraper.run_tick(_FakeClock(tick=1))
+		scraper.run_tick(_FakeClock(tick=2))
+
+		self.assertEqual(agent.requested, ['/shared', '/shared'])
+		self.assertEqual(len([b for b in sent if b[1] == 'counts']), 4)
+		stats = [b for b in sent if b[1] == 'pytelegrafhttp'][-1][2]
+		# counts are totals since the scraper started, like the other stats
+		self.assertEqual(stats['request-cache-hits'], 2)
+		self.assertEqual(stats['request-cache-misses'], 2)
+
+
+class PageScraperReloginTest(TestCase):
+
+	def setUp(self):
+		self.scraper = _create_scraper(scraper_stats_destination='stats')
+		self.agent = _SessionAgent({'/high': _PAGE, '/low': _PAGE, '/lower': _PAGE, '/login': _PAGE})
+		self.scraper._client = self.agent
+		self.sent = _capture_bursts(self.scraper)
+
+	def test_expired_session_recovered_within_tick(self):
+		self.agent.expire_after('/high')
+
+		self.scraper.run_tick(_FakeClock())
+
+		self.assertEqual(self.agent.requested, ['/high', '/low', '/login', '/low', '/lower'])
+		self.assertEqual(len([b for b in self.sent if b[1] == 'counts']), 3)
+		stats = [b for b in self.sent if b[1] == 'pytelegrafhttp'][0][2]
+		self.assertEqual(stats['relogins'], 1)
+		self.assertTrue(self.scraper._logged_in)
+
+	def test_expired_session_recovered_with_pool(self):
+		scraper = _create_scraper(scraper_extraction_workers=1)
+		self.addCleanup(scraper._pool.shutdown)
+		scraper._client = self.agent
+		sent = _capture_bursts(scraper)
+		self.agent.expire_after('/high')
+
+		scraper.run_tick(_FakeClock())
+
+		self.assertEqual(self.agent.requested, ['/high', '/low', '/login', '/low', '/lower'])
+		self.assertEqual(len([b for b in sent if b[1] == 'counts']), 3)
+
+	def test_pooled_metrics_sent_when_later_endpoint_fails(self):
+		scraper = _create_scraper(scraper_extraction_workers=1)
+		self.addCleanup(scraper._pool.shutdown)
+		scraper._client = self.agent
+		scraper._login_cost = 30.0
+		sent = _capture_bursts(scraper)
+		self.agent.expire_after('/high')
+
+		with self.assertRaises(scrape.AuthError):
+			scraper.run_tick(_FakeClock(lateness=40.0))
+
+		self.assertEqual(self.agent.requested, ['/high', '/low'])
+		self.assertEqual(len([b for b in sent if b[1] == 'counts']), 1)
+
+	def test_login_left_for_next_tick_when_no_time(self):
+		self.scraper._login_cost = 30.0
+		self.agent.expire_after('/high')
+
+		with self.assertRaises(scrape.AuthError):
+			self.scraper.run_tick(_FakeClock(lateness=40.0))
+
+		self.assertEqual(self.agent.requested, ['/high', '/low'])
+		self.assertFalse(self.scraper._logged_in)
+
+	def test_relogin_only_once_per_tick(self):
+		self.agent.expire_after('/high')
+		self.agent.expire_after('/low', again=True)
+
+		with self.assertRaises(scrape.AuthError):
+			self.scraper.run_tick(_FakeClock())
+
+		self.assertEqual(self.agent.requested, ['/high', '/low', '/login', '/low'])
+
+
+class PageScraperKeepAliveTest(TestCase):
+
+	def setUp(self):
+		self.scraper = _create_scraper()
+		self.agent = _FakeAgent({'/login': _PAGE})
+		self.scraper._client = self.agent
+
+	def test_no_login_without_prediction(self):
+		self.assertFalse(self.scraper.keep_alive(30.0, 60.0))
+		self.assertEqual(self.agent.requested, [])
+
+	def test_login_before_cookie_expiry(self):
+		self.agent.expiry = time.time() + 80.0
+
+		self.assertTrue(self.scraper.keep_alive(30.0, 60.0))
+
+		self.assertEqual(self.agent.requested, ['/login'])
+		self.assertEqual(self.agent.sessions, 1)
+
+	def test_old_session_closed_after_login(self):
+		self.agent.expiry = time.time() + 80.0
+		old_session = self.agent.session
+
+		self.scraper.keep_alive(30.0, 60.0)
+
+		self.assertIsNot(self.agent.session, old_session)
+		self.assertTrue(old_session.closed)
+
+	def test_old_session_kept_when_login_fails(self):
+		self.agent.expiry = time.time() + 80.0
+		self.agent.pages['/login'] = ConnectionError("connection reset")
+		old_session = self.agent.session
+
+		with self.assertRaises(ConnectionError):
+			self.scraper.keep_alive(30.0, 60.0)
+
+		self.assertIs(self.agent.session, old_session)
+		self.assertFalse(old_session.closed)
+		self.assertTrue(self.scraper._logged_in)
+
+	def test_waiting_again_after_login(self):
+		self.agent.expiry = time.time() + 80.0
+
+		self.scraper.keep_alive(30.0, 60.0)
+
+		self.assertEqual(self.scraper.activity[0], "waiting for next tick")
+
+	def test_no_login_when_cookie_outlasts_next_tick(self):
+		self.agent.expiry = time.time() + 100.0
+
+		self.assertFalse(self.scraper.keep_alive(30.0, 60.0))
+
+	def test_login_before_observed_lifetime_ends(self):
+		self.scraper._session_lifetimes = [300.0, 120.0]
+		self.scraper._session_start = time.time() - 60.0
+
+		self.assertTrue(self.scraper.keep_alive(30.0, 60.0))
+
+		self.assertEqual(self.agent.requested, ['/login'])
+
+	def test_session_lifetime_recorded_on_expiry(self):
+		self.scraper._session_start = time.time() - 100.0
+		self.agent.pages['/high'] = 'this page requires you to log on'
+
+		with self.assertRaises(scrape.AuthError):
+			self.scraper.run_tick(_FakeClock(lateness=60.0))
+
+		self.assertEqual(len(self.scraper._session_lifetimes), 1)
+		self.assertAlmostEqual(self.scraper._session_lifetimes[0], 100.0, delta=5.0)
+
+	def test_no_login_when_not_enough_time(self):
+		self.agent.expiry = time.time() + 10.0
+		self.scraper._login_cost = 20.0
+
+		self.assertFalse(self.scraper.keep_alive(15.0, 60.0))
+		self.assertEqual(self.agent.requested, [])
+
+
+class PageScraperLoginFormTest(TestCase):
+
+	def setUp(self):
+		self.scraper = _create_scraper(scraper_login_steps=[
+			('attempt', {'endpoint': '/login'}),
+			('resp-extract', {'type': 'form-vars', 'inject': {'UserName': 'username', 'PassWord': 'password'}}),
+			('submit-form', {}),
+			('verify', {'pattern': 'verify'})
+		])
+		self.agent = _FakeAgent({
+			'/login': "<form action='/submit' method='post'><input type='hidden' name='token' value='a'>"
+			+ "<input name='UserName'><input type='password' name='PassWord'></form>",
+			'/submit': _PAGE
+		})
+		self.scraper._client = self.agent
+
+	def test_full_login_submits_form(self):
+		self.scraper._login()
+
+		self.assertEqual(self.agent.requested, ['/login', '/submit'])
+		self.assertEqual(self.agent.payloads[-1], {'token': 'a', 'UserName': 'username', 'PassWord': 'password'})
+
+	def test_relogin_submits_cached_form(self):
+		self.scraper._login()
+		self.agent.requested.clear()
+
+		self.scraper._login()
+
+		self.assertEqual(self.agent.requested, ['/submit'])
+		self.assertEqual(self.agent.payloads[-1], {'token': 'a', 'UserName': 'username', 'PassWord': 'password'})
+
+	def test_full_login_when_cached_form_fails(self):
+		self.scraper._login()
+		self.agent.requested.clear()
+		self.agent.pages['/submit'] = ['<p>token expired</p>', _PAGE]
+
+		self.scraper._login()
+
+		self.assertEqual(self.agent.requested, ['/submit', '/login', '/submit'])
+		self.assertTrue(self.scraper._logged_in)
+		self.assertTrue(self.scraper.running)
+
+
+class PageScraperSessionProbeTest(TestCase):
+
+	def setUp(self):
+		self.agent = _FakeAgent({'/high': _PAGE, '/low': _PAGE, '/lower': _PAGE, '/login': _PAGE})
+
+	def test_saved_session_kept_and_probe_page_reused(self):
+		scraper = self._create_scraper()
+
+		scraper.setup()
+		scraper.run_tick(_FakeClock())
+
+		self.assertEqual(self.agent.requested, ['/high', '/low', '/lower'])
+
+	def test_logged_out_session_logs_in(self):
+		self.agent.pages['/high'] = 'this page requires you to log on'
+		scraper = self._create_scraper()
+
+		scraper.setup()
+
+		self.assertEqual(self.agent.requested, ['/high', '/login'])
+		self.assertTrue(scraper._logged_in)
+
+	def test_probe_with_own_pattern(self):
+		self.agent.pages['/small'] = '<p>ok</p>'
+		scraper = self._create_scraper(scraper_session_probe={'endpoint': '/small', 'verify-pattern': 'ok'})
+
+		scraper.setup()
+
+		self.assertEqual(self.agent.requested, ['/small'])
+
+	def test_no_probe(self):
+		scraper = self._create_scraper(scraper_session_probe=None)
+
+		scraper.setup()
+
+		self.assertEqual(self.agent.requested, [])
+
+	def test_probe_needs_pattern_for_other_endpoint(self):
+		with self.assertRaises(util.ConfigException):
+			scrape.parse_config_session_probe({'endpoint': '/small'}, [], 'scraper_session_probe')
+
+	def _create_scraper(self, **kwargs):
+		scraper = _create_scraper(**kwargs)
+		scraper._running = False
+		scraper._client = self.agent
+		scraper._load_state = lambda: True
+		return scraper
+
+
+class PageScraperStateTest(TestCase):
+
+	def setUp(self):
+		tmp = tempfile.TemporaryDirectory()
+		self.addCleanup(tmp.cleanup)
+		self.state_file = os.path.join(tmp.name, 'state.db')
+		self.cookies_file = os.path.join(tmp.name, 'cookies.pkl')
+
+	def test_state_saved_and_loaded(self):
+		scraper = self._create_scraper()
+		scraper._client.cookie_jar.set('session', 'abc', domain='localhost', path='/')
+		scraper._session_lifetimes = [120.0]
+		scraper._save_state()
+		scraper._close_state()
+
+		loaded = self._create_scraper()
+		loaded._logged_in = False
+
+		self.assertTrue(loaded._load_state())
+		self.assertEqual(loaded._client.cookie_jar.get('session'), 'abc')
+		self.assertTrue(loaded._logged_in)
+		self.assertEqual(loaded._session_lifetimes, [120.0])
+
+	def test_unchanged_state_not_rewritten(self):
+		scraper = self._create_scraper()
+		scraper._client.cookie_jar.set('session', 'abc', domain='localhost', path='/')
+		scraper._save_state()
+
+		self.assertEqual(scraper._save_state(), 0)
+		scraper._client.cookie_jar.set('session', 'def', domain='localhost', path='/')
+		self.assertEqual(scraper._save_state(), 1)
+		self.assertEqual(scraper._open_state().items('cookies')['localhost;/;session'].value, 'def')
+
+	def test_unchanged_values_not_rewritten(self):
+		scraper = self._create_scraper()
+		scraper._last_values = {'main;counts;': {'values': {'count': 5}, 'tags': {}, 'timestamp': 1000}}
+		scraper._save_state()
+
+		self.assertEqual(scraper._save_state(), 0)
+		# a tick that got the same values makes new objects for them
+		scraper._last_values = {'main;counts;': {'values': {'count': 5}, 'tags': {}, 'timestamp': 1000}}
+		self.assertEqual(scraper._save_state(), 0)
+		scraper._last_values = {'main;counts;': {'values': {'count': 6}, 'tags': {}, 'timestamp': 2000}}
+		self.assertEqual(scraper._save_state(), 1)
+
+	def test_values_not_changed_while_saving(self):
+		scraper = self._create_scraper()
+		saving = threading.Event()
+		seen = []
+
+		def save():
+			with scraper._state_lock:
+				saving.set()
+				time.sleep(0.2)
+				seen.append(dict(scraper._last_values))
+		saver = threading.Thread(target=save)
+		saver.start()
+		saving.wait()
+		scraper._send_metric_burst('main', 1000, 'counts', {'count': 5}, {})
+		saver.join()
+
+		self.assertEqual(seen, [{}])
+		self.assertIn('main;counts;', scraper._last_values)
+
+	def test_saved_by_time_not_by_tick(self):
+		scraper = _create_scraper(time_save_frequency=2)
+		scraper._client = _FakeAgent({'/high': _PAGE, '/low': _PAGE, '/lower': _PAGE})
+		saves = []
+		scraper._save_state = lambda: saves.append(time.monotonic())
+
+		# ticks that come closer together than the save interval, as they do when endpoints have their own intervals
+		for tick in range(1, 5):
+			scraper.run_tick(_FakeClock(tick=tick, speed=0.1), [0])
+		self.assertEqual(saves, [])
+		time.sleep(0.2)
+		scraper.run_tick(_FakeClock(tick=5, speed=0.1), [0])
+
+		self.assertEqual(len(saves), 1)
+
+	def test_old_state_files_imported(self):
+		with open(self.state_file, 'wb') as f:
+			pickle.dump({'logged_in': True}, f)
+		old = self._create_scraper()
+		old._client.cookie_jar.set('session', 'abc', domain='localhost', path='/')
+		old._client.save_cookies(self.cookies_file)
+
+		loaded = self._create_scraper()
+		loaded._logged_in = False
+
+		self.assertTrue(loaded._load_state())
+		self.assertTrue(loaded._logged_in)
+		self.assertEqual(loaded._client.cookie_jar.get('session'), 'abc')
+		self.assertTrue(os.path.exists(self.state_file + '.bak'))
+
+	def _create_scraper(self):
+		scraper = _create_scraper(env_state_file=self.state_file, env_cookies_file=self.cookies_file)
+		self.addCleanup(scraper._close_state)
+		return scraper
+
+
+class PageScraperReloadTest(TestCase):
+
+	def setUp(self):
+		self.scraper = _create_scraper()
+		self.session = self.scraper._client._session
+		self.endpoints = list(self.scraper._endpoint_scrapers)
+		self.clients = self.scraper._outputs.clients
+
+	def test_unchanged_config_keeps_everything(self):
+		self.scraper.load_config(_create_conf())
+
+		self.assertTrue(self.scraper._logged_in)
+		self.assertIs(self.scraper._client._session, self.session)
+		self.assertEqual(self.scraper._endpoint_scrapers, self.endpoints)
+		self.assertEqual(self.scraper._outputs.clients, self.clients)
+
+	def test_login_change_starts_new_session(self):
+		self.scraper.load_config(_create_conf(scraper_password='changed'))
+
+		self.assertFalse(self.scraper._logged_in)
+		self.assertIsNot(self.scraper._client._session, self.session)
+		self.assertEqual(self.scraper._endpoint_scrapers, self.endpoints)
+
+	def test_changed_metric_only_forgets_that_metric(self):
+		endpoint = self.endpoints[1]
+		endpoint.disabled.add(0)
+		low = _endpoint_conf('/low', 0)
+		low['metrics'].append(dict(low['metrics'][0], name='more'))
+		self.scraper.load_config(_create_conf(
+			scraper_endpoints=[_endpoint_conf('/high', 2), low, _endpoint_conf('/lower', -1)]
+		))
+		self.assertIs(self.scraper._endpoint_scrapers[1], endpoint)
+		self.assertEqual(endpoint.disabled, {0})
+
+		low['metrics'] = low['metrics'][1:]
+		self.scraper.load_config(_create_conf(
+			scraper_endpoints=[_endpoint_conf('/high', 2), low, _endpoint_conf('/lower', -1)]
+		))
+
+		self.assertIs(self.scraper._endpoint_scrapers[1], endpoint)
+		self.assertEqual(endpoint.disabled, set())
+
+	def test_changed_endpoint_rebuilt(self):
+		self.scraper.load_config(_create_conf(
+			scraper_endpoints=[_endpoint_conf('/high', 2), _endpoint_conf('/other', 0), _endpoint_conf('/lower', -1)]
+		))
+
+		scrapers = self.scraper._endpoint_scrapers
+		self.assertIs(scrapers[0], self.endpoints[0])
+		self.assertIsNot(scrapers[1], self.endpoints[1])
+		self.assertIs(scrapers[2], self.endpoints[2])
+
+	def test_changed_destination_rebuilt(self):
+		self.scraper.load_config(_create_conf(scraper_telegraf_destinations={
+			'main': {'port': 10000, 'global-tags': {}},
+			'stats': {'port': 10002, 'global-tags': {}}
+		}))
+
+		self.assertIs(self.scraper._outputs.clients['main'], self.clients['main'])
+		self.assertIsNot(self.scraper._outputs.clients['stats'], self.clients['stats'])
+
+	def test_lambda_conversions_compared_by_code(self):
+		# as when the config file is loaded again
+		first = eval('lambda x: int(x)')
+		second = eval('lambda x: int(x)')
+		other = eval('lambda x: float(x)')
+
+		self.assertTrue(scrape._same_config({'c': first}, {'c': second}))
+		self.assertFalse(scrape._same_config({'c': first}, {'c': other}))
+
+
+class PageScraperConfigTest(TestCase):
+
+	def test_example_config_loads(self):
+		path = os.path.join(os.path.dirname(__file__), '..', '..', 'config.example.py')
+		spec = importlib.util.spec_from_file_location('config_example', path)
+		conf = importlib.util.module_from_spec(spec)
+		spec.loader.exec_module(conf)
+		scraper = scrape.PageScraper(antiflood=False)
+
+		scraper.load_config(conf)
+
+		self.assertEqual(len(scraper.endpoints), 1)
+
+
+class PageScraperWorkersTest(TestCase):
+
+	def test_pooled_extraction_sends_same_bursts(self):
+		pages = {'/high': _PAGE, '/low': _PAGE, '/lower': _PAGE}
+		in_process = _create_scraper()
+		in_process._client = _FakeAgent(pages)
+		expected = _capture_bursts(in_process)
+		pooled = _create_scraper(scraper_extraction_workers=2)
+		self.addCleanup(pooled._pool.shutdown)
+		pooled._client = _FakeAgent(pages)
+		sent = _capture_bursts(pooled)
+
+		in_process.run_tick(_FakeClock())
+		pooled.run_tick(_FakeClock())
+
+		self.assertTrue(pooled._pool.running)
+		self.assertEqual(sent, expected)
+
+
+class PageScraperStreamingTest(TestCase):
+
+	def test_conversion_error_keeps_bursts_sent_before_it(self):
+		endpoint = _endpoint_conf('/high', 0)
+		bad_metric = dict(endpoint['metrics'][0], name='bad')
+		bad_metric['values'] = [{'name': 'count', 'conversion': _fail_conversion, 'type': 'CAPTURE-1'}]
+		endpoint['metrics'].append(bad_metric)
+		endpoint['metrics'].append(dict(endpoint['metrics'][0], name='after'))
+		scraper = _create_scraper(scraper_endpoints=[endpoint])
+		scraper._client = _FakeAgent({'/high': _PAGE})
+		sent = _capture_bursts(scraper)
+
+		with self.assertRaises(ValueError):
+			scraper.run_tick(_FakeClock())
+
+		# metrics are sent as they are extracted, so the one before the failure was sent and the one after was not
+		self.assertEqual([b[1] for b in sent], ['counts'])
+
+
+class TargetConfigTest(TestCase):
+
+	def test_config_without_targets_is_one_target(self):
+		conf = _create_conf()
+
+		self.assertEqual(scrape.get_target_configs(conf), [(None, conf)])
+
+	def test_target_values_override_rest_of_config(self):
+		conf = _create_conf(scraper_targets=[
+			{'name': 'a'},
+			{'name': 'b', 'scraper_host': 'other', 'scraper_username': 'other-user'}
+		])
+
+		(name_a, conf_a), (name_b, conf_b) = scrape.get_target_configs(conf)
+
+		self.assertEqual((name_a, name_b), ('a', 'b'))
+		self.assertEqual(conf_a.scraper_host, 'localhost')
+		self.assertEqual(conf_b.scraper_host, 'other')
+		self.assertEqual(conf_b.scraper_username, 'other-user')
+		self.assertEqual(conf_b.scraper_password, 'password')
+		self.assertEqual(conf_a.env_state_file, 'state-a.pkl')
+		self.assertEqual(conf_b.env_state_file, 'state-b.pkl')
+		self.assertFalse(hasattr(conf_b, 'env_cookies_file'))
+
+	def test_bad_targets_refused(self):
+		bad_targets = [
+			[{'name': 'a'}, {'name': 'a'}],
+			[{'name': 'a', 'scraper_telegraf_destinations': {}}],
+			[{'name': 'a', 'env_state_file': 'state.pkl'}, {'name': 'b', 'env_state_file': 'state.pkl'}],
+			[{'scraper_host': 'other'}],
+			[]
+		]
+		for targets in bad_targets:
+			with self.subTest(targets=targets):
+				with self.assertRaises(util.ConfigException):
+					scrape.get_target_configs(_create_conf(scraper_targets=targets))
+
+	def test_problem_in_target_value_reported_against_target(self):
+		conf = _create_conf(scraper_targets=[{'name': 'a'}, {'name': 'b', 'scraper_endpoints': [{'endpoint': '/x'}]}])
+
+		with self.assertRaises(util.ConfigException) as ctx:
+			scrape.parse_config_targets(conf)
+
+		self.assertEqual(ctx.exception.key, "scraper_targets[1]['scraper_endpoints'][0]")
+
+
+class TargetGroupTest(TestCase):
+
+	def setUp(self):
+		tmp = tempfile.TemporaryDirectory()
+		self.addCleanup(tmp.cleanup)
+		self.state_file = os.path.join(tmp.name, 'state.db')
+		self.group = _create_group(self._conf())
+		self.addCleanup(self.group.cleanup)
+		self.agents = {}
+		for scraper in self.group.targets:
+			self.agents[scraper.name] = _FakeAgent({'/high': _PAGE, '/low': _PAGE, '/lower': _PAGE})
+			scraper._client = self.agents[scraper.name]
+
+	def _conf(self, **kwargs):
+		targets = kwargs.pop('scraper_targets', [
+			{'name': 'a'},
+			{'name': 'b', 'scraper_host': 'other', 'scraper_endpoints': [_endpoint_conf('/high', 1)]}
+		])
+		return _create_conf(env_state_file=self.state_file, scraper_targets=targets, **kwargs)
+
+	def test_endpoints_numbered_across_targets(self):
+		self.group.run_tick(_FakeClock(), [1, 3])
+
+		self.assertEqual([ep['endpoint'] for ep in self.group.endpoints], ['/high', '/low', '/lower', '/high'])
+		self.assertEqual(self.agents['a'].requested, ['/low'])
+		self.assertEqual(self.agents['b'].requested, ['/high'])
+
+	def test_outputs_and_pool_shared(self):
+		a, b = self.group.targets
+
+		self.assertIs(a._outputs, b._outputs)
+		self.assertIs(a._pool, b._pool)
+		self.assertEqual((a._pool_offset, b._pool_offset), (0, 3))
+
+	def test_stats_tagged_with_target(self):
+		group = _create_group(self._conf(scraper_stats_destination='stats'))
+		self.addCleanup(group.cleanup)
+		sent = []
+		for scraper in group.targets:
+			scraper._client = _FakeAgent({'/high': _PAGE, '/low': _PAGE, '/lower': _PAGE})
+			sent.append(_capture_bursts(scraper))
+
+		group.run_tick(_FakeClock())
+
+		self.assertEqual([b[3] for b in sent[1] if b[1] == 'pytelegrafhttp'], [{'target': 'b'}])
+		self.assertIn('targets', group.stats)
+
+	def test_targets_share_the_time_of_the_tick(self):
+		group = _create_group(self._conf(scraper_shed_priority=2))
+		self.addCleanup(group.cleanup)
+		a, b = group.targets
+		a._client = _SlowAgent({'/high': _PAGE, '/low': _PAGE, '/lower': _PAGE}, 0.1)
+		b._client = _FakeAgent({'/high': _PAGE})
+		b._endpoint_costs = {0: 0.3}
+
+		group.run_tick(_FakeClock(is_slow=True, speed=0.5))
+
+		# the first target took 0.3 seconds of the half-second tick, so the second one no longer has room for its
+		# endpoint
+		self.assertEqual(len(a._client.requested), 3)
+		self.assertEqual(b._client.requested, [])
+
+	def test_fatal_error_only_stops_its_target(self):
+		self.agents['a'].pages['/high'] = 'banned for excessive pageloads'
+
+		self.group.run_tick(_FakeClock(tick=1))
+		self.group.run_tick(_FakeClock(tick=2))
+
+		self.assertTrue(self.group.running)
+		self.assertEqual(self.agents['a'].requested, ['/high'])
+		self.assertEqual(self.agents['b'].requested, ['/high', '/high'])
+
+	def test_fatal_error_raised_with_one_target(self):
+		group = _create_group(self._conf(scraper_targets=[{'name': 'a'}]))
+		self.addCleanup(group.cleanup)
+		group.targets[0]._client = _FakeAgent({'/high': 'banned for excessive pageloads'})
+
+		with self.assertRaises(scrape.BotKickedError):
+			group.run_tick(_FakeClock(), [0])
+
+	def test_reload_keeps_remaining_targets(self):
+		a, b = self.group.targets
+
+		self.group.load_config(self._conf(scraper_targets=[{'name': 'a'}, {'name': 'c'}]))
+
+		self.assertIs(self.group.targets[0], a)
+		self.assertEqual([s.name for s in self.group.targets], ['a', 'c'])
+		self.assertTrue(os.path.exists(os.path.join(os.path.dirname(self.state_file), 'state-b.db')))
+
+
+_PAGE = '<p>verify</p><span>count: 12</span><span>slow: 7</span>'
+
+
+def _endpoint_conf(uri, priority):
+	return {
+		'endpoint': uri,
+		'verify-pattern': 'verify',
+		'priority': priority,
+		'metrics': [
+			{
+				'dest': 'main',
+				'name': 'counts',
+				'regex': [r'count: (\d+).*slow: (\d+)'],
+				'values': [
+					{'name': 'count', 'conversion': int, 'type': 'CAPTURE-1'},
+					{'name': 'slow', 'conversion': int, 'type': 'CAPTURE-2', 'priority': 0}
+				],
+				'tags': {},
+				'priority': 1
+			}
+		]
+	}
+
+
+def _create_conf(**kwargs):
+	conf = dict(
+		scraper_logged_out_pattern='requires you to log on',
+		scraper_bot_kicked_pattern='banned for excessive pageloads',
+		scraper_use_ssl=False,
+		scraper_host='localhost',
+		scraper_username='username',
+		scraper_password='password',
+		scraper_login_steps=[
+			('attempt', {'endpoint': '/login'}),
+			('verify', {'pattern': 'verify'})
+		],
+		scraper_endpoints=[_endpoint_conf('/high', 2), _endpoint_conf('/low', 0), _endpoint_conf('/lower', -1)],
+		scraper_telegraf_destinations={
+			'main': {'port': 10000, 'global-tags': {}},
+			'stats': {'port': 10001, 'global-tags': {}}
+		},
+		env_cookies_file='cookies.pkl',
+		env_state_file='state.pkl',
+		time_save_frequency=10,
+		log_full_http_responses=False,
+		log_full_http_requests=False
+	)
+	conf.update(kwargs)
+	return SimpleNamespace(**conf)
+
+
+def _create_scraper(**kwargs):
+	scraper = scrape.PageScraper(antiflood=False)
+	scraper.load_config(_create_conf(**kwargs))
+	scraper._logged_in = True
+	scraper._running = True
+	return scraper
+
+
+def _create_group(conf):
+	group = scrape.TargetGroup(antiflood=False)
+	group.load_config(conf)
+	for scraper in group.targets:
+		scraper._logged_in = True
+		scraper._running = True
+	group._needs_setup.clear()
+	group._running = True
+	return group
+
+
+def _fail_conversion(value):
+	raise ValueError("cannot convert " + repr(value))
+
+
+def _capture_bursts(scraper):
+	sent = []
+
+	def capture(channel, timestamp, metric, values, tags):
+		sent.append((channel, metric, values, tags))
+	scraper._send_metric_burst = capture
+	return sent
+
+
+class _FakeAgent(object):
+
+	def __init__(self, pages):
+		self.pages = pages
+		self.requested = []
+		self.host = 'localhost'
+		self.expiry = None
+		self.sessions = 0
+		self.payloads = []
+		self.cookie_jar = http.cookiejar.CookieJar()
+		self.session = _FakeSession()
+
+	def request(self, method, uri, host=None, query=None, payload=None, auth=False, **kwargs):
+		self.requested.append(uri)
+		self.payloads.append(payload)
+		page = self.pages[uri]
+		if isinstance(page, list):
+			page = page.pop(0) if len(page) > 1 else page[0]
+		if isinstance(page, Exception):
+			raise page
+		return 200, page
+
+	def start_new_session(self):
+		self.sessions += 1
+
+	def swap_session(self, session):
+		old_session = self.session
+		if session is None:
+			self.sessions += 1
+			session = _FakeSession()
+		self.session = session
+		return old_session
+
+	def copy_cookies(self):
+		return list(self.cookie_jar)
+
+	def cookie_expiry(self):
+		return self.expiry
+
+
+class _FakeSession(object):
+
+	def __init__(self):
+		self.closed = False
+
+	def close(self):
+		self.closed = True
+
+
+class _SlowAgent(_FakeAgent):
+	"""
+	Agent that takes a given number of seconds to give each page.
+	"""
+
+	def __init__(self, pages, delay):
+		super().__init__(pages)
+		self.delay = delay
+
+	def request(self, method, uri, host=None, query=None, payload=None, auth=False, **kwargs):
+		time.sleep(self.delay)
+		return super().request(method, uri)
+
+
+class _SessionAgent(_FakeAgent):
+	"""
+	Agent whose session expires after a given page is requested, until the login page is requested.
+	"""
+
+	def __init__(self, pages):
+		super().__init__(pages)
+		self._expire_after = set()
+		self._expire_again = set()
+		self._expired = False
+
+	def expire_after(self, uri, again=False):
+		if again:
+			self._expire_again.add(uri)
+		else:
+			self._expire_after.add(uri)
+
+	def request(self, method, uri, host=None, query=None, payload=None, auth=False, **kwargs):
+		if uri == '/login':
+			self._expired = False
+			return super().request(method, uri)
+		status, page = super().request(method, uri)
+		if uri in self._expire_again and not self._expired:
+			self._expire_again.discard(uri)
+			self._expired = True
+		if self._expired:
+			page = 'this page requires you to log on'
+		if uri in self._expire_after:
+			self._expire_after.discard(uri)
+			self._expired = True
+		return status, page
+
+
+class _FakeClock(object):
+
+	def __init__(self, tick=1, is_slow=False, lateness=0.0, speed=60.0):
+		self.tick = tick
+		self.time = datetime.now(timezone.utc)
+		self.is_slow = is_slow
+		self.lateness = timedelta(seconds=lateness)
+		self.speed = timedelta(seconds=speed)
+		self.lateness_stats = {'late-ticks': 0, 'missed-ticks': 0}
+
@@ -0,0 +1,91 @@
+from pytelegrafhttp import scrape, snapshot
+from unittest import TestCase
+import os
+import shutil
+import tempfile
+
+
+_EXAMPLE_CONFIG = os.path.join(os.path.dirname(__file__), '..', '..', 'config.example.py')
+
+
+class SnapshotTest(TestCase):
+
+	def setUp(self):
+		tmp = tempfile.TemporaryDirectory()
+		self.addCleanup(tmp.cleanup)
+		self.path = os.path.join(tmp.name, 'config.py')
+		shutil.copyfile(_EXAMPLE_CONFIG, self.path)
+		with open(self.path, 'a') as fp:
+			fp.write("\nenv_config_snapshot = True\n")
+
+	def test_unchanged_config_read_from_snapshot(self):
+		conf, parsed = snapshot.load(self.path)
+		self.assertIsNone(parsed)
+		expected = scrape.parse_config(conf)
+		self.assertTrue(snapshot.save(self.path, conf, expected))
+
+		conf, parsed = snapshot.load(self.path)
+
+		self.assertIsInstance(conf, snapshot.ConfigSnapshot)
+		self.assertEqual(conf.scraper_host, 'e-fancomics.org')
+		self.assertTrue(scrape._same_config(parsed, expected))
+		scraper = scrape.PageScraper(antiflood=False)
+		scraper.load_config(conf, parsed)
+		self.assertEqual(len(scraper.endpoints), 1)
+
+	def test_changed_config_executed(self):
+		conf, _ = snapshot.load(self.path)
+		snapshot.save(self.path, conf, scrape.parse_config(conf))
+		with open(self.path, 'a') as fp:
+			fp.write("\nscraper_host = 'example.com'\n")
+
+		conf, parsed = snapshot.load(self.path)
+
+		self.assertIsNone(parsed)
+		self.assertEqual(conf.scraper_host, 'example.com')
+
+	def test_changed_source_invalidates(self):
+		sample = os.path.join(os.path.dirname(self.path), 'sample.html')
+		with open(sample, 'w') as fp:
+			fp.write('<html></html>')
+		conf, _ = snapshot.load(self.path)
+		snapshot.save(self.path, conf, scrape.parse_config(conf), [sample])
+		with open(sample, 'w') as fp:
+			fp.write('<html><body></body></html>')
+
+		_, parsed = snapshot.load(self.path)
+
+		self.assertIsNone(parsed)
+
+	def test_unpicklable_config_not_saved(self):
+		with open(self.path, 'a') as fp:
+			fp.write("\nscraper_endpoints[0]['metrics'][0]['values'][0]['conversion'] = lambda x: int(x)\n")
+		conf, _ = snapshot.load(self.path)
+
+		self.assertFalse(snapshot.save(self.path, conf, scrape.parse_config(conf)))
+		self.assertFalse(os.path.exists(snapshot.get_snapshot_path(self.path)))
+
+	def test_disabled_snapshot_not_saved(self):
+		with open(self.path, 'a') as fp:
+			fp.write("\nenv_config_snapshot = False\n")
+		conf, _ = snapshot.load(self.path)
+
+		self.assertFalse(snapshot.save(self.path, conf, scrape.parse_config(conf)))
+
+	def test_not_saved_by_default(self):
+		conf = snapshot.exec_config(self.path)
+		del conf.env_config_snapshot
+
+		self.assertFalse(snapshot.save(self.path, conf, scrape.parse_config(conf)))
+		self.assertFalse(os.path.exists(snapshot.get_snapshot_path(self.path)))
+
+	def test_damaged_snapshot_ignored(self):
+		conf, _ = snapshot.load(self.path)
+		snapshot.save(self.path, conf, scrape.parse_config(conf))
+		with open(snapshot.get_snapshot_path(self.path), 'wb') as fp:
+			fp.write(b'not a snapshot')
+
+		conf, parsed = snapshot.load(self.path)
+
+		self.assertIsNone(parsed)
+		self.assertEqual(conf.scraper_host, 'e-fancomics.org')
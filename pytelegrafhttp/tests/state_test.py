@@ -0,0 +1,77 @@
+from pytelegrafhttp import state
+from unittest import TestCase
+import os
+import sqlite3
+import tempfile
+
+
+class StateStoreTest(TestCase):
+
+	def setUp(self):
+		tmp = tempfile.TemporaryDirectory()
+		self.addCleanup(tmp.cleanup)
+		self.path = os.path.join(tmp.name, 'state.db')
+
+	def test_values_read_back(self):
+		store = self._open()
+		store.set('login', 'logged-in', True)
+		store.set('clock', 'tick', 12)
+		store.flush()
+		store.close()
+
+		store = self._open()
+
+		self.assertEqual(store.get('login', 'logged-in'), True)
+		self.assertEqual(store.items('clock'), {'tick': 12})
+		self.assertTrue(state.is_database(self.path))
+
+	def test_only_changed_values_written(self):
+		store = self._open()
+		store.set('values', 'a', {'count': 1})
+		store.set('values', 'b', {'count': 2})
+		self.assertEqual(store.flush(), 2)
+
+		store.set('values', 'a', {'count': 1})
+		store.set('values', 'b', {'count': 3})
+
+		self.assertEqual(store.flush(), 1)
+		self.assertEqual(store.flush(), 0)
+
+	def test_replace_section_removes_missing(self):
+		store = self._open()
+		store.replace_section('cookies', {'a': 1, 'b': 2})
+		store.flush()
+
+		store.replace_section('cookies', {'b': 2})
+
+		self.assertEqual(store.flush(), 1)
+		store.close()
+		self.assertEqual(self._open().items('cookies'), {'b': 2})
+
+	def test_unflushed_values_not_written(self):
+		store = self._open()
+		store.set('login', 'logged-in', True)
+		store.close()
+
+		self.assertIsNone(self._open().get('login', 'logged-in'))
+
+	def test_wal_mode(self):
+		self._open()
+
+		conn = sqlite3.connect(self.path)
+		self.addCleanup(conn.close)
+		self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], 'wal')
+
+	def test_corrupt_file_moved_aside(self):
+		with open(self.path, 'wb') as f:
+			f.write(b'SQLite format 3\x00' + b'\xff' * 200)
+
+		store = self._open()
+
+		self.assertEqual(store.items('login'), {})
+		self.assertTrue(os.path.exists(self.path + '.corrupt'))
+
+	def _open(self):
+		store = state.StateStore(self.path)
+		self.addCleanup(store.close)
+		return store
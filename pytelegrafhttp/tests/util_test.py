@@ -0,0 +1,141 @@
+from pytelegrafhttp import util
+from unittest import TestCase
+from datetime import datetime, timezone
+
+
+class ParseSiteTimeTest(TestCase):
+
+	def setUp(self):
+		self.now = datetime(2018, 3, 1, 0, 4, 30, tzinfo=timezone.utc)
+
+	def test_today(self):
+		parsed = util.parse_site_time('Today, 0:02', self.now)
+
+		self.assertEqual(parsed, datetime(2018, 3, 1, 0, 2, tzinfo=timezone.utc))
+
+	def test_yesterday_across_month(self):
+		parsed = util.parse_site_time('Yesterday, 23:58', self.now)
+
+		self.assertEqual(parsed, datetime(2018, 2, 28, 23, 58, tzinfo=timezone.utc))
+
+	def test_absolute(self):
+		parsed = util.parse_site_time('2018-01-31 14:05', self.now)
+
+		self.assertEqual(parsed, datetime(2018, 1, 31, 14, 5, tzinfo=timezone.utc))
+
+	def test_absolute_date_only(self):
+		parsed = util.parse_site_time('2017-12-25', self.now)
+
+		self.assertEqual(parsed, datetime(2017, 12, 25, tzinfo=timezone.utc))
+
+	def test_unknown_format_falls_back(self):
+		parsed = util.parse_site_time('1 March 2018 00:01', self.now)
+
+		self.assertEqual(parsed, datetime(2018, 3, 1, 0, 1, tzinfo=timezone.utc))
+
+	def test_unrecognized(self):
+		with self.assertRaises(ValueError):
+			util.parse_site_time('not a time at all', self.now)
+
+
+class CheckOnlineTest(TestCase):
+
+	def setUp(self):
+		self.now = datetime(2018, 3, 1, 0, 4, 30, tzinfo=timezone.utc)
+
+	def test_online(self):
+		self.assertEqual(util.check_online('Yesterday, 23:59', max_minutes=6, now=self.now), 1)
+
+	def test_offline(self):
+		self.assertEqual(util.check_online('Yesterday, 23:58', max_minutes=6, now=self.now), 0)
+
+	def test_uses_tick_time(self):
+		with util.tick_time(self.now):
+			online = util.check_online('Today, 0:02', max_minutes=5)
+
+		self.assertEqual(online, 1)
+		self.assertIsNone(util._tick_now)
+
+
+class ConverterTest(TestCase):
+
+	def test_numbers(self):
+		self.assertEqual(util.get_converter('int')('612'), 612)
+		self.assertEqual(util.get_converter('int-commas')('61,234'), 61234)
+		self.assertEqual(util.get_converter('float')('2.45'), 2.45)
+		self.assertEqual(util.get_converter('float-commas')('1,002.5'), 1002.5)
+		self.assertEqual(util.get_converter('percent')('2.45 %'), 2.45)
+		self.assertEqual(util.get_converter('per-min')('2.6 / min'), 2.6)
+		self.assertEqual(util.get_converter('per-day')('1.0'), 1.0)
+
+	def test_online_within(self):
+		now = datetime(2018, 3, 1, 12, 0, tzinfo=timezone.utc)
+		conv = util.get_converter('online-within:5m')
+
+		with util.tick_time(now):
+			column = conv.convert_column(['Today, 11:56', 'Today, 11:54', 'Yesterday, 11:58'])
+
+		self.assertEqual(column, [1, 0, 0])
+
+	def test_online_within_repeated_values(self):
+		now = datetime(2018, 3, 1, 12, 0, tzinfo=timezone.utc)
+		conv = util.get_converter('online-within:5m')
+		values = ['Today, 11:56', 'Today, 11:54', 'Today, 11:56', 'Today, 11:54']
+
+		with util.tick_time(now):
+			column = conv.convert_column(values)
+			rows = [conv(v) for v in values]
+
+		self.assertEqual(column, [1, 0, 1, 0])
+		self.assertEqual(column, rows)
+
+	def test_column_matches_rows(self):
+		for spec in ('int', 'int-commas', 'float', 'float-commas', 'percent', 'per-min'):
+			with self.subTest(spec=spec):
+				conv = util.get_converter(spec)
+				values = ['1,200', '3', '45'] if 'commas' in spec else ['12', '3', '45']
+
+				self.assertEqual(list(conv.convert_column(values)), [conv(v) for v in values])
+
+	def test_online_within_requires_duration(self):
+		with self.assertRaises(ValueError):
+			util.get_converter('online-within')
+
+	def test_unknown(self):
+		with self.assertRaises(ValueError):
+			util.get_converter('roman-numerals')
+
+	def test_argument_not_taken(self):
+		with self.assertRaises(ValueError):
+			util.get_converter('int:5')
+
+	def test_picklable(self):
+		import pickle
+		conv = util.get_converter('online-within:30s')
+
+		restored = pickle.loads(pickle.dumps(conv))
+
+		self.assertEqual(restored, conv)
+		self.assertEqual(restored.spec, 'online-within:30s')
+
+
+class GetConfigStrTest(TestCase):
+
+	def test_value(self):
+		self.assertEqual(util.get_config_str(_Conf(host='example.com'), 'host'), 'example.com')
+
+	def test_missing_uses_default(self):
+		self.assertEqual(util.get_config_str(_Conf(), 'host', 'localhost'), 'localhost')
+
+	def test_missing_without_default(self):
+		with self.assertRaises(util.ConfigException):
+			util.get_config_str(_Conf(), 'host')
+
+	def test_none_when_optional(self):
+		self.assertIsNone(util.get_config_str(_Conf(host=None), 'host', None))
+
+
+class _Conf(object):
+
+	def __init__(self, **values):
+		self.__dict__.update(values)
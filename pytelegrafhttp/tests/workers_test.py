@@ -0,0 +1,92 @@
+from pytelegrafhttp import workers, scrape, util
+from pytelegrafhttp.endpoint import Endpoint
+from pytelegrafhttp.tests.endpoint_test import _create_body_text
+from unittest import TestCase
+import re
+
+
+class ExtractionPoolTest(TestCase):
+
+	def setUp(self):
+		self.pool = workers.ExtractionPool(2, 10)
+		self.addCleanup(self.pool.shutdown)
+		self.endpoints = scrape.parse_config_endpoints([{
+			'endpoint': '/hath',
+			'verify-pattern': 'F@H Miss% shows the percentage of requests',
+			'metrics': [
+				{
+					'dest': 'hath-net',
+					'name': 'hath-net',
+					'regex': [r'<td>(Global|Asia and Oceania)</td>.*?<td[^>]*>(\d+)</td>\s*</tr>'],
+					'values': [{'name': 'quality', 'conversion': 'int', 'type': 'CAPTURE-2'}],
+					'tags': {'region': 'CAPTURE-1'}
+				},
+				{
+					'dest': 'hath-health',
+					'name': 'hath-health',
+					'regex': [r'<td><a [^>]*>([^<]+)</a></td>\s*<td>(\d+)</td>'],
+					'values': [{'name': 'id', 'conversion': 'int', 'type': 'CAPTURE-2'}],
+					'tags': {'host': 'CAPTURE-1'}
+				}
+			]
+		}], '', lint_mode='off')
+		ep = self.endpoints[0]
+		self.endpoint = Endpoint(ep['endpoint'], ep['verify-pattern'], ep['sections'])
+		self.text = _create_body_text(dict(id='1', name='flandre'), dict(id='2', name='remilia'))
+
+	def test_same_bursts_as_in_process(self):
+		self.assertTrue(self.pool.start(self.endpoints, None))
+		metrics = self.endpoints[0]['metrics']
+
+		with util.tick_time(util.current_time()):
+			job = self.pool.submit(0, self.endpoint, metrics, self.text)
+			bursts = job.bursts()
+
+		expected = Endpoint('/hath', self.endpoints[0]['verify-pattern']).scrape_all_metrics(metrics, self.text)
+		self.assertEqual(bursts, expected)
+		self.assertEqual(len(bursts), 4)
+
+	def test_unpicklable_config_not_started(self):
+		self.endpoints[0]['metrics'][0]['values'][0]['conversion'] = lambda v: int(v)
+
+		with self.assertLogs('pytelegrafhttp.workers', 'WARNING'):
+			self.assertFalse(self.pool.start(self.endpoints, None))
+		self.assertFalse(self.pool.running)
+
+	def test_timeout_skips_metric(self):
+		self.endpoints[0]['metrics'][0]['regex'] = re.compile(r'(a+)+b(\d)')
+		self.pool = workers.ExtractionPool(1, 0.5)
+		self.addCleanup(self.pool.shutdown)
+		self.pool.start(self.endpoints, None)
+		text = 'F@H Miss% shows the percentage of requests ' + ('a' * 40)
+
+		with self.assertLogs('pytelegrafhttp.workers', 'ERROR'):
+			bursts = self.pool.submit(0, self.endpoint, self.endpoints[0]['metrics'], text).bursts()
+
+		self.assertEqual(bursts, [])
+		self.assertTrue(self.pool.running)
+
+	def test_cached_parse_reused_by_any_worker(self):
+		self.pool.start(self.endpoints, None)
+		metrics = self.endpoints[0]['metrics']
+
+		with util.tick_time(util.current_time()):
+			first = self.pool.submit(0, self.endpoint, metrics, self.text).bursts()
+			second = self.pool.submit(0, self.endpoint, metrics, self.text).bursts()
+
+		self.assertEqual(second, first)
+		self.assertEqual(self.endpoint.reused_count, 2)
+
+	def test_overruns_counted_across_workers(self):
+		self.endpoints[0]['metrics'][0]['regex'] = re.compile(r'(a+)+b(\d)')
+		self.endpoints[0]['metrics'][0]['time-budget'] = 0.05
+		self.endpoint.max_overruns = 2
+		self.pool.start(self.endpoints, None)
+		text = 'F@H Miss% shows the percentage of requests ' + ('a' * 40)
+
+		with self.assertLogs('pytelegrafhttp.endpoint', 'WARNING'):
+			for _ in range(2):
+				self.pool.submit(0, self.endpoint, self.endpoints[0]['metrics'], text).bursts()
+
+		self.assertEqual(self.endpoint.overrun_count, 2)
+		self.assertEqual(self.endpoint.disabled, {0})
@@ -1,9 +1,16 @@
 """
 Contains utility classes.
 """
+import array
+import datetime
+import functools
 import re
 
 
+# marker for config getters that have no default value, as None is a valid default.
+_NO_DEFAULT = object()
+
+
 class VerificationError(Exception):
 	"""
 	Raise when a page did not match the expected content.
@@ -33,26 +40,338 @@ class ConfigException(Exception):
 		super().__init__(msg)
 
 
+# reference time used for conversions in the current tick; None when not in a tick.
+_tick_now = None
+
+
+class tick_time(object):
+	"""
+	Context manager that sets the reference time used by conversions, such as check_online(), for the duration of a
+	tick. This makes every row of a scraped page be evaluated against the same time, and avoids getting the current
+	time once for every row.
+	"""
+
+	def __init__(self, now):
+		"""
+		:type now: ``datetime.datetime``
+		:param now: The reference time. Must be timezone-aware.
+		"""
+		self._now = now
+		self._prev = None
+
+	def __enter__(self):
+		global _tick_now
+		self._prev = _tick_now
+		_tick_now = self._now
+		return self._now
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		global _tick_now
+		_tick_now = self._prev
+		return False
+
+
+def current_time():
+	"""
+	Gets the reference time for conversions. This is the time set by tick_time() if currently in a tick, or the actual
+	current time otherwise.
+
+	:rtype: ``datetime.datetime``
+	:return: The reference time as a timezone-aware UTC datetime.
+	"""
+	if _tick_now is not None:
+		return _tick_now
+	return datetime.datetime.now(datetime.timezone.utc)
+
+
+_relative_time_pattern = re.compile(r'\s*(today|yesterday),?\s*(\d{1,2}):(\d{1,2})(?::(\d{1,2}))?\s*$', re.IGNORECASE)
+_absolute_time_pattern = re.compile(r'\s*(\d{4})-(\d{1,2})-(\d{1,2})(?:[ T,]+(\d{1,2}):(\d{1,2})(?::(\d{1,2}))?)?\s*$')
+
+
+def parse_site_time(time_str, now=None):
+	"""
+	Parses a time as shown on the H@H pages, such as "Today, 14:05", "Yesterday, 9:30", or "2018-01-31 14:05". Times
+	are assumed to be in UTC. Formats other than these are given to dateparser, which is much slower.
+
+	Results for the known formats are cached by string and date, so parsing the same string again on the same day is
+	cheap.
+
+	:type time_str: ``str``
+	:param time_str: The time to parse.
+	:type now: ``datetime.datetime``
+	:param now: The time that relative times such as "Today" are relative to. Defaults to current_time().
+	:rtype: ``datetime.datetime``
+	:return: The parsed time as a timezone-aware UTC datetime.
+	"""
+	if now is None:
+		now = current_time()
+	parsed = _parse_site_time_cached(time_str, now.astimezone(datetime.timezone.utc).date())
+	if parsed is None:
+		# unknown format; fall back to the generic parser. Not cached, as it could be relative to the exact time.
+		from dateparser import parse
+		settings = {
+			'TIMEZONE': 'UTC',
+			'RETURN_AS_TIMEZONE_AWARE': True,
+			'RELATIVE_BASE': now.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+		}
+		parsed = parse(time_str, languages=['en'], settings=settings)
+		if parsed is None:
+			raise ValueError("not a recognized time: " + repr(time_str))
+		parsed = parsed.astimezone(datetime.timezone.utc)
+	return parsed
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_site_time_cached(time_str, today):
+	m = _relative_time_pattern.match(time_str)
+	if m is not None:
+		day = today
+		if m.group(1).lower() == 'yesterday':
+			day -= datetime.timedelta(days=1)
+		secs = int(m.group(4)) if m.group(4) is not None else 0
+		tm = datetime.time(int(m.group(2)), int(m.group(3)), secs)
+		return datetime.datetime.combine(day, tm).replace(tzinfo=datetime.timezone.utc)
+
+	m = _absolute_time_pattern.match(time_str)
+	if m is not None:
+		parts = [int(g) if g is not None else 0 for g in m.groups()]
+		return datetime.datetime(*parts, tzinfo=datetime.timezone.utc)
+	return None
+
+
 # used for checking whether client is online based on last seen time.
 # returned value is given as a number.
-def check_online(last_seen_str, max_minutes):
-	from dateparser import parse
-	from datetime import datetime, timezone, timedelta
-	now = datetime.utcnow().replace(tzinfo=timezone.utc)
-	last_seen = parse(last_seen_str, languages=['en'], settings={'TIMEZONE': 'UTC', 'RETURN_AS_TIMEZONE_AWARE': True})
-	max_time = timedelta(minutes=max_minutes)
+def check_online(last_seen_str, max_minutes, now=None):
+	if now is None:
+		now = current_time()
+	last_seen = parse_site_time(last_seen_str, now)
+	max_time = datetime.timedelta(minutes=max_minutes)
 	return 1 if now - last_seen <= max_time else 0
 
 
-def get_config_regex(conf, var_name):
+class Converter(object):
+	"""
+	A named conversion of captured text into a metric value. Unlike a lambda given in the config file, a Converter can
+	be pickled, compared, and applied to a whole column of captured values at once.
+
+	Converters are created from their names with get_converter(). Subclasses set the name that they are registered
+	under and implement convert(value), which converts a single captured value.
+	"""
+
+	name = None
+
+	takes_arg = False
+	"""Whether the converter is given an argument after a colon in its name."""
+
+	time_dependent = False
+	"""Whether the result depends on the current time as well as the captured text."""
+
+	def __init__(self, arg=None):
+		"""
+		Creates a new Converter.
+
+		:type arg: ``str``
+		:param arg: The argument given after the colon in the converter name, if any.
+		"""
+		if arg is not None and not self.takes_arg:
+			raise ValueError("converter " + repr(self.name) + " does not take an argument, but was given " + repr(arg))
+		self.arg = arg
+
+	def convert_column(self, values):
+		"""
+		Converts every captured value of a column.
+
+		:type values: ``list[str]``
+		:param values: The captured text of each row.
+		:rtype: ``list[Any]``
+		:return: The converted values, in the same order.
+		"""
+		return list(map(self.convert, values))
+
+	@property
+	def spec(self):
+		"""
+		The full name of this converter, including its argument, as given to get_converter().
+		:rtype: ``str``
+		"""
+		if self.arg is None:
+			return self.name
+		return self.name + ':' + self.arg
+
+	def __call__(self, value):
+		return self.convert(value)
+
+	def __eq__(self, other):
+		return type(self) is type(other) and self.arg == other.arg
+
+	def __hash__(self):
+		return hash((type(self), self.arg))
+
+	def __repr__(self):
+		return "get_converter(" + repr(self.spec) + ")"
+
+
+class _IntConverter(Converter):
+	name = 'int'
+
+	convert = staticmethod(int)
+
+	def convert_column(self, values):
+		return list(map(int, values))
+
+
+class _IntCommasConverter(Converter):
+	name = 'int-commas'
+
+	def convert(self, value):
+		return int(value.replace(',', ''))
+
+	def convert_column(self, values):
+		return list(map(int, _strip_all(values, ',')))
+
+
+class _FloatConverter(Converter):
+	name = 'float'
+
+	convert = staticmethod(float)
+
+	def convert_column(self, values):
+		return array.array('d', map(float, values))
+
+
+class _FloatCommasConverter(Converter):
+	name = 'float-commas'
+
+	def convert(self, value):
+		return float(value.replace(',', ''))
+
+	def convert_column(self, values):
+		return array.array('d', map(float, _strip_all(values, ',')))
+
+
+class _PercentConverter(Converter):
+	name = 'percent'
+
+	def convert(self, value):
+		return float(value.strip().rstrip('%'))
+
+
+class _RateConverter(Converter):
+	"""Converts rates such as '2.6 / min' by dropping the unit."""
+
+	def convert(self, value):
+		return float(value.split('/', 1)[0])
+
+
+class _PerMinConverter(_RateConverter):
+	name = 'per-min'
+
+
+class _PerDayConverter(_RateConverter):
+	name = 'per-day'
+
+
+class _OnlineWithinConverter(Converter):
+	name = 'online-within'
+	takes_arg = True
+	time_dependent = True
+
+	def __init__(self, arg=None):
+		if arg is None:
+			raise ValueError("'online-within' requires a duration, such as 'online-within:5m'")
+		super().__init__(arg)
+		self._max_minutes = _parse_duration(arg) / 60.0
+
+	def convert(self, value):
+		return check_online(value, max_minutes=self._max_minutes)
+
+	def convert_column(self, values):
+		# the last-seen times of most clients are the same handful of strings, so each is only checked once
+		now = current_time()
+		results = {v: check_online(v, self._max_minutes, now=now) for v in set(values)}
+		return list(map(results.__getitem__, values))
+
+
+_converter_types = {c.name: c for c in (
+	_IntConverter,
+	_IntCommasConverter,
+	_FloatConverter,
+	_FloatCommasConverter,
+	_PercentConverter,
+	_PerMinConverter,
+	_PerDayConverter,
+	_OnlineWithinConverter
+)}
+
+
+def get_converter(spec):
+	"""
+	Gets a converter by its name. The supported converters are:
+
+	* 'int' - An integer, such as '612'.
+	* 'int-commas' - An integer that may contain thousands separators, such as '61,234'.
+	* 'float' - A real number, such as '2.45'.
+	* 'float-commas' - A real number that may contain thousands separators.
+	* 'percent' - A real number with an optional percent sign, such as '2.45 %'.
+	* 'per-min' and 'per-day' - A rate with an optional unit, such as '2.6 / min'.
+	* 'online-within:DURATION' - 1 if a last-seen time such as 'Today, 12:30' is within DURATION of the current
+	time, otherwise 0. DURATION is a number followed by 's', 'm', or 'h', such as '5m'.
+
+	:type spec: ``str``
+	:param spec: The name of the converter, followed by a colon and its argument if it takes one.
+	:rtype: ``Converter``
+	:return: The converter.
+	"""
+	if ':' in spec:
+		name, arg = spec.split(':', 1)
+	else:
+		name, arg = spec, None
+	try:
+		conv_type = _converter_types[name.strip().lower()]
+	except KeyError:
+		raise ValueError("unknown converter: " + repr(spec))
+	return conv_type(arg)
+
+
+def _strip_all(values, chars):
+	"""
+	Removes a string from every value of a column. This is done on all of the values joined together, which is much
+	faster than doing it on each value for large columns.
+	"""
+	joined = '\0'.join(values)
+	if chars not in joined:
+		return values
+	stripped = joined.replace(chars, '').split('\0')
+	if len(stripped) != len(values):
+		# a value contained the separator; do it the slow way
+		return [v.replace(chars, '') for v in values]
+	return stripped
+
+
+def _parse_duration(duration):
+	"""
+	Parses a duration such as '30s', '5m', or '2h' into a number of seconds. A number with no unit is in minutes.
+	"""
+	m = re.match(r'\s*(\d+(?:\.\d+)?)\s*([smh]?)\s*$', duration, re.IGNORECASE)
+	if m is None:
+		raise ValueError("not a valid duration: " + repr(duration))
+	mult = {'s': 1, 'm': 60, 'h': 3600, '': 60}[m.group(2).lower()]
+	return float(m.group(1)) * mult
+
+
+def get_config_regex(conf, var_name, default=_NO_DEFAULT):
 	"""
 	Gets a config value as a regex pattern. Must be given as a string in the config file.
 
 	:param conf: The config module to read.
 	:param var_name: The name of the config variable.
+	:param default: The value to return if the config variable is not defined. If not given, a missing variable
+	causes a ConfigException to be raised.
 	:rtype: re.__Regex
 	:return: The config value.
 	"""
+	if default is not _NO_DEFAULT and not hasattr(conf, var_name):
+		return default
 	var_val = get_config_str(conf, var_name)
 	try:
 		var_val = re.compile(var_val, re.DOTALL)
@@ -61,18 +380,22 @@ def get_config_regex(conf, var_name):
 	return var_val
 
 
-def get_config_int(conf, var_name):
+def get_config_int(conf, var_name, default=_NO_DEFAULT):
 	"""
 	Gets a config value as an integer value.
 
 	:param conf: The config module to read.
 	:param var_name: The name of the config variable.
+	:param default: The value to return if the config variable is not defined. If not given, a missing variable
+	causes a ConfigException to be raised.
 	:rtype: int
 	:return: The config value.
 	"""
 	try:
 		var_val = getattr(conf, var_name)
 	except AttributeError:
+		if default is not _NO_DEFAULT:
+			return default
 		raise ConfigException("Missing config definition", var_name)
 	try:
 		var_val = int(var_val)
@@ -81,18 +404,22 @@ def get_config_int(conf, var_name):
 	return var_val
 
 
-def get_config_float(conf, var_name):
+def get_config_float(conf, var_name, default=_NO_DEFAULT):
 	"""
 	Gets a config value as a floating-point precision value.
 
 	:param conf: The config module to read.
 	:param var_name: The name of the config variable.
+	:param default: The value to return if the config variable is not defined. If not given, a missing variable
+	causes a ConfigException to be raised.
 	:rtype: float
 	:return: The config value.
 	"""
 	try:
 		var_val = getattr(conf, var_name)
 	except AttributeError:
+		if default is not _NO_DEFAULT:
+			return default
 		raise ConfigException("Missing config definition", var_name)
 	try:
 		var_val = float(var_val)
@@ -101,18 +428,22 @@ def get_config_float(conf, var_name):
 	return var_val
 
 
-def get_config_bool(conf, var_name):
+def get_config_bool(conf, var_name, default=_NO_DEFAULT):
 	"""
 	Gets a config value as a boolean value.
 
 	:param conf: The config module to read.
 	:param var_name: The name of the config variable.
+	:param default: The value to return if the config variable is not defined. If not given, a missing variable
+	causes a ConfigException to be raised.
 	:rtype: bool
 	:return: The config value.
 	"""
 	try:
 		var_val = getattr(conf, var_name)
 	except AttributeError:
+		if default is not _NO_DEFAULT:
+			return default
 		raise ConfigException("Missing config definition", var_name)
 	try:
 		var_val = bool(var_val)
@@ -121,19 +452,25 @@ def get_config_bool(conf, var_name):
 	return var_val
 
 
-def get_config_str(conf, var_name):
+def get_config_str(conf, var_name, default=_NO_DEFAULT):
 	"""
 	Gets a config value as a string.
 
 	:param conf: The config module to read.
 	:param var_name: The name of the config variable.
+	:param default: The value to return if the config variable is not defined. If not given, a missing variable
+	causes a ConfigException to be raised. If given as None, the variable may also be set to None to leave it unset.
 	:rtype: str
 	:return: The config value.
 	"""
 	try:
 		var_val = getattr(conf, var_name)
 	except AttributeError:
+		if default is not _NO_DEFAULT:
+			return default
 		raise ConfigException("Missing config definition", var_name)
+	if var_val is None and default is None:
+		return None
 	try:
 		var_val = str(var_val)
 	except ValueError:
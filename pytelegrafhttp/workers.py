@@ -0,0 +1,261 @@
+"""
+Pool of worker processes that extract metrics from endpoint pages. Regex searches hold the GIL, so extraction in a
+single process can only ever use one core; with a pool, the metrics of a page, and the pages of several endpoints, are
+extracted in parallel.
+"""
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+import logging
+import pickle
+import signal
+import time
+from .endpoint import Endpoint, Burst
+from . import util
+
+try:
+	from multiprocessing import shared_memory
+except ImportError:
+	# before python 3.8; page text is sent to the workers with each task instead
+	shared_memory = None
+
+_log = logging.getLogger(__name__)
+_log.setLevel(logging.DEBUG)
+
+# the endpoints that a worker process extracts from, as (Endpoint, metrics) tuples. Set once when the worker starts.
+_worker_endpoints = None
+
+
+class ExtractionPool(object):
+	"""
+	Extracts the metrics of endpoint pages in a pool of worker processes. The parsed endpoints are sent to each worker
+	once, when it is started, and the text of each page is given to the workers through shared memory where it is
+	supported. Each metric of a page is extracted as a separate task.
+
+	Any worker can get any task, so the workers keep nothing about the metrics between tasks. The parse cache, overrun
+	counts, and disabled metrics are all kept by the Endpoint in this process, which is sent what it needs with each
+	task and records each result.
+	"""
+
+	def __init__(self, workers, timeout):
+		"""
+		Creates a new ExtractionPool. No processes are started until start() is called.
+
+		:type workers: ``int``
+		:param workers: The number of worker processes.
+		:type timeout: ``float``
+		:param timeout: The number of seconds to wait for all of the metrics of a page to be extracted.
+		"""
+		self._workers = workers
+		self._timeout = timeout
+		self._executor = None
+		self._init_args = None
+
+	def start(self, endpoints, time_budget):
+		"""
+		Starts the worker processes for the given endpoints. If the pool is already running, it is stopped first.
+
+		:type endpoints: ``list[dict[str, Any]]``
+		:param endpoints: The parsed endpoints.
+		:type time_budget: ``float``
+		:param time_budget: The default time budget of each metric, as given to Endpoint.
+		:rtype: ``bool``
+		:return: Whether the pool was started. It cannot be if the endpoints cannot be sent to other processes, such as
+		when a conversion is a lambda.
+		"""
+		self.shutdown()
+		init_args = (endpoints, time_budget)
+		try:
+			pickle.dumps(init_args)
+		except (pickle.PicklingError, AttributeError, TypeError) as e:
+			_log.warning("Endpoint config cannot be sent to extraction workers (" + str(e) + "); extracting in-process")
+			return False
+		self._init_args = init_args
+		self._executor = concurrent.futures.ProcessPoolExecutor(
+			max_workers=self._workers, initializer=_init_worker, initargs=init_args
+		)
+		_log.debug("Started extraction pool with " + str(self._workers) + " worker(s)")
+		return True
+
+	def submit(self, endpoint_idx, endpoint, metrics, text, min_priority=None):
+		"""
+		Starts extracting every metric of a page.
+
+		:type endpoint_idx: ``int``
+		:param endpoint_idx: The index of the endpoint that the page is from.
+		:type endpoint: ``Endpoint``
+		:param endpoint: The Endpoint of the page in this process. It has already verified the page, and the results
+		of the workers are recorded in it.
+		:type metrics: ``list[dict[str, Any]]``
+		:param metrics: The parsed metrics of the endpoint.
+		:type text: ``str``
+		:param text: The text of the page.
+		:type min_priority: ``int``
+		:param min_priority: If given, metrics and values with a priority below this are skipped.
+		:rtype: ``PageJob``
+		:return: The job, which gives the bursts once they are extracted.
+		"""
+		page = _PageText(text)
+		futures = []
+		try:
+			for metric_idx, m in enumerate(metrics):
+				if metric_idx in endpoint.disabled or (min_priority is not None and m['priority'] < min_priority):
+					continue
+				known_hash = endpoint.cached_hash(metric_idx, min_priority) if m['reusable'] else None
+				args = (endpoint_idx, metric_idx, page.ref, min_priority, known_hash, util.current_time())
+				futures.append((metric_idx, self._executor.submit(_extract_metric, *args)))
+		except BaseException:
+			page.close()
+			raise
+		return PageJob(self, endpoint, metrics, min_priority, page, futures, time.monotonic() + self._timeout)
+
+	def restart(self):
+		"""
+		Stops all worker processes, including any that are still busy, and starts new ones.
+		"""
+		if self._executor is None:
+			return
+		_log.warning("Restarting extraction pool")
+		# a busy worker will never see a request to stop, so it has to be terminated
+		for proc in list(getattr(self._executor, '_processes', {}).values()):
+			proc.terminate()
+		self._executor.shutdown(wait=False)
+		self._executor = concurrent.futures.ProcessPoolExecutor(
+			max_workers=self._workers, initializer=_init_worker, initargs=self._init_args
+		)
+
+	def shutdown(self):
+		"""
+		Stops all worker processes.
+		"""
+		if self._executor is not None:
+			self._executor.shutdown(wait=True)
+			self._executor = None
+
+	@property
+	def running(self):
+		"""
+		:rtype: ``bool``
+		:return: Whether the worker processes have been started.
+		"""
+		return self._executor is not None
+
+
+class PageJob(object):
+	"""
+	The extraction of every metric of a single page by an ExtractionPool.
+	"""
+
+	def __init__(self, pool, endpoint, metrics, min_priority, page, futures, deadline):
+		self._pool = pool
+		self._endpoint = endpoint
+		self._metrics = metrics
+		self._min_priority = min_priority
+		self._page = page
+		self._futures = futures
+		self._deadline = deadline
+
+	def close(self):
+		"""
+		Abandons any metrics that have not been extracted yet and frees the page text.
+		"""
+		for metric_idx, future in self._futures:
+			future.cancel()
+		self._page.close()
+
+	def bursts(self):
+		"""
+		Waits for every metric to be extracted and gives the bursts. A metric that could not be extracted in time is
+		skipped, and the pool is restarted so that it does not hold up later pages.
+
+		:rtype: ``list[Burst]``
+		:return: The bursts of all metrics, in the same order that Endpoint.scrape_all_metrics() gives them.
+		"""
+		bursts = []
+		try:
+			for metric_idx, future in self._futures:
+				try:
+					result = future.result(timeout=max(0, self._deadline - time.monotonic()))
+				except concurrent.futures.TimeoutError:
+					_log.error(
+						"Extraction of metric " + str(metric_idx) + " for endpoint '" + self._endpoint.uri + "' timed out"
+					)
+					self._pool.restart()
+					break
+				except BrokenProcessPool:
+					# the pool was restarted while this page was waiting
+					_log.error("Extraction workers for endpoint '" + self._endpoint.uri + "' stopped; skipping")
+					break
+				text_hash, metric_bursts, overran, elapsed = result
+				if metric_bursts is not None:
+					metric_bursts = [Burst(*b) for b in metric_bursts]
+				metric = self._metrics[metric_idx]
+				bursts += self._endpoint.record_extraction(
+					metric, metric_idx, self._min_priority, text_hash, metric_bursts, overran, elapsed
+				)
+		finally:
+			self._page.close()
+		return bursts
+
+
+class _PageText(object):
+	"""
+	The text of a page, shared with the worker processes. Workers are given ref, which is either the name and size of a
+	block of shared memory that holds the text encoded as UTF-8, or the text itself if shared memory is not supported.
+	"""
+
+	def __init__(self, text):
+		self._shm = None
+		if shared_memory is None:
+			self.ref = ('text', text)
+			return
+		data = text.encode('utf-8')
+		self._shm = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+		self._shm.buf[:len(data)] = data
+		self.ref = ('shm', self._shm.name, len(data))
+
+	def close(self):
+		if self._shm is not None:
+			self._shm.close()
+			self._shm.unlink()
+			self._shm = None
+
+
+def _init_worker(endpoints, time_budget):
+	global _worker_endpoints
+	# the handlers of the main process are inherited when workers are forked; interrupts and reloads are for the main
+	# process to handle, and it shuts the workers down itself, but a worker should still stop when it is terminated
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	if hasattr(signal, 'SIGHUP'):
+		signal.signal(signal.SIGHUP, signal.SIG_IGN)
+	signal.signal(signal.SIGTERM, signal.SIG_DFL)
+	_worker_endpoints = []
+	for ep in endpoints:
+		endpoint = Endpoint(ep['endpoint'], ep['verify-pattern'], ep['sections'], time_budget)
+		_worker_endpoints.append((endpoint, ep['metrics']))
+
+
+def _read_page(ref):
+	if ref[0] == 'text':
+		return ref[1]
+	shm = shared_memory.SharedMemory(name=ref[1])
+	try:
+		return bytes(shm.buf[:ref[2]]).decode('utf-8')
+	finally:
+		shm.close()
+
+
+def _extract_metric(endpoint_idx, metric_idx, page_ref, min_priority, known_hash, now):
+	"""
+	Extracts a single metric of a page in a worker process. Conversions are done relative to the given time, so that
+	they match those done in the main process during the same tick.
+
+	:return: What Endpoint.extract_metric() gives, with the bursts as tuples.
+	"""
+	endpoint, metrics = _worker_endpoints[endpoint_idx]
+	text = _read_page(page_ref)
+	with util.tick_time(now):
+		result = endpoint.extract_metric(metrics[metric_idx], metric_idx, text, min_priority, known_hash)
+	text_hash, bursts, overran, elapsed = result
+	if bursts is not None:
+		bursts = [(b.channel, b.metric, b.values, b.tags) for b in bursts]
+	return text_hash, bursts, overran, elapsed
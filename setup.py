@@ -26,7 +26,7 @@ setup(
 	keywords='telegraf metrics http.py',
 	packages=['pytelegrafhttp'],
 	install_requires=['pytelegraf', 'requests', 'dateparser'],
-	python_requires='>=3.3',
+	python_requires='>=3.7',
 	extras_require={
 		'systemd-logs': ['systemd-python']
 	},